@@ -0,0 +1,215 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.template.response import SimpleTemplateResponse
+from rest_framework import exceptions, generics
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from api.authentication import CachedJWTAuthentication, cached_user_entry
+from api.fieldsets import SparseFieldsetMixin
+from api.cache import acache_response, filter_params, order_scopes, product_scopes
+from api.views import OrderViewSet, ProductDetailAPIView, ProductListCreateAPIView
+
+
+class AsyncGenericAPIView(generics.GenericAPIView):
+    """
+    GenericAPIView with an async dispatch, for read-only endpoints served
+    under ASGI.
+
+    Authentication, permissions, content negotiation, filter backends and
+    pagination come from the usual class attributes. JWT and session
+    authentication and the ORM calls in the handlers use their async APIs;
+    other authenticators run through sync_to_async. Responses are rendered
+    here, so Django doesn't hop to a thread to render them. The middleware
+    around the view still costs thread hops: api's own middleware runs on the
+    event loop, but Django's MiddlewareMixin-based ones call their
+    process_request/process_response hooks through sync_to_async.
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if hasattr(response, '__await__'):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.render_response(request, self.response)
+
+    async def ainitial(self, request, *args, **kwargs):
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        neg = self.perform_content_negotiation(request)
+        request.accepted_renderer, request.accepted_media_type = neg
+        version, scheme = self.determine_version(request, *args, **kwargs)
+        request.version, request.versioning_scheme = version, scheme
+
+        await self.aperform_authentication(request)
+        self.check_permissions(request)
+        self.check_throttles(request)
+
+    async def aperform_authentication(self, request):
+        for authenticator in request.authenticators:
+            if isinstance(authenticator, JWTAuthentication):
+                result = await self.jwt_authenticate(authenticator, request)
+            elif isinstance(authenticator, SessionAuthentication):
+                # safe methods only, so no CSRF check is needed
+                user = await request._request.auser()
+                result = (user, None) if user and user.is_active else None
+            else:
+                result = await sync_to_async(authenticator.authenticate)(request)
+            if result is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = result
+                return
+        request._not_authenticated()
+
+    @staticmethod
+    async def jwt_authenticate(authenticator, request):
+        # JWTAuthentication.authenticate with the user looked up through the async cache/ORM
+        header = authenticator.get_header(request)
+        if header is None:
+            return None
+        raw_token = authenticator.get_raw_token(header)
+        if raw_token is None:
+            return None
+        token = authenticator.get_validated_token(raw_token)
+        if isinstance(authenticator, CachedJWTAuthentication):
+            return await authenticator.aget_user(token), token
+
+        user_id = CachedJWTAuthentication.get_user_id(token)
+        try:
+            user = await authenticator.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except authenticator.user_model.DoesNotExist:
+            raise exceptions.AuthenticationFailed('User not found', code='user_not_found')
+        CachedJWTAuthentication.check_user(cached_user_entry(user), token)
+        return user, token
+
+    def render_response(self, request, response):
+        """Render a DRF response and return it as a plain HttpResponse."""
+        if not isinstance(response, SimpleTemplateResponse):
+            return response
+        if not response.is_rendered:
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+        rendered = HttpResponse(response.content, status=response.status_code)
+        for header, value in response.items():
+            rendered[header] = value
+        return rendered
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, ValueError, TypeError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        paginator = self.paginator
+        page = None
+        if paginator is not None and hasattr(paginator, 'apaginate_queryset'):
+            page = await paginator.apaginate_queryset(queryset, request, view=self)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        compiled = self.compiled_serializer_class(context=self.get_serializer_context())
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, JSONRenderer):
+            return Response(await compiled.aserialize(queryset))
+        # streamed a chunk at a time, like StreamingListModelMixin on the sync views
+        return StreamingHttpResponse(
+            self.astream_json(compiled, queryset, renderer), content_type=renderer.media_type,
+        )
+
+    async def astream_json(self, compiled, queryset, renderer):
+        renderer_context = self.get_renderer_context()
+        yield b'['
+        separator = b''
+        async for data in compiled.aiter_chunks(queryset):
+            # render the chunk as a list and drop the surrounding brackets
+            body = renderer.render(data, renderer.media_type, renderer_context)
+            yield separator + body[1:-1]
+            separator = b','
+        yield b']'
+
+
+class AsyncProductListAPIView(SparseFieldsetMixin, AsyncGenericAPIView):
+    queryset = ProductListCreateAPIView.queryset
+    serializer_class = ProductListCreateAPIView.serializer_class
+    compiled_serializer_class = ProductListCreateAPIView.compiled_serializer_class
+    filterset_class = ProductListCreateAPIView.filterset_class
+    filter_backends = ProductListCreateAPIView.filter_backends
+    search_fields = ProductListCreateAPIView.search_fields
+    ordering_fields = ProductListCreateAPIView.ordering_fields
+    pagination_class = ProductListCreateAPIView.pagination_class
+    permission_classes = []
+
+    @acache_response(60 * 15, key_prefix='product_list', scopes=product_scopes)
+    async def get(self, request):
+        return await self.alist(request)
+
+
+class AsyncProductDetailAPIView(SparseFieldsetMixin, AsyncGenericAPIView):
+    queryset = ProductDetailAPIView.queryset
+    serializer_class = ProductDetailAPIView.serializer_class
+    lookup_url_kwarg = ProductDetailAPIView.lookup_url_kwarg
+    permission_classes = []
+
+    @acache_response(60 * 15, key_prefix='product_detail', scopes=product_scopes)
+    async def get(self, request, product_id):
+        product = await self.aget_object()
+        return Response(self.get_serializer(product).data)
+
+
+class AsyncOrderMixin(SparseFieldsetMixin):
+    queryset = OrderViewSet.queryset
+    field_querysets = OrderViewSet.field_querysets
+    serializer_class = OrderViewSet.serializer_class
+    compiled_serializer_class = OrderViewSet.compiled_serializer_class
+    permission_classes = OrderViewSet.permission_classes
+    filterset_class = OrderViewSet.filterset_class
+    filter_backends = OrderViewSet.filter_backends
+    pagination_class = OrderViewSet.pagination_class
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if not self.request.user.is_staff:
+            qs = qs.filter(user=self.request.user)
+        return qs
+
+
+class AsyncOrderListAPIView(AsyncOrderMixin, AsyncGenericAPIView):
+    @acache_response(60 * 15, key_prefix='order_list', scopes=order_scopes, params=filter_params, etag=True)
+    async def get(self, request):
+        return await self.alist(request)
+
+
+class AsyncOrderDetailAPIView(AsyncOrderMixin, AsyncGenericAPIView):
+    lookup_url_kwarg = 'pk'
+
+    @acache_response(60 * 15, key_prefix='order_detail', scopes=order_scopes, etag=True)
+    async def get(self, request, pk):
+        order = await self.aget_object()
+        return Response(self.get_serializer(order).data)
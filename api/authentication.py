@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from api.cache import async_cache
+
+
+# what a request needs from an authenticated user without a query; other
+# fields (password hash included) are never cached and load on first access
+CACHED_USER_FIELDS = ('id', 'is_active', 'is_staff', 'is_superuser')
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    invalidate_cached_users([user_id])
+
+
+def invalidate_cached_users(user_ids):
+    """
+    Drop the cached entries of users, again once the surrounding transaction
+    commits so a request can't re-cache the pre-commit row in between.
+    """
+    keys = [user_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def cached_user_entry(user):
+    entry = {name: getattr(user, name) for name in CACHED_USER_FIELDS}
+    # what the revoke claim of the user's tokens is compared with
+    entry['password_hash'] = get_md5_hash_password(user.password)
+    return entry
+
+
+def user_from_entry(user_model, entry):
+    """The cached user, with every field outside CACHED_USER_FIELDS deferred."""
+    names = [field.attname for field in user_model._meta.concrete_fields if field.attname in entry]
+    return user_model.from_db(user_model.objects.db, names, [entry[name] for name in names])
+
+
+class TokenCache:
+    """
+    Bounded LRU of raw token -> validated token, so a client reusing its
+    access token skips the signature check. Entries live ``ttl`` seconds and
+    never past the token's own expiry.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, raw_token):
+        with self.lock:
+            entry = self.entries.get(raw_token)
+            if entry is None:
+                return None
+            token, expires = entry
+            if expires <= time.time():
+                del self.entries[raw_token]
+                return None
+            self.entries.move_to_end(raw_token)
+            return token
+
+    def set(self, raw_token, token):
+        expires = min(time.time() + settings.JWT_TOKEN_CACHE_TTL, token.get('exp', 0))
+        with self.lock:
+            self.entries[raw_token] = (token, expires)
+            self.entries.move_to_end(raw_token)
+            while len(self.entries) > settings.JWT_TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without a signature check or a user query per request.
+
+    Validated tokens are kept in this process's ``token_cache``; the
+    CACHED_USER_FIELDS of users and a digest of their password hash are read
+    from the shared cache for JWT_USER_CACHE_TIMEOUT seconds, and dropped from
+    it whenever a user is saved, deleted (api.signals) or bulk updated
+    (api.models.UserQuerySet), so deactivation and password changes apply to
+    the next request. The active and revoked-token checks still run on every
+    request.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = token_cache.get(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            token_cache.set(raw_token, token)
+        return token
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        entry = cache.get(user_cache_key(user_id))
+        if entry is not None:
+            self.check_user(entry, validated_token)
+            return user_from_entry(self.user_model, entry)
+        try:
+            user = self.user_model.objects.get(**{jwt_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise exceptions.AuthenticationFailed('User not found', code='user_not_found')
+        entry = cached_user_entry(user)
+        cache.set(user_cache_key(user_id), entry, settings.JWT_USER_CACHE_TIMEOUT)
+        self.check_user(entry, validated_token)
+        return user
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        entry = await async_cache.get(user_cache_key(user_id))
+        if entry is not None:
+            self.check_user(entry, validated_token)
+            return user_from_entry(self.user_model, entry)
+        try:
+            user = await self.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise exceptions.AuthenticationFailed('User not found', code='user_not_found')
+        entry = cached_user_entry(user)
+        await async_cache.set(user_cache_key(user_id), entry, settings.JWT_USER_CACHE_TIMEOUT)
+        self.check_user(entry, validated_token)
+        return user
+
+    @staticmethod
+    def get_user_id(validated_token):
+        try:
+            return validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+    @staticmethod
+    def check_user(entry, validated_token):
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not entry['is_active']:
+            raise exceptions.AuthenticationFailed('User is inactive', code='user_inactive')
+        if jwt_settings.CHECK_REVOKE_TOKEN and \
+                validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != entry['password_hash']:
+            raise exceptions.AuthenticationFailed(
+                "The user's password has been changed.", code='password_changed'
+            )
@@ -0,0 +1,129 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger('api.budget')
+# the QueryUsages recording in the current context; a ContextVar rather than
+# per-connection wrappers so that async code's ORM calls, which run on
+# another thread's connection, are counted too
+_usages = ContextVar('query_usages', default=())
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def count_queries(execute, sql, params, many, context):
+    """execute_wrapper on every connection, see ``install_query_counter``."""
+    usages = _usages.get()
+    if not usages:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for usage in usages:
+            usage.queries += 1
+            usage.db_time += elapsed
+
+
+def install_query_counter(connection):
+    # connection_created fires again on every reconnect of the same wrapper
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class QueryUsage:
+    """Counts the queries made while recording, and the time spent in them."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def record(self):
+        # restored by value: a streamed body may be consumed in another context
+        previous = _usages.get()
+        _usages.set((*previous, self))
+        try:
+            yield
+        finally:
+            _usages.set(previous)
+
+    @property
+    def db_time_ms(self):
+        return self.db_time * 1000
+
+    @property
+    def duration_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+class QueryBudgetMixin:
+    """
+    Declares how many queries, how much DB time and how much wall time a
+    request to this view may use.
+
+    Usage is reported in the ``X-Query-Budget`` header and logged on the
+    ``api.budget`` logger, as a warning when over budget. With
+    ``QUERY_BUDGET_ENFORCE = True`` going over budget raises
+    QueryBudgetExceeded, so N+1s fail CI; the test runner also sets
+    ``QUERY_BUDGET_ENFORCE_TIMINGS = False``, which leaves the machine
+    dependent time budgets to the log. Streamed responses are measured until
+    the last chunk is sent and are only logged.
+
+    ``method_max_queries`` maps HTTP methods to their own query budget, for
+    writes that legitimately cost more than the reads ``max_queries`` is sized for.
+    """
+    max_queries = None
+    method_max_queries = {}
+    max_db_time_ms = None
+    max_duration_ms = None
+
+    def get_query_budget(self):
+        max_queries = self.method_max_queries.get(self.request.method, self.max_queries)
+        return max_queries, self.max_db_time_ms, self.max_duration_ms
+
+    def dispatch(self, request, *args, **kwargs):
+        usage = QueryUsage()
+        with usage.record():
+            response = super().dispatch(request, *args, **kwargs)
+
+        if response.streaming:
+            response.streaming_content = self.measure_stream(response.streaming_content, usage, request)
+        else:
+            response['X-Query-Budget'] = self.check_query_budget(usage, request)
+        return response
+
+    def measure_stream(self, content, usage, request):
+        with usage.record():
+            yield from content
+        self.check_query_budget(usage, request)
+
+    def check_query_budget(self, usage, request):
+        max_queries, max_db_time_ms, max_duration_ms = self.get_query_budget()
+        report = '; '.join([
+            f'queries={usage.queries}/{max_queries or "-"}',
+            f'db={usage.db_time_ms:.1f}/{max_db_time_ms or "-"}ms',
+            f'total={usage.duration_ms:.1f}/{max_duration_ms or "-"}ms',
+        ])
+        too_many_queries = max_queries is not None and usage.queries > max_queries
+        too_slow = (
+            (max_db_time_ms is not None and usage.db_time_ms > max_db_time_ms)
+            or (max_duration_ms is not None and usage.duration_ms > max_duration_ms)
+        )
+        message = f'{self.__class__.__name__} {request.method} {request.path}: {report}'
+        if not (too_many_queries or too_slow):
+            logger.info(message)
+            return report
+
+        logger.warning('query budget exceeded: %s', message)
+        if getattr(settings, 'QUERY_BUDGET_ENFORCE', False) and (
+                too_many_queries or getattr(settings, 'QUERY_BUDGET_ENFORCE_TIMINGS', True)):
+            raise QueryBudgetExceeded(message)
+        return report
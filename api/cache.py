@@ -0,0 +1,373 @@
+import asyncio
+import functools
+import hashlib
+import time
+import weakref
+
+import redis.asyncio
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import urlencode
+
+from api.fieldsets import FIELDS_PARAM, OMIT_PARAM
+
+VERSION_KEY_PREFIX = 'version'
+VERSION_TIMEOUT = None
+
+
+def version_key(scope):
+    return f'{VERSION_KEY_PREFIX}:{scope}'
+
+
+def bumped_key(scope):
+    return f'replica:bumped:{scope}'
+
+
+def recently_bumped(scopes):
+    """
+    Whether any of ``scopes`` was bumped in the last REPLICA_STICKY_SECONDS,
+    i.e. replicas may not have caught up with the write behind it yet.
+    """
+    return bool(cache.get_many([bumped_key(scope) for scope in scopes]))
+
+
+def get_versions(scopes):
+    """Current generation of every scope, creating missing ones."""
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # start from the clock so an evicted counter never reuses old generations
+            cache.add(key, time.time_ns(), VERSION_TIMEOUT)
+            versions[key] = cache.get(key)
+    return [str(versions[key]) for key in keys]
+
+
+def bump_version(*scopes):
+    """
+    Invalidate everything cached under ``scopes`` in O(1) per scope.
+
+    Entries are never deleted: their keys embed the old generation and simply
+    stop being read, then expire on their own timeout. The bump is repeated
+    once the surrounding transaction commits, so responses cached by other
+    requests from pre-commit data are dropped too.
+    """
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def reset_versions(scopes):
+    """
+    bump_version for bulk loads running outside a transaction: each scope
+    gets a fresh generation, all in one ``set_many`` rather than an
+    ``incr`` per scope, and nothing is repeated on commit.
+    """
+    generation = time.time_ns()
+    cache.set_many({version_key(scope): generation for scope in scopes}, VERSION_TIMEOUT)
+    if getattr(settings, 'DATABASE_REPLICAS', []):
+        cache.set_many({bumped_key(scope): True for scope in scopes}, settings.REPLICA_STICKY_SECONDS)
+
+
+async def aget_versions(scopes):
+    keys = [version_key(scope) for scope in scopes]
+    versions = await async_cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            await async_cache.add(key, time.time_ns(), VERSION_TIMEOUT)
+            versions[key] = await async_cache.get(key)
+    return [str(versions[key]) for key in keys]
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), VERSION_TIMEOUT)
+    if getattr(settings, 'DATABASE_REPLICAS', []):
+        # see api.replicas.ReplicaReadMixin.replica_scopes
+        cache.set_many({bumped_key(scope): True for scope in scopes}, settings.REPLICA_STICKY_SECONDS)
+
+
+def cache_response(timeout, key_prefix, scopes, params=None, etag=False, max_size=1024 * 1024):
+    """
+    Cache a DRF view handler's rendered response under versioned keys.
+
+    ``scopes`` is a list of scope names or a callable taking
+    ``(view, request, **kwargs)`` and returning one. Bumping any of them with
+    ``bump_version`` makes every response cached under the old generation
+    unreachable. Streaming responses are cached as they are sent, unless the
+    body grows past ``max_size`` bytes.
+
+    ``params`` is an optional callable ``(view, request)`` returning the query
+    parameters that affect the response; by default the full query string is
+    part of the key. With ``etag=True`` the key doubles as a strong ETag, so a
+    matching ``If-None-Match`` is answered with 304 before the cache or the
+    database is touched.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return handler(view, request, *args, **kwargs)
+
+            names = scopes(view, request, **kwargs) if callable(scopes) else scopes
+            query = params(view, request) if params else None
+            key = response_cache_key(key_prefix, request, names, get_versions(names), query)
+            tag = f'"{hashlib.md5(key.encode()).hexdigest()}"' if etag else None
+
+            if tag and tag in parse_etags(request.headers.get('If-None-Match', '')):
+                response = HttpResponseNotModified()
+                response['ETag'] = tag
+                response['X-Cache'] = 'HIT'
+                return response
+
+            cached = cache.get(key)
+            if cached is not None:
+                response = HttpResponse(
+                    cached['content'], status=cached['status'], content_type=cached['content_type']
+                )
+                response['X-Cache'] = 'HIT'
+            else:
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                response['X-Cache'] = 'MISS'
+                if response.streaming:
+                    response.streaming_content = tee_to_cache(
+                        response.streaming_content, key, response, timeout, max_size
+                    )
+                else:
+                    response.add_post_render_callback(
+                        lambda rendered: store(key, rendered, rendered.content, timeout)
+                    )
+
+            if tag:
+                response['ETag'] = tag
+                # per-user data: never shared by proxies, always revalidated by clients
+                response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def acache_response(timeout, key_prefix, scopes, params=None, etag=False, max_size=1024 * 1024):
+    """
+    cache_response for the async views in api.async_views. Entries are
+    versioned by the same scopes, so product and order writes invalidate them
+    too; all cache calls go through ``async_cache``.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(view, request, *args, **kwargs):
+            names = scopes(view, request, **kwargs) if callable(scopes) else scopes
+            query = params(view, request) if params else None
+            key = response_cache_key(key_prefix, request, names, await aget_versions(names), query)
+            tag = f'"{hashlib.md5(key.encode()).hexdigest()}"' if etag else None
+
+            if tag and tag in parse_etags(request.headers.get('If-None-Match', '')):
+                response = HttpResponseNotModified()
+                response['ETag'] = tag
+                response['X-Cache'] = 'HIT'
+                return response
+
+            cached = await async_cache.get(key)
+            if cached is not None:
+                response = HttpResponse(
+                    cached['content'], status=cached['status'], content_type=cached['content_type']
+                )
+                response['X-Cache'] = 'HIT'
+            else:
+                response = await handler(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                response['X-Cache'] = 'MISS'
+                if response.streaming:
+                    response.streaming_content = atee_to_cache(
+                        response.streaming_content, key, response, timeout, max_size
+                    )
+                else:
+                    view.render_response(request, response)
+                    await astore(key, response, response.content, timeout)
+
+            if tag:
+                response['ETag'] = tag
+                response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def response_cache_key(key_prefix, request, scopes, versions, query=None):
+    renderer = getattr(request, 'accepted_renderer', None)
+    if query is None:
+        target = request.get_full_path()
+    else:
+        target = f'{request.path}?{urlencode(query)}'
+    return ':'.join([
+        'response', key_prefix, getattr(renderer, 'format', ''),
+        *(f'{scope}={version}' for scope, version in zip(scopes, versions)),
+        hashlib.md5(target.encode()).hexdigest(),
+    ])
+
+
+def parse_etags(header):
+    if header.strip() == '*':
+        return {'*'}
+    return {tag.strip().removeprefix('W/') for tag in header.split(',') if tag.strip()}
+
+
+def filter_params(view, request):
+    """
+    Normalized query parameters for a list view: only those read by its
+    filterset, search/ordering filters, paginator and sparse fieldsets,
+    sorted, blanks dropped.
+    """
+    names = {FIELDS_PARAM, OMIT_PARAM}
+    filterset_class = getattr(view, 'filterset_class', None)
+    if filterset_class is not None:
+        names.update(filterset_class.base_filters)
+    for backend in getattr(view, 'filter_backends', []):
+        names.update(
+            getattr(backend, attr) for attr in ('search_param', 'ordering_param')
+            if hasattr(backend, attr)
+        )
+    paginator = getattr(view, 'paginator', None)
+    for attr in ('cursor_query_param', 'page_query_param', 'page_size_query_param',
+                 'limit_query_param', 'offset_query_param'):
+        if getattr(paginator, attr, None):
+            names.add(getattr(paginator, attr))
+    return sorted(
+        (name, value)
+        for name in names
+        for value in request.query_params.getlist(name)
+        if value != ''
+    )
+
+
+def store(key, response, content, timeout):
+    cache.set(key, {
+        'content': content,
+        'status': response.status_code,
+        'content_type': response['Content-Type'],
+    }, timeout)
+
+
+async def astore(key, response, content, timeout):
+    await async_cache.set(key, {
+        'content': content,
+        'status': response.status_code,
+        'content_type': response['Content-Type'],
+    }, timeout)
+
+
+async def atee_to_cache(chunks, key, response, timeout, max_size):
+    body, size = [], 0
+    async for chunk in chunks:
+        if body is not None:
+            size += len(chunk)
+            if size > max_size:
+                body = None
+            else:
+                body.append(chunk)
+        yield chunk
+    if body is not None:
+        await astore(key, response, b''.join(body), timeout)
+
+
+def tee_to_cache(chunks, key, response, timeout, max_size):
+    body, size = [], 0
+    for chunk in chunks:
+        if body is not None:
+            size += len(chunk)
+            if size > max_size:
+                body = None
+            else:
+                body.append(chunk)
+        yield chunk
+    if body is not None:
+        store(key, response, b''.join(body), timeout)
+
+
+class AsyncCache:
+    """
+    The default cache for async code.
+
+    django-redis has no async API (Django's a* cache methods run the sync
+    client in a thread), so for redis this talks to the server through
+    redis.asyncio, with the client's own key and value encoding so entries are
+    shared with the sync cache. Other backends use Django's async methods.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        # one pool per event loop: asyncio connections can't cross loops
+        self.pools = weakref.WeakKeyDictionary()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def is_redis(self):
+        return settings.CACHES[self.alias]['BACKEND'] == 'django_redis.cache.RedisCache'
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        pool = self.pools.get(loop)
+        if pool is None:
+            location = settings.CACHES[self.alias]['LOCATION']
+            pool = self.pools[loop] = redis.asyncio.ConnectionPool.from_url(location, **settings.REDIS_POOL)
+        return redis.asyncio.Redis(connection_pool=pool)
+
+    async def get(self, key):
+        if not self.is_redis:
+            return await self.cache.aget(key)
+        value = await self.client().get(self.cache.client.make_key(key))
+        return None if value is None else self.cache.client.decode(value)
+
+    async def get_many(self, keys):
+        if not self.is_redis:
+            return await self.cache.aget_many(keys)
+        values = await self.client().mget([self.cache.client.make_key(key) for key in keys])
+        return {
+            key: self.cache.client.decode(value)
+            for key, value in zip(keys, values) if value is not None
+        }
+
+    async def set(self, key, value, timeout):
+        if not self.is_redis:
+            return await self.cache.aset(key, value, timeout)
+        await self.client().set(
+            self.cache.client.make_key(key), self.cache.client.encode(value),
+            px=None if timeout is None else int(timeout * 1000),
+        )
+
+    async def add(self, key, value, timeout):
+        if not self.is_redis:
+            return await self.cache.aadd(key, value, timeout)
+        return bool(await self.client().set(
+            self.cache.client.make_key(key), self.cache.client.encode(value),
+            nx=True, px=None if timeout is None else int(timeout * 1000),
+        ))
+
+
+async_cache = AsyncCache()
+
+
+# scopes used by the views and bumped from api.signals
+
+def product_scopes(view, request, **kwargs):
+    if 'product_id' in kwargs:
+        return [f"product:{kwargs['product_id']}"]
+    return ['product']
+
+
+def order_scopes(view, request, **kwargs):
+    # orders embed product names and prices (bumped as 'catalog', unlike stock
+    # changes), and are only visible to their owner or staff
+    owner = 'order' if request.user.is_staff else f'order:user:{request.user.pk}'
+    return ['catalog', owner]
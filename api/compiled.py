@@ -0,0 +1,185 @@
+from itertools import chain, islice
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject, PrimaryKeyRelatedField
+from rest_framework.response import Response
+
+
+class CompiledSerializer:
+    """
+    Read-only fast path for a ModelSerializer.
+
+    The serializer's declared fields are turned once per class into a flat
+    list of ``values_list()`` columns and per-column converters, so list
+    endpoints render straight from database tuples instead of model instances.
+    The field objects' own ``to_representation`` is reused for every value, so
+    the output is identical to ``serializer_class(queryset, many=True).data``.
+
+    - ``expressions`` maps field names backed by model properties to a query
+      expression computing the same value in the database.
+    - ``nested`` maps ``many=True`` nested serializer fields to the compiled
+      serializer used for the reverse relation.
+    - SerializerMethodFields are called with a lightweight row object and can
+      only use the queryset's annotations and ``expressions``.
+    """
+    serializer_class = None
+    expressions = {}
+    nested = {}
+    chunk_size = 2000
+
+    def __init__(self, context=None):
+        self.serializer = self.serializer_class(context=context or {})
+        self.columns = []
+        self.plan = []
+        self.compiled = False
+
+    def compile(self, queryset):
+        model = queryset.model
+        annotations = queryset.query.annotations
+
+        for name, field in self.serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                self.plan.append((name, 'nested', self.compile_nested(model, name, field)))
+            elif isinstance(field, serializers.SerializerMethodField):
+                if name not in annotations and name not in self.expressions:
+                    raise ImproperlyConfigured(
+                        f'{self.__class__.__name__} cannot compile `{name}`: '
+                        'annotate the queryset or add it to `expressions`.'
+                    )
+                method = getattr(self.serializer, field.method_name)
+                self.plan.append((name, 'method', (self.add_column(name), method)))
+            elif name in self.expressions:
+                self.plan.append((name, 'value', (self.add_column(name), field.to_representation)))
+            elif isinstance(field, serializers.BaseSerializer) or field.source == '*':
+                raise ImproperlyConfigured(
+                    f'{self.__class__.__name__} cannot compile `{name}`.'
+                )
+            else:
+                path = '__'.join(field.source_attrs)
+                if isinstance(field, PrimaryKeyRelatedField):
+                    convert = lambda value, field=field: field.to_representation(PKOnlyObject(value))
+                else:
+                    convert = field.to_representation
+                self.plan.append((name, 'value', (self.add_column(path), convert)))
+
+        self.compiled = True
+
+    def compile_nested(self, model, name, field):
+        compiled_class = self.nested.get(name)
+        if compiled_class is None:
+            raise ImproperlyConfigured(
+                f'{self.__class__.__name__} has no compiled serializer for `{name}`.'
+            )
+        relation = model._meta.get_field(field.source)
+        child = compiled_class(context=self.serializer.context)
+        queryset = relation.related_model._default_manager.order_by('pk')
+        child.compile(queryset)
+        return relation.field, child, queryset
+
+    def add_column(self, path):
+        self.columns.append(path)
+        return len(self.columns) - 1
+
+    def values(self, queryset, *leading):
+        extra = {name: expr for name, expr in self.expressions.items() if name in self.columns}
+        if extra:
+            queryset = queryset.annotate(**extra)
+        return queryset.values_list(*leading, *self.columns)
+
+    def serialize(self, queryset):
+        return list(chain.from_iterable(self.iter_chunks(queryset)))
+
+    def iter_chunks(self, queryset):
+        """Yield the serialized rows in lists of at most ``chunk_size``."""
+        queryset = queryset.prefetch_related(None)
+        if not self.compiled:
+            self.compile(queryset)
+        rows = self.values(queryset, 'pk').iterator(chunk_size=self.chunk_size)
+
+        while chunk := list(islice(rows, self.chunk_size)):
+            children = self.fetch_children([row[0] for row in chunk])
+            yield [self.render(row[1:], children, row[0]) for row in chunk]
+
+    async def aserialize(self, queryset):
+        """serialize() through the async ORM, for async views."""
+        return [row async for chunk in self.aiter_chunks(queryset) for row in chunk]
+
+    async def aiter_chunks(self, queryset):
+        """iter_chunks() through the async ORM, for async views."""
+        queryset = queryset.prefetch_related(None)
+        if not self.compiled:
+            self.compile(queryset)
+        # QuerySet.aiterator() runs values_list() queries on the event loop,
+        # so the sync iterator is advanced a chunk at a time on the ORM's thread
+        rows = self.values(queryset, 'pk').iterator(chunk_size=self.chunk_size)
+        next_chunk = sync_to_async(lambda: list(islice(rows, self.chunk_size)))
+        while chunk := await next_chunk():
+            yield await self.arender_chunk(chunk)
+
+    async def arender_chunk(self, chunk):
+        children = {}
+        for name, child, rows in self.child_rows([row[0] for row in chunk]):
+            children[name] = child.group([row async for row in rows])
+        return [self.render(row[1:], children, row[0]) for row in chunk]
+
+    def fetch_children(self, pks):
+        # one query per nested relation per chunk, grouped by the parent key
+        return {name: child.group(rows) for name, child, rows in self.child_rows(pks)}
+
+    def child_rows(self, pks):
+        for name, kind, step in self.plan:
+            if kind != 'nested':
+                continue
+            fk, child, queryset = step
+            if child.nested:
+                raise ImproperlyConfigured('Compiled serializers support one level of nesting.')
+            yield name, child, child.values(queryset.filter(**{f'{fk.name}__in': pks}), fk.attname)
+
+    def group(self, rows):
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(row[0], []).append(self.render(row[1:]))
+        return grouped
+
+    def render(self, row, children=None, pk=None):
+        ret = {}
+        for name, kind, step in self.plan:
+            if kind == 'value':
+                index, convert = step
+                value = row[index]
+                ret[name] = None if value is None else convert(value)
+            elif kind == 'nested':
+                ret[name] = children[name].get(pk, [])
+            else:
+                index, method = step
+                ret[name] = method(SimpleNamespace(**{self.columns[index]: row[index]}))
+        return ret
+
+
+class CompiledListModelMixin:
+    """
+    Opt-in list() that renders through ``compiled_serializer_class``.
+
+    Filtering, permissions and pagination are unchanged; paginated pages are
+    already loaded as instances and go through the regular serializer.
+    """
+    compiled_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.compiled_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        compiled = self.compiled_serializer_class(context=self.get_serializer_context())
+        return Response(compiled.serialize(queryset))
+
@@ -0,0 +1,77 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from api.fieldsets import FIELDS_PARAM, OMIT_PARAM
+
+VALIDATORS_TIMEOUT = 60 * 60
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The resource has been modified since you last fetched it.'
+    default_code = 'precondition_failed'
+
+
+def validators_key(pk):
+    return f'product:validators:{pk}'
+
+
+def product_validators(pk):
+    """
+    ``(version, updated_at timestamp)`` of a product, or None if it doesn't
+    exist. Cached, so conditional GETs can be answered without the database.
+    """
+    # imported here so api.models can import this module
+    from api.models import Product
+
+    validators = cache.get(validators_key(pk))
+    if validators is None:
+        row = Product.objects.filter(pk=pk).values_list('version', 'updated_at').first()
+        if row is None:
+            return None
+        validators = (row[0], int(row[1].timestamp()))
+        cache.set(validators_key(pk), validators, VALIDATORS_TIMEOUT)
+    return validators
+
+
+def invalidate_product_validators(*pks):
+    """
+    Drop the cached validators of products, again once the surrounding
+    transaction commits so a conditional GET can't re-cache the pre-commit
+    version in between.
+    """
+    keys = [validators_key(pk) for pk in pks]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def product_etag(request, pk, version):
+    # the representation differs per renderer and fieldset, so the (strong) tag does too
+    renderer = getattr(request, 'accepted_renderer', None)
+    tag = f'product-{pk}-v{version}-{getattr(renderer, "format", "")}'
+    fieldset = [(param, value) for param in (FIELDS_PARAM, OMIT_PARAM) for value in request.GET.getlist(param)]
+    if fieldset:
+        tag += '-' + hashlib.md5(repr(fieldset).encode()).hexdigest()[:12]
+    return f'"{tag}"'
+
+
+def not_modified_response(request, etag, last_modified):
+    """The 304 answer to a conditional GET/HEAD, or None to serve the product."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None and response.status_code == status.HTTP_412_PRECONDITION_FAILED:
+        raise PreconditionFailed()
+    if response is not None:
+        # answered from the cached validators, counted as a hit by api.metrics
+        response['X-Cache'] = 'HIT'
+    return response
+
+
+def check_write_preconditions(request, etag, last_modified):
+    """Raise PreconditionFailed unless If-Match / If-Unmodified-Since hold."""
+    if get_conditional_response(request, etag=etag, last_modified=last_modified) is not None:
+        raise PreconditionFailed()
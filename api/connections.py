@@ -0,0 +1,103 @@
+import threading
+from collections import Counter
+
+import redis
+from django.conf import settings
+from django.db import connections
+from django_redis.pool import ConnectionFactory
+from kombu.transport import redis as kombu_redis
+
+_redis_pools = {}
+_redis_pools_lock = threading.Lock()
+# new database connections per alias since the process started
+connections_opened = Counter()
+
+
+def get_redis_pool(url=None):
+    """
+    The process-wide redis connection pool for ``url`` (REDIS_URL by default),
+    sized by ``settings.REDIS_POOL``.
+    """
+    url = url or settings.REDIS_URL
+    pool = _redis_pools.get(url)
+    if pool is None:
+        with _redis_pools_lock:
+            pool = _redis_pools.get(url)
+            if pool is None:
+                pool = _redis_pools[url] = redis.ConnectionPool.from_url(url, **settings.REDIS_POOL)
+    return pool
+
+
+class SharedConnectionFactory(ConnectionFactory):
+    """django-redis connection factory handing out the shared pools."""
+
+    def get_or_create_connection_pool(self, params):
+        return get_redis_pool(params['url'])
+
+
+class SharedPoolChannel(kombu_redis.Channel):
+    """
+    Publishes through the shared REDIS_URL pool, so the Celery producer in a
+    web process borrows the cache's connections. The worker's asynchronous
+    consumer keeps kombu's own pool.
+    """
+
+    def _get_pool(self, asynchronous=False):
+        pool = super()._get_pool(asynchronous=asynchronous)
+        if asynchronous:
+            return pool
+        return get_redis_pool()
+
+    def _disconnect_pools(self):
+        # don't close connections that are shared with the cache
+        if self._pool is get_redis_pool():
+            self._pool = None
+        super()._disconnect_pools()
+
+
+class SharedPoolTransport(kombu_redis.Transport):
+    Channel = SharedPoolChannel
+
+
+def record_connection(alias):
+    connections_opened[alias] += 1
+
+
+def connection_stats():
+    """Persistent connection and pool usage for every database and redis pool."""
+    databases = {}
+    for alias in connections:
+        conn = connections[alias]
+        stats = {
+            'vendor': conn.vendor,
+            'conn_max_age': conn.settings_dict['CONN_MAX_AGE'],
+            'health_checks': conn.settings_dict['CONN_HEALTH_CHECKS'],
+            'connected': conn.connection is not None,
+            'opened': connections_opened[alias],
+        }
+        pool = getattr(conn, 'pool', None)
+        if pool is not None:
+            pool_stats = pool.get_stats()
+            in_use = pool_stats['pool_size'] - pool_stats['pool_available']
+            stats['pool'] = {
+                'max_size': pool.max_size,
+                'size': pool_stats['pool_size'],
+                'in_use': in_use,
+                'waiting': pool_stats.get('requests_waiting', 0),
+                'saturation': in_use / pool.max_size,
+            }
+        databases[alias] = stats
+
+    pools = {}
+    for pool in list(_redis_pools.values()):
+        # no credentials from the url
+        kwargs = pool.connection_kwargs
+        name = f"{kwargs.get('host', kwargs.get('path'))}:{kwargs.get('port', '')}/{kwargs.get('db', 0)}"
+        in_use = len(pool._in_use_connections)
+        pools[name] = {
+            'max_size': pool.max_connections,
+            'size': pool._created_connections,
+            'in_use': in_use,
+            'saturation': in_use / pool.max_connections,
+        }
+    return {'databases': databases, 'redis': pools}
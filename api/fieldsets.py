@@ -0,0 +1,97 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def selected_fields(request, names):
+    """
+    The subset of the serializer field ``names`` asked for with
+    ``?fields=a,b`` and/or ``?omit=c``, or None when the request has neither.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    params = request.query_params
+    if FIELDS_PARAM not in params and OMIT_PARAM not in params:
+        return None
+
+    requested = {
+        param: [name.strip() for value in params.getlist(param) for name in value.split(',') if name.strip()]
+        for param in (FIELDS_PARAM, OMIT_PARAM)
+    }
+    names = set(names)
+    errors = {
+        param: [f'Unknown field: {name}.' for name in requested[param] if name not in names]
+        for param in requested
+    }
+    if any(errors.values()):
+        raise ValidationError({param: messages for param, messages in errors.items() if messages})
+    return set(requested[FIELDS_PARAM] or names) - set(requested[OMIT_PARAM])
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    Drops the fields not asked for with ``?fields=``/``?omit=`` on reads, for
+    the top-level serializer of a request (nested ones render in full).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        kept = selected_fields(self.context.get('request'), self.fields)
+        if kept is not None:
+            for name in list(self.fields):
+                if name not in kept:
+                    self.fields.pop(name)
+
+
+class SparseFieldsetMixin:
+    """
+    Plans a view's queryset around the fields its serializer will render.
+
+    With ``?fields=``/``?omit=`` only the columns of the rendered fields are
+    loaded. ``field_querysets`` maps serializer fields to the name of a
+    queryset method adding what that field alone needs (an annotation, a
+    prefetch); each method is applied once, when any of its fields is rendered.
+    """
+    field_querysets = {}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.rendered_fields()
+        methods = dict.fromkeys(
+            method for name, method in self.field_querysets.items() if fields is None or name in fields
+        )
+        for method in methods:
+            queryset = getattr(queryset, method)()
+        if fields is not None:
+            columns = self.field_columns(queryset.model, fields)
+            if columns is not None:
+                queryset = queryset.only(*columns)
+        return queryset
+
+    def rendered_fields(self):
+        params = self.request.query_params
+        if self.request.method not in SAFE_METHODS or (FIELDS_PARAM not in params and OMIT_PARAM not in params):
+            return None
+        return self.get_serializer().fields
+
+    def field_columns(self, model, fields):
+        """Model fields to load for ``fields``, or None when that can't be told."""
+        columns = []
+        for name, field in fields.items():
+            if name in self.field_querysets:
+                continue
+            if not field.source_attrs:
+                # source='*' or a method field reading the whole instance
+                return None
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                # a property, its columns are unknown
+                return None
+            # many-to-many and reverse relations are read by their own queries
+            if model_field.concrete and not model_field.many_to_many:
+                columns.append(model_field.name)
+        return columns
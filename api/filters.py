@@ -1,7 +1,31 @@
+import datetime
+
 import django_filters
+from django.utils import timezone
 from rest_framework import filters
 from api.models import Order, Product
 
+
+class DayFilter(django_filters.DateFilter):
+    """
+    Matches a datetime field against a whole day as a half-open range,
+    ``start <= field < next day``, in the current time zone. Unlike a
+    ``__date`` lookup this compares the raw column, so the index on it is used.
+    """
+
+    def filter(self, qs, value):
+        if value in django_filters.constants.EMPTY_VALUES:
+            return qs
+        start = timezone.make_aware(datetime.datetime.combine(value, datetime.time.min))
+        end = start + datetime.timedelta(days=1)
+        if self.distinct:
+            qs = qs.distinct()
+        return self.get_method(qs)(**{
+            f'{self.field_name}__gte': start,
+            f'{self.field_name}__lt': end,
+        })
+
+
 class ProductFilter(django_filters.FilterSet):
     class Meta:
         model = Product
@@ -13,8 +37,8 @@ class ProductFilter(django_filters.FilterSet):
     # url will use a __ instead of a a _ 
 
 class OrderFilter(django_filters.FilterSet):
-    # overrode the default date filter to use the date field and not the datetime
-    created_at = django_filters.DateFilter(field_name='created_at__date')  
+    # overrode the default date filter to match the whole day and not the exact datetime
+    created_at = DayFilter(field_name='created_at')
     class Meta:
         model = Order
         fields = {
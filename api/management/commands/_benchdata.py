@@ -0,0 +1,36 @@
+import random
+from decimal import Decimal
+
+from django.utils import lorem_ipsum
+
+from api.models import Order, OrderItem, Product, User
+
+
+def add_data_arguments(parser):
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=3, help='items per order')
+
+
+def create_data(options, username):
+    """
+    Synthetic products, orders and items for the bench_* commands, sized by
+    the ``add_data_arguments`` options; callers roll them back when done.
+    """
+    rng = random.Random(0)
+    user = User.objects.create_user(username=username)
+    paragraph = lorem_ipsum.paragraph()
+    Product.objects.bulk_create(
+        Product(
+            name=f'Bench product {i}', description=paragraph,
+            price=Decimal(rng.randint(100, 50000)) / 100, stock=rng.randint(0, 20),
+        )
+        for i in range(options['products'])
+    )
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    orders = Order.objects.bulk_create(Order(user=user) for _ in range(options['orders']))
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product_id=rng.choice(product_ids), quantity=rng.randint(1, 5))
+        for order in orders
+        for _ in range(options['items'])
+    )
@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import RequestFactory
+
+from api.connections import connections_opened
+
+
+class Command(BaseCommand):
+    help = 'Compares request latency with per-request and persistent database connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/users/', help='endpoint to request')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        configured = connection.settings_dict['CONN_MAX_AGE']
+        # the full WSGI stack, which closes or keeps the connection on request_finished
+        handler = WSGIHandler()
+        environ = RequestFactory().get(options['path'], HTTP_HOST='localhost').environ
+
+        self.stdout.write(f"connection setup: {self.setup_time(connection) * 1000:.3f}ms "
+                          f"({connection.vendor}, {options['database']})")
+        runs = [('per-request', 0), ('persistent', configured or 60)]
+        if connection.settings_dict.get('OPTIONS', {}).get('pool'):
+            # Django refuses persistent connections on a pooled alias
+            self.stdout.write('persistent run skipped: connections come from the psycopg pool')
+            runs = runs[:1]
+        try:
+            for label, max_age in runs:
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                self.run(label, handler, environ, options['requests'], connection.alias)
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = configured
+
+    def run(self, label, handler, environ, requests, alias):
+        opened = connections_opened[alias]
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = handler(dict(environ), lambda status, headers: None)
+            b''.join(response)
+            response.close()
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        total = sum(timings)
+        self.stdout.write(
+            f'{label:<12} {requests / total:>8.0f} req/s  '
+            f'mean={statistics.mean(timings) * 1000:.2f}ms  '
+            f'p95={timings[int(len(timings) * 0.95) - 1] * 1000:.2f}ms  '
+            f'connections opened={connections_opened[alias] - opened}'
+        )
+
+    @staticmethod
+    def setup_time(connection, rounds=50):
+        connection.close()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            connection.connect()
+            connection.close()
+        return (time.perf_counter() - start) / rounds
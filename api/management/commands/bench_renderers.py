@@ -0,0 +1,53 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.management.commands._benchdata import add_data_arguments, create_data
+from api.models import Order, Product
+from api.renderers import MessagePackRenderer, ORJSONRenderer, msgpack
+from api.serializers import CompiledOrderSerializer, CompiledProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks encode time and response size of the JSON, orjson and MessagePack renderers'
+
+    def add_arguments(self, parser):
+        add_data_arguments(parser)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        renderers = [('json', JSONRenderer()), ('orjson', ORJSONRenderer())]
+        if msgpack is not None:
+            renderers.append(('msgpack', MessagePackRenderer()))
+        else:
+            self.stderr.write('msgpack is not installed, skipping MessagePack')
+
+        # synthetic rows live only for the duration of the benchmark
+        with transaction.atomic():
+            create_data(options, username='bench-renderers')
+            payloads = [
+                ('products', CompiledProductSerializer().serialize(Product.objects.order_by('pk'))),
+                ('orders', CompiledOrderSerializer().serialize(Order.objects.with_totals())),
+            ]
+            transaction.set_rollback(True)
+
+        for label, data in payloads:
+            expected = renderers[0][1].render(data)
+            for name, renderer in renderers:
+                body = renderer.render(data)
+                if name == 'orjson' and body != expected:
+                    self.stderr.write(f'{label}: orjson output differs from JSONRenderer')
+                best = min(self.timed(renderer.render, data) for _ in range(options['repeat']))
+                self.stdout.write(
+                    f'{label:<10} {name:<8} {len(data):>7} rows  {best * 1000:9.2f}ms  '
+                    f'{len(body) / 1024:>9.1f} KiB  {len(gzip.compress(body)) / 1024:>8.1f} KiB gzipped'
+                )
+
+    @staticmethod
+    def timed(func, data):
+        start = time.perf_counter()
+        func(data)
+        return time.perf_counter() - start
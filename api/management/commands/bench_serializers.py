@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.management.commands._benchdata import add_data_arguments, create_data
+from api.models import Order, Product
+from api.serializers import (CompiledOrderSerializer, CompiledProductSerializer,
+                             OrderSerializer, ProductSerializer)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the regular and compiled list serializers (rows/sec)'
+
+    def add_arguments(self, parser):
+        add_data_arguments(parser)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # synthetic rows live only for the duration of the benchmark
+        with transaction.atomic():
+            create_data(options, username='bench-serializers')
+            self.run(
+                'products',
+                Product.objects.order_by('pk'),
+                ProductSerializer, CompiledProductSerializer, options['repeat'],
+            )
+            self.run(
+                'orders',
+                Order.objects.with_totals().prefetch_related('items__product'),
+                OrderSerializer, CompiledOrderSerializer, options['repeat'],
+            )
+            transaction.set_rollback(True)
+
+    def run(self, label, queryset, serializer_class, compiled_class, repeat):
+        renderer = JSONRenderer()
+        rows = queryset.count()
+
+        def regular():
+            return renderer.render(serializer_class(queryset.all(), many=True).data)
+
+        def compiled():
+            return renderer.render(compiled_class().serialize(queryset.all()))
+
+        if regular() != compiled():
+            self.stderr.write(f'{label}: compiled output differs from the regular serializer')
+
+        for name, func in (('regular', regular), ('compiled', compiled)):
+            best = min(self.timed(func) for _ in range(repeat))
+            self.stdout.write(f'{label:<10} {name:<9} {rows:>8} rows  {best:8.3f}s  {rows / best:>10.0f} rows/sec')
+
+    @staticmethod
+    def timed(func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
@@ -0,0 +1,6 @@
+from api.transfer import ExportCommand, OrderExporter
+
+
+class Command(ExportCommand):
+    help = 'Streams all orders with their items to a CSV or JSON Lines file, resumably'
+    exporter_class = OrderExporter
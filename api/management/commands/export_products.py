@@ -0,0 +1,6 @@
+from api.transfer import ExportCommand, ProductExporter
+
+
+class Command(ExportCommand):
+    help = 'Streams the product catalogue to a CSV or JSON Lines file, resumably (products without a sku are skipped)'
+    exporter_class = ProductExporter
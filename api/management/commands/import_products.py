@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.transfer import FORMATS, detect_format, import_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Upserts products from a CSV or JSON Lines file (columns sku, name, description, '
+        'price, stock) in batches, matching on sku. An interrupted import resumes from its checkpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=1, help='processes writing batches in parallel (not on sqlite)')
+        parser.add_argument('--restart', action='store_true', help='ignore a checkpoint left by an earlier run')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        start = time.perf_counter()
+        reported = [start]
+
+        def progress(state):
+            if options['verbosity'] > 1 or time.perf_counter() - reported[0] > 5:
+                reported[0] = time.perf_counter()
+                self.stdout.write(f"{state['rows']} rows imported...")
+
+        state = import_products(
+            path, detect_format(path, options['format']), options['batch_size'],
+            options['workers'], options['restart'], progress,
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {state['rows']} rows in {elapsed:.1f}s: {state['created']} created, "
+            f"{state['updated']} updated, {state['unchanged']} unchanged."
+        ))
@@ -0,0 +1,113 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+
+class Command(BaseCommand):
+    help = (
+        'In-process load test of a read endpoint: the sync view under WSGI and '
+        'ASGI, and its /async/ variant under ASGI (requests/sec and latency)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/products/', help='sync endpoint; /async is prefixed for the async one')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument('--token', help='JWT access token for authenticated endpoints such as /orders/')
+
+    def handle(self, *args, **options):
+        headers = {'HTTP_HOST': 'localhost'}
+        if options['token']:
+            headers['HTTP_AUTHORIZATION'] = f"Bearer {options['token']}"
+        path = options['path']
+        async_path = f'/async{path}'
+
+        runs = [
+            ('wsgi  sync ', self.run_wsgi(path, headers, options)),
+            ('asgi  sync ', asyncio.run(self.run_asgi(path, headers, options))),
+            ('asgi  async', asyncio.run(self.run_asgi(async_path, headers, options))),
+        ]
+        for label, (elapsed, timings, errors) in runs:
+            timings.sort()
+            self.stdout.write(
+                f'{label}  {len(timings) / elapsed:>8.0f} req/s  '
+                f'p50={self.percentile(timings, 50):.1f}ms  '
+                f'p95={self.percentile(timings, 95):.1f}ms  '
+                f'p99={self.percentile(timings, 99):.1f}ms  '
+                f'mean={statistics.mean(timings):.1f}ms  errors={errors}'
+            )
+
+    def run_wsgi(self, path, headers, options):
+        handler = WSGIHandler()
+        environ = RequestFactory().get(path, **headers).environ
+
+        def request():
+            start = time.perf_counter()
+            status = []
+            response = handler(dict(environ), lambda code, response_headers: status.append(code))
+            b''.join(response)
+            response.close()
+            return (time.perf_counter() - start) * 1000, not status[0].startswith('2')
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(lambda _: request(), range(options['requests'])))
+        return self.summarize(start, results)
+
+    async def run_asgi(self, path, headers, options):
+        handler = ASGIHandler()
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'query_string': query.encode(),
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+            'headers': [
+                (name[5:].lower().replace('_', '-').encode(), value.encode())
+                for name, value in headers.items()
+            ],
+        }
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def request():
+            async with semaphore:
+                done = asyncio.Event()
+                sent = []
+
+                async def receive():
+                    if not sent:
+                        sent.append(True)
+                        return {'type': 'http.request', 'body': b'', 'more_body': False}
+                    # the client stays connected until the response is complete
+                    await done.wait()
+                    return {'type': 'http.disconnect'}
+
+                status = []
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+                    elif not message.get('more_body'):
+                        done.set()
+
+                start = time.perf_counter()
+                await handler(dict(scope), receive, send)
+                return (time.perf_counter() - start) * 1000, not 200 <= status[0] < 300
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(request() for _ in range(options['requests'])))
+        return self.summarize(start, results)
+
+    @staticmethod
+    def summarize(start, results):
+        elapsed = time.perf_counter() - start
+        return elapsed, [timing for timing, _ in results], sum(error for _, error in results)
+
+    @staticmethod
+    def percentile(timings, pct):
+        return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
@@ -1,40 +1,194 @@
+import math
 import random
+import time
+import uuid
+from datetime import timedelta
 from decimal import Decimal
+from itertools import accumulate
 
-from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from django.utils import lorem_ipsum
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import lorem_ipsum, timezone
+from api.cache import bump_version
 from api.models import User, Product, Order, OrderItem
+from api.stats import invalidate_product_stats
+from api.transfer import batched
+
+STATUS_WEIGHTS = {
+    Order.StatusChoices.CONFIRMED: 80,
+    Order.StatusChoices.PENDING: 15,
+    Order.StatusChoices.CANCELLED: 5,
+}
+QUANTITY_WEIGHTS = {1: 60, 2: 25, 3: 10, 4: 3, 5: 2}
+
 
 class Command(BaseCommand):
-    help = 'Creates application data'
+    help = (
+        'Creates application data: the demo catalogue, plus a synthetic dataset of the given '
+        'size. The same seed and sizes always produce the same rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=0, help='synthetic users besides admin')
+        parser.add_argument('--products', type=int, default=0, help='synthetic products besides the demo ones')
+        parser.add_argument('--orders', type=int, default=3)
+        parser.add_argument('--items', type=int, default=2, help='average items per order')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--product-skew', type=float, default=1.1,
+                            help='zipf exponent of product popularity, 0 for uniform')
+        parser.add_argument('--user-skew', type=float, default=0.8,
+                            help='zipf exponent of orders per user, 0 for uniform')
+        parser.add_argument('--days', type=int, default=365, help='spread order dates over this many days')
+        parser.add_argument('--batch-size', type=int, default=10000)
 
-    def handle(self, *args, **kwargs):
+    def handle(self, *args, **options):
+        if options['items'] < 1:
+            raise CommandError('--items must be at least 1.')
+        start = time.perf_counter()
+        self.report_every = options['batch_size'] * 10
         # get or create superuser
         user = User.objects.filter(username='admin').first()
         if not user:
             user = User.objects.create_superuser(username='admin', password='test')
 
+        seed = options['seed']
+        demo = random.Random(f'{seed}-demo')
         # create products - name, desc, price, stock, image
         products = [
-            Product(name="A Scanner Darkly", description=lorem_ipsum.paragraph(), price=Decimal('12.99'), stock=4),
-            Product(name="Coffee Machine", description=lorem_ipsum.paragraph(), price=Decimal('70.99'), stock=6),
-            Product(name="Velvet Underground & Nico", description=lorem_ipsum.paragraph(), price=Decimal('15.99'), stock=11),
-            Product(name="Enter the Wu-Tang (36 Chambers)", description=lorem_ipsum.paragraph(), price=Decimal('17.99'), stock=2),
-            Product(name="Digital Camera", description=lorem_ipsum.paragraph(), price=Decimal('350.99'), stock=4),
-            Product(name="Watch", description=lorem_ipsum.paragraph(), price=Decimal('500.05'), stock=0),
+            Product(sku='DEMO-1', name="A Scanner Darkly", description=self.paragraph(demo), price=Decimal('12.99'), stock=4),
+            Product(sku='DEMO-2', name="Coffee Machine", description=self.paragraph(demo), price=Decimal('70.99'), stock=6),
+            Product(sku='DEMO-3', name="Velvet Underground & Nico", description=self.paragraph(demo), price=Decimal('15.99'), stock=11),
+            Product(sku='DEMO-4', name="Enter the Wu-Tang (36 Chambers)", description=self.paragraph(demo), price=Decimal('17.99'), stock=2),
+            Product(sku='DEMO-5', name="Digital Camera", description=self.paragraph(demo), price=Decimal('350.99'), stock=4),
+            Product(sku='DEMO-6', name="Watch", description=self.paragraph(demo), price=Decimal('500.05'), stock=0),
         ]
+        # rows already present are kept, so rerunning with the same seed adds nothing
+        Product.objects.bulk_create(products, ignore_conflicts=True)
+
+        self.create_users(random.Random(f'{seed}-users'), options)
+        self.create_products(random.Random(f'{seed}-products'), options)
+        self.create_orders(random.Random(f'{seed}-orders'), options)
+
+        # bulk_create skips the signals that keep the search index and caches in sync
+        call_command('rebuild_search_index', stdout=self.stdout)
+        bump_version('product', 'catalog', 'order')
+        invalidate_product_stats()
+        with connection.cursor() as cursor:
+            # planner statistics for the new data distribution
+            cursor.execute('ANALYZE')
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - start:.1f}s.'))
+
+    def create_users(self, rng, options):
+        # hashing is deliberately slow, every synthetic user shares the password 'test'
+        password = make_password('test')
+        users = (
+            User(username=f'user{i:08d}', email=f'user{i:08d}@example.com', password=password)
+            for i in range(options['users'])
+        )
+        self.insert(User, users, options['users'], options['batch_size'], ignore_conflicts=True)
+
+    def create_products(self, rng, options):
+        words = lorem_ipsum.WORDS
+        products = (
+            Product(
+                sku=f'SKU-{i:08d}',
+                name=' '.join(rng.choice(words) for _ in range(rng.randint(2, 4))).title(),
+                description=' '.join(rng.choice(words) for _ in range(rng.randint(10, 40))),
+                # long tail of cheap products, a few expensive ones
+                price=Decimal(min(5000, max(0.5, math.exp(rng.normalvariate(3.3, 1))))).quantize(Decimal('0.01')),
+                stock=0 if rng.random() < 0.05 else rng.randint(1, 500),
+            )
+            for i in range(options['products'])
+        )
+        self.insert(Product, products, options['products'], options['batch_size'], ignore_conflicts=True)
+
+    def create_orders(self, rng, options):
+        user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        pick_users = self.zipf_sampler(rng, user_ids, options['user_skew'])
+        pick_products = self.zipf_sampler(rng, product_ids, options['product_skew'])
+        statuses, status_weights = zip(*STATUS_WEIGHTS.items())
+        quantities, quantity_weights = zip(*QUANTITY_WEIGHTS.items())
+        max_items = min(2 * options['items'] - 1, len(product_ids))
+        # dates count back from today's midnight, so a rerun on the same day matches
+        now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        period = timedelta(days=options['days']).total_seconds()
+
+        def orders():
+            for _ in range(options['orders']):
+                order_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+                order = (
+                    order_id, pick_users(1)[0], rng.choices(statuses, status_weights)[0],
+                    now - timedelta(seconds=rng.random() * period),
+                )
+                # distinct products, popular ones more often
+                count = rng.randint(1, max_items)
+                chosen = set()
+                while len(chosen) < count:
+                    chosen.update(pick_products(count - len(chosen)))
+                items = [
+                    (order_id, product_id, rng.choices(quantities, quantity_weights)[0])
+                    for product_id in sorted(chosen)
+                ]
+                yield order, items
+
+        created = 0
+        for batch in batched(orders(), options['batch_size']):
+            existing = set(Order.objects.filter(pk__in=[order[0] for order, _ in batch]).values_list('pk', flat=True))
+            batch = [(order, items) for order, items in batch if order[0] not in existing]
+            with transaction.atomic():
+                self.insert_rows(Order, ['order_id', 'user', 'status', 'created_at'], [order for order, _ in batch])
+                self.insert_rows(OrderItem, ['order', 'product', 'quantity'], [item for _, items in batch for item in items])
+            created += len(batch) + len(existing)
+            self.progress(Order, created, options['orders'])
+
+    @staticmethod
+    def paragraph(rng):
+        """A lorem ipsum paragraph, like lorem_ipsum.paragraph() but drawn from ``rng``."""
+        sentences = (
+            ' '.join(rng.choice(lorem_ipsum.WORDS) for _ in range(rng.randint(5, 15))).capitalize() + '.'
+            for _ in range(rng.randint(1, 4))
+        )
+        return ' '.join(sentences)
+
+    @staticmethod
+    def zipf_sampler(rng, population, exponent):
+        """Sample ``population`` with the i-th (random) element weighted 1 / i ** exponent."""
+        population = list(population)
+        rng.shuffle(population)
+        cum_weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(len(population))))
+        return lambda k: rng.choices(population, cum_weights=cum_weights, k=k)
 
-        # create products & re-fetch from DB
-        Product.objects.bulk_create(products)
-        products = Product.objects.all()
+    @staticmethod
+    def insert_rows(model, field_names, rows):
+        """
+        INSERT plain tuples with executemany, several times faster than
+        bulk_create for the order tables. No model instances are built, and
+        auto_now_add doesn't overwrite the generated order dates.
+        """
+        fields = [model._meta.get_field(name) for name in field_names]
+        quote = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+                for row in rows
+            ])
 
+    def insert(self, model, objs, total, batch_size, **kwargs):
+        created = 0
+        for batch in batched(objs, batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, **kwargs)
+            created += len(batch)
+            self.progress(model, created, total)
 
-        # create some dummy orders tied to the superuser
-        for _ in range(3):
-            # create an Order with 2 order items
-            order = Order.objects.create(user=user)
-            for product in random.sample(list(products), 2):
-                OrderItem.objects.create(
-                    order=order, product=product, quantity=random.randint(1,3)
-                )
\ No newline at end of file
+    def progress(self, model, created, total):
+        if created == total or created % self.report_every == 0:
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {created}/{total}')
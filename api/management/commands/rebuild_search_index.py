@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index (e.g. after bulk loads that skip signals)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        if backend is None:
+            self.stdout.write('No full-text backend for this database, nothing to do.')
+            return
+        backend.rebuild(options['database'])
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.outbox import relay
+
+
+class Command(BaseCommand):
+    help = 'Drains the outbox table to Celery in batches; runs until interrupted unless --once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_RELAY_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=0.5, help='seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='exit once the outbox is empty')
+
+    def handle(self, *args, **options):
+        relayed = 0
+        try:
+            while True:
+                # honours CONN_MAX_AGE and drops broken connections, as between requests
+                close_old_connections()
+                count = relay(options['batch_size'])
+                relayed += count
+                if count < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Relayed {relayed} messages.')
@@ -0,0 +1,88 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections
+from rest_framework.exceptions import ValidationError
+
+from api.models import Order, OrderItem, Product, User
+from api.serializers import OrderCreateSerializer
+
+
+class Command(BaseCommand):
+    help = 'Hammers one hot product with concurrent checkouts and checks for oversell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--orders', type=int, default=1000, help='checkout attempts in total')
+        parser.add_argument('--stock', type=int, default=500, help='initial stock of the hot product')
+        parser.add_argument('--quantity', type=int, default=1, help='units per order')
+        parser.add_argument('--keep', action='store_true', help='keep the generated rows')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f'stress-stock-{time.time_ns()}')
+        product = Product.objects.create(
+            name='Hot product', description='stress test', price=Decimal('9.99'), stock=options['stock']
+        )
+        payload = {'status': 'pending', 'items': [{'product': product.pk, 'quantity': options['quantity']}]}
+
+        attempts = iter(range(options['orders']))
+        lock = threading.Lock()
+        counts = {'placed': 0, 'rejected': 0, 'retries': 0}
+
+        def worker():
+            close_old_connections()
+            try:
+                while True:
+                    with lock:
+                        if next(attempts, None) is None:
+                            return
+                    outcome = self.checkout(user, payload)
+                    with lock:
+                        counts[outcome[0]] += 1
+                        counts['retries'] += outcome[1]
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        product.refresh_from_db()
+        sold = sum(OrderItem.objects.filter(product=product).values_list('quantity', flat=True))
+        oversold = sold - options['stock']
+
+        self.stdout.write(
+            f"{options['threads']} threads, {options['orders']} attempts in {elapsed:.2f}s "
+            f"({options['orders'] / elapsed:.0f} checkouts/sec)\n"
+            f"placed={counts['placed']} rejected={counts['rejected']} retries={counts['retries']}\n"
+            f"sold={sold} remaining={product.stock} oversold={max(oversold, 0)}"
+        )
+
+        consistent = oversold <= 0 and sold + product.stock == options['stock']
+        if not options['keep']:
+            Order.objects.filter(user=user).delete()
+            product.delete()
+            user.delete()
+        if not consistent:
+            raise CommandError('Stock is inconsistent with the placed orders.')
+
+    def checkout(self, user, payload):
+        retries = 0
+        while True:
+            serializer = OrderCreateSerializer(data=payload)
+            try:
+                serializer.is_valid(raise_exception=True)
+                serializer.save(user=user)
+                return 'placed', retries
+            except ValidationError:
+                return 'rejected', retries
+            except OperationalError:
+                # sqlite reports lock contention instead of waiting; retry
+                retries += 1
+                time.sleep(0.001 * retries)
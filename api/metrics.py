@@ -0,0 +1,119 @@
+import os
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+from api.budget import QueryUsage
+
+# Metrics are kept in process memory. Under gunicorn set PROMETHEUS_MULTIPROC_DIR
+# to an empty directory before the workers start: every worker then writes its
+# values to mmapped files there and /metrics adds them up. The directory must be
+# wiped on deploy, and a gunicorn ``child_exit`` hook should call
+# ``prometheus_client.multiprocess.mark_process_dead(worker.pid)``.
+
+REQUEST_DURATION = Histogram(
+    'api_request_duration_seconds', 'Time to respond, streamed bodies included.',
+    ['view', 'method', 'status'],
+    buckets=(.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    'api_request_queries', 'Database queries per request.',
+    ['view', 'method'],
+    buckets=(0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 30, 50, 100),
+)
+REQUEST_DB_DURATION = Histogram(
+    'api_request_db_duration_seconds', 'Time spent in database queries per request.',
+    ['view', 'method'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+RESPONSE_CACHE = Counter(
+    'api_response_cache', 'Responses served from (hit) or stored in (miss) the response cache.',
+    ['view', 'result'],
+)
+
+
+def view_label(request):
+    # the url name, or the view's dotted path: bounded, unlike request.path
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unresolved'
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count, DB time and response cache hits per
+    resolved view, for the Prometheus endpoint in ``metrics_view``.
+    Streamed responses are measured until the last chunk is sent. Runs
+    natively under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        usage = QueryUsage()
+        with usage.record():
+            response = self.get_response(request)
+        return self.measure(usage, request, response)
+
+    async def __acall__(self, request):
+        usage = QueryUsage()
+        with usage.record():
+            response = await self.get_response(request)
+        return self.measure(usage, request, response)
+
+    def measure(self, usage, request, response):
+        if response.streaming:
+            stream = self.ameasure_stream if response.is_async else self.measure_stream
+            response.streaming_content = stream(response.streaming_content, usage, request, response)
+        else:
+            self.observe(usage, request, response)
+        return response
+
+    def measure_stream(self, content, usage, request, response):
+        try:
+            with usage.record():
+                yield from content
+        finally:
+            self.observe(usage, request, response)
+
+    async def ameasure_stream(self, content, usage, request, response):
+        try:
+            with usage.record():
+                async for chunk in content:
+                    yield chunk
+        finally:
+            self.observe(usage, request, response)
+
+    @staticmethod
+    def observe(usage, request, response):
+        view = view_label(request)
+        REQUEST_DURATION.labels(view, request.method, response.status_code).observe(usage.duration_ms / 1000)
+        REQUEST_QUERIES.labels(view, request.method).observe(usage.queries)
+        REQUEST_DB_DURATION.labels(view, request.method).observe(usage.db_time)
+        # set by api.cache.cache_response, and on 304s answered from cached validators
+        cache_result = response.get('X-Cache')
+        if cache_result:
+            RESPONSE_CACHE.labels(view, cache_result.lower()).inc()
+
+
+def metrics_view(request):
+    """Prometheus text exposition; needs ``Authorization: Bearer METRICS_TOKEN`` when that is set."""
+    token = settings.METRICS_TOKEN
+    if token is not None and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+PRODUCT_FTS_TABLE = 'api_product_fts'
+PRODUCT_TSVECTOR = (
+    "to_tsvector('english'::regconfig, "
+    "COALESCE(\"name\", '') || ' ' || COALESCE(\"description\", ''))"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_FTS_TABLE} USING fts5(name, description)'
+        )
+        schema_editor.execute(
+            f'INSERT INTO {PRODUCT_FTS_TABLE} (rowid, name, description) '
+            'SELECT id, name, description FROM api_product'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS api_product_search_idx ON api_product USING gin (({PRODUCT_TSVECTOR}))'
+        )
+        # name__icontains compiles to UPPER("name") LIKE UPPER(%s)
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS api_product_name_trgm_idx ON api_product '
+            'USING gin ((UPPER("name")) gin_trgm_ops)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {PRODUCT_FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS api_product_search_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS api_product_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_order_status_alter_orderitem_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
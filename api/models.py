@@ -1,17 +1,150 @@
 import uuid
+from collections import Counter
+
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db.models.functions import Now, Upper
+from django.contrib.auth.models import AbstractUser, UserManager as AuthUserManager
+
+from api.cache import bump_version
+from api.conditional import invalidate_product_validators
+from api.stats import stock_availability_changed
+
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # imported here to keep the DRF/simplejwt imports out of api.models
+        from api.authentication import CACHED_USER_FIELDS, invalidate_cached_users
+
+        # bulk updates skip the post_save signal that drops cached users
+        if {*CACHED_USER_FIELDS, 'password'}.isdisjoint(kwargs):
+            return super().update(**kwargs)
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        invalidate_cached_users(user_ids)
+        return rows
+
+
+class UserManager(AuthUserManager.from_queryset(UserQuerySet)):
+    pass
+
 
 # Custom User Model
 class User(AbstractUser):
-    pass
+    objects = UserManager()
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'Not enough stock for product {product_id}.')
+        self.product_id = product_id
+
+
+class ProductQuerySet(models.QuerySet):
+    def reserve_stock(self, quantities):
+        """
+        Take ``{product_id: quantity}`` out of stock atomically.
+
+        The rows are locked in product id order, so two orders sharing products
+        can't deadlock, then decremented in a single conditional UPDATE
+        (``stock = stock - n WHERE stock >= n``), so concurrent checkouts can
+        never oversell. Raises InsufficientStock; call it inside a transaction.
+        """
+        quantities = {pk: n for pk, n in quantities.items() if n > 0}
+        if not quantities:
+            return
+        stock = dict(
+            self.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk', 'stock')
+        )
+        for product_id in sorted(quantities):
+            if stock.get(product_id, 0) < quantities[product_id]:
+                raise InsufficientStock(product_id)
+
+        amount = self._per_product(quantities)
+        updated = self.filter(pk__in=quantities, stock__gte=amount).update(
+            stock=models.F('stock') - amount, **self._new_version()
+        )
+        if updated != len(quantities):
+            raise InsufficientStock(min(quantities))
+        sold_out = sum(stock[pk] == n for pk, n in quantities.items())
+        self._stock_changed(quantities, -sold_out)
+
+    def release_stock(self, quantities):
+        quantities = {pk: n for pk, n in quantities.items() if n > 0}
+        if not quantities:
+            return
+        back_in_stock = self.filter(pk__in=quantities, stock=0).count()
+        amount = self._per_product(quantities)
+        self.filter(pk__in=quantities).update(stock=models.F('stock') + amount, **self._new_version())
+        self._stock_changed(quantities, back_in_stock)
+
+    @staticmethod
+    def _per_product(quantities):
+        return models.Case(
+            *(models.When(pk=pk, then=models.Value(n)) for pk, n in quantities.items()),
+            output_field=models.PositiveIntegerField(),
+        )
+
+    def adjust_stock(self, before, after):
+        """Reserve or release the difference between two reservations."""
+        delta = Counter(after)
+        delta.subtract(before)
+        self.release_stock({pk: -n for pk, n in delta.items() if n < 0})
+        self.reserve_stock({pk: n for pk, n in delta.items() if n > 0})
+
+    @staticmethod
+    def _new_version():
+        return {'version': models.F('version') + 1, 'updated_at': Now()}
+
+    @staticmethod
+    def _stock_changed(quantities, in_stock_delta):
+        # queryset updates skip post_save, so invalidate cached products here.
+        # Product lists render and sort on stock; orders (the 'catalog' scope)
+        # never depend on it.
+        bump_version('product', *(f'product:{pk}' for pk in quantities))
+        invalidate_product_validators(*quantities)
+        stock_availability_changed(in_stock_delta)
+
 
 class Product(models.Model):
+    # natural key for catalogue imports/exports (import_products upserts on it)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
     image = models.ImageField(upload_to='product/', null=True, blank=True)
+    # ETag / Last-Modified of the product detail endpoint, bumped on every change
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # ProductFilter price lookups
+            models.Index(fields=['price'], name='product_price_idx'),
+            # name__iexact compiles to UPPER("name") = UPPER(%s) on postgres
+            models.Index(Upper('name'), name='product_name_upper_idx'),
+            # InStockFilterBackend, in primary key order
+            models.Index(fields=['id'], condition=models.Q(stock__gt=0), name='product_in_stock_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so api.stats can apply the difference on save
+        if {'name', 'price', 'stock'}.issubset(field_names):
+            instance._loaded_values = {'name': instance.name, 'price': instance.price, 'stock': instance.stock}
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            # incremented by the database, so concurrent saves never reuse a version
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        if not isinstance(self.version, int):
+            self.refresh_from_db(fields=['version'])
 
     @property
     def in_stock(self): 
@@ -20,6 +153,21 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        # total and item count computed by the database instead of per item in python
+        return self.annotate(
+            total_price=models.Sum(
+                models.F('items__product__price') * models.F('items__quantity'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            item_count=models.Count('items'),
+        )
+
+    def with_items(self):
+        return self.prefetch_related('items__product')
+
+
 class Order(models.Model):
     class StatusChoices(models.TextChoices):
         PENDING = 'pending'
@@ -36,6 +184,27 @@ class Order(models.Model):
         )
     products = models.ManyToManyField(Product, through='OrderItem', related_name='orders')
 
+    class Meta:
+        indexes = [
+            # a user's orders (OrderViewSet.get_queryset) and OrderFilter on created_at
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            # OrderFilter on status, optionally with a created_at range
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
+
+    objects = OrderQuerySet.as_manager()
+
+    def reserved_quantities(self, items=None):
+        """{product_id: quantity} held in stock by this order; none once cancelled."""
+        if self.status == self.StatusChoices.CANCELLED:
+            return {}
+        if items is None:
+            items = self.items.values_list('product_id', 'quantity')
+        quantities = Counter()
+        for product_id, quantity in items:
+            quantities[product_id] += quantity
+        return quantities
+
     def __str__(self):
         return f"Order #{self.order_id} vt {self.user.username}"
     
@@ -51,3 +220,17 @@ class OrderItem(models.Model):
     
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in order #{self.order.order_id}"
+
+
+class OutboxMessage(models.Model):
+    """
+    A side effect (e.g. a confirmation email) recorded in the same
+    transaction as the change that causes it, and handed to Celery
+    afterwards by the relay in api/outbox.py.
+    """
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk}"
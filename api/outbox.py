@@ -0,0 +1,63 @@
+import logging
+
+from celery import group
+from django.conf import settings
+from django.db import transaction
+
+from api.models import OutboxMessage
+from api.tasks import send_order_confirmation_emails
+
+logger = logging.getLogger('api.outbox')
+ORDER_CONFIRMATION = 'order_confirmation'
+
+
+def enqueue_order_confirmations(orders):
+    """
+    Record confirmation emails for ``[(order_id, email), ...]``. Call it in
+    the transaction that creates the orders: they are only sent if it commits,
+    and the request never waits on the broker.
+    """
+    OutboxMessage.objects.bulk_create(
+        OutboxMessage(kind=ORDER_CONFIRMATION, payload={'order_id': str(order_id), 'email': email})
+        for order_id, email in orders
+    )
+
+
+def publish_order_confirmations(payloads):
+    orders = [[payload['order_id'], payload['email']] for payload in payloads]
+    size = settings.OUTBOX_EMAIL_BATCH_SIZE
+    group(
+        send_order_confirmation_emails.s(orders[i:i + size]) for i in range(0, len(orders), size)
+    ).apply_async()
+
+
+PUBLISHERS = {
+    ORDER_CONFIRMATION: publish_order_confirmations,
+}
+
+
+def relay(batch_size=None):
+    """
+    Publish up to ``batch_size`` outbox messages to Celery, oldest first, and
+    delete them. The rows stay locked until then (skipped by concurrent
+    relays), and a failed publish rolls back so they are retried. A crash
+    between publishing and committing sends them again: delivery is at least
+    once. Returns the number of messages relayed.
+    """
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(kind__in=PUBLISHERS).order_by('pk')
+            .values_list('pk', 'kind', 'payload')[:batch_size]
+        )
+        if not messages:
+            return 0
+        by_kind = {}
+        for _, kind, payload in messages:
+            by_kind.setdefault(kind, []).append(payload)
+        for kind, payloads in by_kind.items():
+            PUBLISHERS[kind](payloads)
+        OutboxMessage.objects.filter(pk__in=[pk for pk, _, _ in messages]).delete()
+    logger.debug('relayed %d outbox messages', len(messages))
+    return len(messages)
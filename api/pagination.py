@@ -0,0 +1,210 @@
+from django.core import signing
+from django.db.models import Q
+from rest_framework import filters
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from api.search import RANK_ANNOTATION
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over a fixed tuple of ordering fields.
+
+    Instead of OFFSET, each page filters on the key of the last row seen, so
+    deep pages cost the same as the first one and no COUNT(*) is issued.
+    Cursors are signed, so clients can't forge or edit them.
+
+    Unless ``always_paginate`` is set, pagination only kicks in when the client
+    asks for it with ``?cursor=`` or ``?page_size=``; plain list calls keep
+    returning the unpaginated list.
+    """
+    ordering = ('pk',)
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    salt = 'api.pagination.keyset'
+    invalid_cursor_message = 'Invalid cursor'
+    always_paginate = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        return self.set_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        return self.set_page([obj async for obj in page_queryset])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        if (not self.always_paginate
+                and self.cursor_query_param not in request.query_params
+                and self.page_size_query_param not in request.query_params):
+            return None
+
+        self.request = request
+        self.model = queryset.model
+        self.annotations = queryset.query.annotations
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.keys = self.get_ordering(request, queryset, view)
+
+        self.cursor_values, self.reverse = self.decode_cursor(request)
+        keys = [self.flip(key) for key in self.keys] if self.reverse else self.keys
+
+        queryset = queryset.order_by(*keys)
+        loaded, deferred = queryset.query.deferred_loading
+        if loaded and not deferred:
+            # narrowed with only(): the keys are read back for the cursors
+            queryset = queryset.only(
+                *loaded, *(self.field_name(key) for key in keys if self.field_name(key) not in self.annotations)
+            )
+        if self.cursor_values is not None:
+            queryset = queryset.filter(self.build_seek_filter(keys, self.cursor_values))
+
+        # fetch one extra row to know whether there is another page
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+
+        seeked = self.cursor_values is not None
+        self.page = results
+        self.has_next = has_more if not self.reverse else seeked
+        self.has_previous = seeked if not self.reverse else has_more
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        # honour OrderingFilter when the view uses it, with pk as tie-breaker
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, filters.OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    ordering = list(ordering)
+                    if not any(self.field_name(key) == 'pk' for key in ordering):
+                        ordering.append('pk')
+                    return ordering
+        if RANK_ANNOTATION in queryset.query.annotations:
+            # a full-text search keeps its relevance order across pages
+            return list(queryset.query.order_by)
+        return list(self.ordering)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, obj, reverse):
+        payload = {
+            'k': [self.field_name(key) for key in self.keys],
+            'v': [self.get_value(obj, key) for key in self.keys],
+            'r': reverse,
+        }
+        token = signing.dumps(payload, salt=self.salt, compress=True)
+        url = replace_query_param(self.base_url, self.cursor_query_param, token)
+        return replace_query_param(url, self.page_size_query_param, self.page_size)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = signing.loads(token, salt=self.salt)
+            if payload['k'] != [self.field_name(key) for key in self.keys]:
+                raise ValueError('cursor ordering does not match the request')
+            values = [
+                self.get_field(key).to_python(value)
+                for key, value in zip(self.keys, payload['v'])
+            ]
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, bool(payload.get('r'))
+
+    def build_seek_filter(self, keys, values):
+        # (a, b) > (x, y)  ->  a > x OR (a = x AND b > y), per field direction
+        condition = Q()
+        for i, key in enumerate(keys):
+            name = self.field_name(key)
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            term = Q(**{f'{name}__{lookup}': values[i]})
+            for prev_key, prev_value in zip(keys[:i], values[:i]):
+                term &= Q(**{self.field_name(prev_key): prev_value})
+            condition |= term
+        return condition
+
+    def get_value(self, obj, key):
+        name = self.field_name(key)
+        if name in self.annotations:
+            return getattr(obj, name)
+        return self.get_field(key).value_to_string(obj)
+
+    def get_field(self, key):
+        name = self.field_name(key)
+        if name == 'pk':
+            return self.model._meta.pk
+        if name in self.annotations:
+            return self.annotations[name].output_field
+        return self.model._meta.get_field(name)
+
+    @staticmethod
+    def field_name(key):
+        return key.lstrip('-')
+
+    @staticmethod
+    def flip(key):
+        return key[1:] if key.startswith('-') else f'-{key}'
+
+
+class ProductKeysetPagination(KeysetPagination):
+    ordering = ('pk',)
+
+
+class OrderKeysetPagination(KeysetPagination):
+    # newest first; order_id breaks ties between orders created in the same instant
+    ordering = ('-created_at', '-order_id')
+
+
+class ProductInfoPagination(ProductKeysetPagination):
+    always_paginate = True
@@ -0,0 +1,283 @@
+import atexit
+import base64
+import json
+import logging
+import pstats
+import random
+import threading
+import traceback
+from collections import deque
+from contextvars import ContextVar
+from io import StringIO
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models.sql.compiler import SQLCompiler
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_str
+from silk import models as silk_models
+from silk.collector import DataCollector
+from silk.config import SilkyConfig
+from silk.middleware import SilkyMiddleware, _should_intercept
+from silk.model_factory import RequestModelFactory, ResponseModelFactory
+from silk.sql import _explain_query
+
+logger = logging.getLogger('api.profiling')
+# full detail (tracebacks, EXPLAIN, python profile) for traced requests only
+_detailed = ContextVar('profiling_detailed', default=False)
+
+
+def is_traced(request):
+    value = request.headers.get(settings.PROFILING_TRACE_HEADER)
+    if value is None:
+        return False
+    token = settings.PROFILING_TRACE_TOKEN
+    return token is None or constant_time_compare(value, token)
+
+
+def execute_sql(self, *args, **kwargs):
+    """SQLCompiler.execute_sql recording the query for the profiled request, if any."""
+    collector = DataCollector()
+    if collector.request is None or getattr(self.query.model, '__module__', '') == 'silk.models' \
+            or len(collector.queries) >= settings.PROFILING_MAX_QUERIES:
+        return self._execute_sql(*args, **kwargs)
+    try:
+        sql, params = self.as_sql()
+    except Exception:
+        # e.g. EmptyResultSet, which execute_sql handles itself
+        return self._execute_sql(*args, **kwargs)
+    try:
+        query = sql % tuple(force_str(param) for param in params)
+    except (TypeError, ValueError):
+        query = sql
+    if any(ignored in query for ignored in SilkyConfig().SILKY_IGNORE_QUERIES):
+        return self._execute_sql(*args, **kwargs)
+
+    detailed = _detailed.get()
+    record = {
+        'query': query,
+        'start_time': timezone.now(),
+        'traceback': ''.join(reversed(traceback.format_stack())) if detailed else '',
+    }
+    try:
+        return self._execute_sql(*args, **kwargs)
+    finally:
+        record['end_time'] = timezone.now()
+        if detailed:
+            record['analysis'] = _explain_query(self.connection, sql, params)
+        collector.register_query(record)
+
+
+class RecordBuffer:
+    """
+    Finished request records held in memory and written to silk's tables in
+    bulk by a background thread. At most PROFILING_BUFFER_SIZE records are
+    kept; when the database can't keep up the oldest are dropped.
+    """
+
+    def __init__(self):
+        self.records = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.dropped = 0
+        self.flushed = 0
+
+    def add(self, record):
+        with self.lock:
+            if len(self.records) >= settings.PROFILING_BUFFER_SIZE:
+                self.records.popleft()
+                self.dropped += 1
+            self.records.append(record)
+            full = len(self.records) >= settings.PROFILING_FLUSH_SIZE
+        if settings.PROFILING_FLUSH_INTERVAL:
+            self.start()
+            if full:
+                self.wakeup.set()
+
+    def start(self):
+        # also restarts the thread in a forked worker process
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, name='profiling-flush', daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        # exits once the background flush is turned off
+        while settings.PROFILING_FLUSH_INTERVAL:
+            self.wakeup.wait(settings.PROFILING_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            if not settings.PROFILING_FLUSH_INTERVAL:
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('flushing profiling records failed')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write the buffered records with one INSERT per silk table; returns how many."""
+        with self.lock:
+            records = list(self.records)
+            self.records.clear()
+        if not records:
+            return 0
+        try:
+            with transaction.atomic():
+                silk_models.Request.objects.bulk_create([request for request, _, _ in records])
+                silk_models.Response.objects.bulk_create([response for _, response, _ in records])
+                # the manager's bulk_create updates the request once per query
+                silk_models.SQLQuery.objects.get_queryset().bulk_create(
+                    [query for _, _, queries in records for query in queries]
+                )
+        except DatabaseError:
+            self.dropped += len(records)
+            raise
+        self.flushed += len(records)
+        silk_models.Request.garbage_collect(force=False)
+        return len(records)
+
+    def stats(self):
+        return {'buffered': len(self.records), 'flushed': self.flushed, 'dropped': self.dropped}
+
+
+buffer = RecordBuffer()
+atexit.register(lambda: buffer.flush() if buffer.records else None)
+
+
+class SampledSilkyMiddleware(SilkyMiddleware):
+    """
+    Silk's middleware with a bounded cost, for use in production.
+
+    Only PROFILING_SAMPLE_RATE of the requests are recorded, plus every
+    request carrying the PROFILING_TRACE_HEADER (whose value must match
+    PROFILING_TRACE_TOKEN when that is set). Sampled requests record query
+    timings only; traced ones also get bodies, tracebacks, EXPLAIN output
+    and, with SILKY_PYTHON_PROFILER, a python profile. Nothing is written
+    while the request runs: the records are buffered and flushed in bulk off
+    the request thread.
+
+    Under ASGI the sampling decision is made on the event loop, and only
+    recorded requests hop to a thread: silk's DataCollector is thread-local,
+    so recording runs on the thread-sensitive thread the request's ORM calls
+    use.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        request.silk_filters = {}
+        if not self.sampled(request):
+            return await self.get_response(request)
+        await sync_to_async(self.intercept)(request)
+        response = await self.get_response(request)
+        return await sync_to_async(self.process_response)(request, response)
+
+    def process_request(self, request):
+        if self.sampled(request):
+            self.intercept(request)
+        else:
+            DataCollector().clear()
+
+    @staticmethod
+    def sampled(request):
+        return is_traced(request) or random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def intercept(self, request):
+        DataCollector().clear()
+        if not _should_intercept(request):
+            return
+
+        traced = is_traced(request)
+        request.silk_is_intercepted = True
+        _detailed.set(traced)
+        self._apply_dynamic_mappings()
+        if not hasattr(SQLCompiler, '_execute_sql'):
+            SQLCompiler._execute_sql = SQLCompiler.execute_sql
+            SQLCompiler.execute_sql = execute_sql
+
+        factory = RequestModelFactory(request)
+        # parsing and re-encoding bodies is the costly part, keep it to traced requests
+        body, raw_body = factory.body() if traced else ('', '')
+        request_model = silk_models.Request(
+            path=request.path, encoded_headers=factory.encoded_headers(), method=request.method,
+            query_params=factory.query_params(), view_name=factory.view_name(), body=body or '',
+        )
+        try:
+            request_model.raw_body = raw_body or ''
+        except UnicodeDecodeError:
+            pass
+        DataCollector().configure(request_model, should_profile=traced and SilkyConfig().SILKY_PYTHON_PROFILER)
+
+    def process_response(self, request, response):
+        if not getattr(request, 'silk_is_intercepted', False):
+            return response
+        if response.streaming and not response.is_async:
+            # a streaming response runs its queries while it's being consumed
+            response.streaming_content = self.finish_after(response.streaming_content, response)
+        else:
+            self.finish(response)
+        return response
+
+    def finish_after(self, content, response):
+        try:
+            yield from content
+        finally:
+            self.finish(response)
+
+    def finish(self, response):
+        collector = DataCollector()
+        try:
+            buffer.add(self.record(collector, response))
+        except Exception:
+            logger.exception('recording %s for profiling failed', collector.request.path)
+        finally:
+            collector.clear()
+            _detailed.set(False)
+
+    @staticmethod
+    def record(collector, response):
+        """Unsaved silk Request, Response and SQLQuery models of the finished request."""
+        collector.stop_python_profiler()
+        request = collector.request
+        request.end_time = timezone.now()
+        request.time_taken = (request.end_time - request.start_time).total_seconds() * 1000
+        request.path = request._shorten(request.path) if len(request.path) > 190 else request.path
+        if request.view_name and len(request.view_name) > 190:
+            request.view_name = request._shorten(request.view_name)
+        profiler = getattr(collector.local, 'pythonprofiler', None)
+        if profiler:
+            out = StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats()
+            request.pyprofile = '\n'.join(out.getvalue().split('\n')[:256])
+
+        queries = []
+        for identifier, query in collector.queries.items():
+            query = silk_models.SQLQuery(identifier=identifier, request=request, **query)
+            query.time_taken = (query.end_time - query.start_time).total_seconds() * 1000
+            queries.append(query)
+        request.num_sql_queries = len(queries)
+
+        body, content = ResponseModelFactory(response).body() if _detailed.get() else ('', b'')
+        if isinstance(content, str):
+            content = content.encode()
+        response_model = silk_models.Response(
+            request=request, status_code=response.status_code, body=body or '',
+            encoded_headers=json.dumps(dict(response.items()), ensure_ascii=SilkyConfig().SILKY_JSON_ENSURE_ASCII),
+            raw_body=base64.b64encode(content or b'').decode('ascii'),
+        )
+        return request, response_model, queries
@@ -0,0 +1,103 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+from api.cache import recently_bumped
+
+# database alias the current request reads from, set by ReplicaReadMixin
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def sticky_key(user_id):
+    return f'replica:sticky:user:{user_id}'
+
+
+@contextmanager
+def reads_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes always go to ``default``. Reads go to ``default`` too, unless a view
+    that opted in with ReplicaReadMixin pinned the request to a replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Serves GET/HEAD/OPTIONS requests of the view from one of
+    ``settings.DATABASE_REPLICAS``.
+
+    Authentication and permission checks still read from the primary. With
+    ``sticky_writes = True`` a successful write by a user sends that user's
+    reads back to the primary for ``REPLICA_STICKY_SECONDS``, so they never
+    see a replica that hasn't caught up with their own write.
+
+    ``replica_scopes`` lists the cache scopes the view's responses are cached
+    under (or is a callable returning them, as for cache_response). For
+    ``REPLICA_STICKY_SECONDS`` after any of them is bumped, everyone reads from
+    the primary, so a cache miss is never filled from a lagging replica and
+    then cached under the new version.
+    """
+    read_from_replica = True
+    sticky_writes = False
+    replica_scopes = None
+
+    def get_read_alias(self, request):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not (self.read_from_replica and replicas) or request.method not in SAFE_METHODS:
+            return None
+        if request.user.is_authenticated and cache.get(sticky_key(request.user.pk)):
+            return None
+        scopes = self.get_replica_scopes(request)
+        if scopes and recently_bumped(scopes):
+            return None
+        return random.choice(replicas)
+
+    def get_replica_scopes(self, request):
+        scopes = self.replica_scopes
+        return scopes(self, request, **self.kwargs) if callable(scopes) else scopes
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.read_alias = self.get_read_alias(request)
+        if self.read_alias:
+            self._read_token = _read_alias.set(self.read_alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_read_token', None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._read_token = None
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        if getattr(self, 'read_alias', None) and response.streaming:
+            # streamed bodies run their queries after the view returns
+            response.streaming_content = self.stream_from(self.read_alias, response.streaming_content)
+        elif self.sticky_writes and request.method not in SAFE_METHODS \
+                and response.status_code < 400 and request.user.is_authenticated:
+            cache.set(sticky_key(request.user.pk), True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    def stream_from(self, alias, content):
+        with reads_from(alias):
+            yield from content
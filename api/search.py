@@ -0,0 +1,119 @@
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+PRODUCT_FTS_TABLE = 'api_product_fts'
+# annotation holding a result's relevance; backends order on it, best first
+RANK_ANNOTATION = 'search_rank'
+# must stay identical to the expression indexed in migration 0003
+PRODUCT_TSVECTOR = (
+    "to_tsvector('english'::regconfig, "
+    "COALESCE(\"name\", '') || ' ' || COALESCE(\"description\", ''))"
+)
+
+
+class SQLiteSearchBackend:
+    """FTS5 virtual table holding a copy of name/description, keyed by product id."""
+    # bm25() is lower for better matches
+    ordering = (RANK_ANNOTATION, 'pk')
+
+    def filter(self, queryset, terms):
+        match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        rank = RawSQL(
+            f'SELECT bm25({PRODUCT_FTS_TABLE}) FROM {PRODUCT_FTS_TABLE} '
+            f'WHERE {PRODUCT_FTS_TABLE}.rowid = "api_product"."id" AND {PRODUCT_FTS_TABLE} MATCH %s',
+            [match], output_field=FloatField(),
+        )
+        matches = RawSQL(
+            f'SELECT rowid FROM {PRODUCT_FTS_TABLE} WHERE {PRODUCT_FTS_TABLE} MATCH %s', [match]
+        )
+        return queryset.filter(pk__in=matches).annotate(**{RANK_ANNOTATION: rank}).order_by(*self.ordering)
+
+    def index(self, product, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {PRODUCT_FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {PRODUCT_FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.pk, product.name, product.description],
+            )
+
+    def remove(self, product_id, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {PRODUCT_FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def reindex(self, queryset):
+        """Copy the products of ``queryset`` into the index again, e.g. after a bulk upsert."""
+        sql, params = queryset.values_list('id', 'name', 'description').query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {PRODUCT_FTS_TABLE} WHERE rowid IN (SELECT id FROM ({sql}))', params)
+            cursor.execute(f'INSERT INTO {PRODUCT_FTS_TABLE} (rowid, name, description) {sql}', params)
+
+    def rebuild(self, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {PRODUCT_FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {PRODUCT_FTS_TABLE} (rowid, name, description) '
+                'SELECT id, name, description FROM api_product'
+            )
+
+
+class PostgresSearchBackend:
+    """
+    Expression GIN index over a tsvector of name/description; the index
+    follows the table by itself, so there is nothing to sync.
+    """
+    ordering = (f'-{RANK_ANNOTATION}', 'pk')
+
+    def filter(self, queryset, terms):
+        query = ' '.join(terms)
+        matches = RawSQL(
+            f"{PRODUCT_TSVECTOR} @@ websearch_to_tsquery('english'::regconfig, %s)", [query],
+            output_field=BooleanField(),
+        )
+        rank = RawSQL(
+            f"ts_rank({PRODUCT_TSVECTOR}, websearch_to_tsquery('english'::regconfig, %s))", [query],
+            output_field=FloatField(),
+        )
+        return (
+            queryset.alias(search_match=matches).filter(search_match=True)
+            .annotate(**{RANK_ANNOTATION: rank}).order_by(*self.ordering)
+        )
+
+    def index(self, product, using):
+        pass
+
+    def remove(self, product_id, using):
+        pass
+
+    def reindex(self, queryset):
+        pass
+
+    def rebuild(self, using):
+        pass
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend(),
+    'postgresql': PostgresSearchBackend(),
+}
+
+
+def get_search_backend(using='default'):
+    """The full-text backend for a database alias, or None to fall back to LIKE."""
+    return BACKENDS.get(connections[using].vendor)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on products: ``?search=`` goes
+    through the database's full-text index and results come back ranked.
+    Databases without a backend keep SearchFilter's icontains behaviour.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        backend = get_search_backend(queryset.db)
+        if not terms or backend is None or queryset.model._meta.label != 'api.Product':
+            return super().filter_queryset(request, queryset, view)
+        return backend.filter(queryset, terms)
@@ -1,15 +1,19 @@
-from django.db import transaction
+from collections import defaultdict
+
+from django.db import models, transaction
 from rest_framework import serializers
-from .models import Product, Order, OrderItem, User
+from .compiled import CompiledSerializer
+from .fieldsets import SparseFieldsetSerializerMixin
+from .models import InsufficientStock, Product, Order, OrderItem, User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         exclude = ['password', 'user_permissions']
         # fields = '__all__'
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Product #the model
         fields = [
@@ -41,43 +45,133 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['product_name', 'product_price', 'quantity', 'item_subtotal']
         # item_subtotal comes from the OrderItem model
 
-class OrderCreateSerializer(serializers.ModelSerializer):
+class BulkProductField(serializers.PrimaryKeyRelatedField):
+    # reads the products resolved up front by OrderItemListSerializer
+    def to_internal_value(self, data):
+        products = getattr(self.parent, 'product_cache', None)
+        if products is not None and not isinstance(data, bool):
+            try:
+                return products[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class OrderItemListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        # validate every referenced product with a single query, or none when
+        # the caller (e.g. the batch endpoint) already resolved them
+        products = self.context.get('products')
+        if products is None:
+            products = self.fetch_products(data if isinstance(data, list) else [])
+        self.child.product_cache = products
+        try:
+            return super().to_internal_value(data)
+        finally:
+            self.child.product_cache = None
+
+    @staticmethod
+    def fetch_products(items):
+        ids = set()
+        for item in items:
+            try:
+                ids.add(int(item['product']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        return Product.objects.in_bulk(ids)
+
+
+class StockReservationMixin:
+    def adjust_stock(self, before, after):
+        try:
+            Product.objects.adjust_stock(before, after)
+        except InsufficientStock as exc:
+            raise serializers.ValidationError({'items': [str(exc)]})
+
+
+
+class OrderCreateSerializer(StockReservationMixin, serializers.ModelSerializer):
     #nested serializers
     class OrderItemSerializer(serializers.ModelSerializer):
+        product = BulkProductField(queryset=Product.objects.all())
+
         class Meta:
             model = OrderItem
             fields = ['product', 'quantity']
+            list_serializer_class = OrderItemListSerializer
 
     #nested serializers
     items = OrderItemSerializer(many=True, required=False)
     order_id = serializers.UUIDField(read_only=True)
 
     def update(self, instance, validated_data):
-        ordered_data = validated_data.pop('items')
+        ordered_data = validated_data.pop('items', None)
 
         # atomic transaction, just in case something fails
         with transaction.atomic():
+            before = instance.reserved_quantities()
             instance = super().update(instance, validated_data)
 
             if ordered_data is not None:
-                # clear the existing order items
-                instance.items.all().delete()
-                # create new order items
-                for item_data in ordered_data:
-                    OrderItem.objects.create(order=instance, **item_data)
+                self.sync_items(instance, ordered_data)
+            self.adjust_stock(before, instance.reserved_quantities())
 
         return instance
 
     def create(self, validated_data):
-        ordered_data = validated_data.pop('items')
+        ordered_data = validated_data.pop('items', [])
         with transaction.atomic():
             order = Order.objects.create(**validated_data)
-
-            for item_data in ordered_data:
-                OrderItem.objects.create(order=order, **item_data)
+            self.adjust_stock({}, order.reserved_quantities(
+                (item_data['product'].pk, item_data['quantity']) for item_data in ordered_data
+            ))
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, **item_data) for item_data in ordered_data
+            )
 
         return order
 
+    def sync_items(self, order, ordered_data):
+        """
+        Diff the submitted items against the stored ones and only write the
+        rows that changed: matching products keep their row, leftover rows are
+        reused for new products, then the rest is deleted or bulk created.
+        """
+        by_product = defaultdict(list)
+        for item in order.items.order_by('pk'):
+            by_product[item.product_id].append(item)
+
+        unmatched = []
+        changed = []
+        for item_data in ordered_data:
+            candidates = by_product.get(item_data['product'].pk)
+            if not candidates:
+                unmatched.append(item_data)
+                continue
+            item = candidates.pop(0)
+            if item.quantity != item_data['quantity']:
+                item.quantity = item_data['quantity']
+                changed.append(item)
+
+        existing = [item for items in by_product.values() for item in items]
+        created = []
+        for item_data in unmatched:
+            if existing:
+                item = existing.pop()
+                item.product = item_data['product']
+                item.quantity = item_data['quantity']
+                changed.append(item)
+            else:
+                created.append(OrderItem(order=order, **item_data))
+
+        if changed:
+            OrderItem.objects.bulk_update(changed, ['product', 'quantity'])
+        if existing:
+            # through the related manager so the deleted items keep `order` cached
+            order.items.filter(pk__in=[item.pk for item in existing]).delete()
+        if created:
+            OrderItem.objects.bulk_create(created)
+
     # the obj parameter is the Order instance 
     def get_total_price(self, obj):
         order_items = obj.items.all()
@@ -94,17 +188,34 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         }
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetSerializerMixin, StockReservationMixin, serializers.ModelSerializer):
     order_id = serializers.UUIDField(read_only=True)
 
     #nested serializers
     items = OrderItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
+    item_count = serializers.SerializerMethodField()
+
+    def update(self, instance, validated_data):
+        # status changes (e.g. cancelling) release or re-reserve the order's stock
+        with transaction.atomic():
+            before = instance.reserved_quantities()
+            instance = super().update(instance, validated_data)
+            self.adjust_stock(before, instance.reserved_quantities())
+        return instance
 
     # the obj parameter is the Order instance 
     def get_total_price(self, obj):
+        # use the SQL aggregate from Order.objects.with_totals() when present
+        if hasattr(obj, 'total_price'):
+            return obj.total_price if obj.total_price is not None else 0
         order_items = obj.items.all()
         return sum(order_item.item_subtotal for order_item in order_items)
+
+    def get_item_count(self, obj):
+        if hasattr(obj, 'item_count'):
+            return obj.item_count
+        return len(obj.items.all())
     
     class Meta:
         model = Order
@@ -114,13 +225,38 @@ class OrderSerializer(serializers.ModelSerializer):
             'user', 
             'status', 
             'items',
-            'total_price'
+            'total_price',
+            'item_count',
             ]
         
 class ProductInfoSerializer(serializers.Serializer):
     #get all products, count of products, max price of product
 
-    # nested serializers
-    products = ProductSerializer(many=True)
+    # nested serializers, only when asked for with ?products=true
+    products = ProductSerializer(many=True, required=False)
     count = serializers.IntegerField()
-    max_price = serializers.DecimalField(max_digits=10, decimal_places=2)
\ No newline at end of file
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    avg_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    in_stock_count = serializers.IntegerField()
+
+
+# compiled fast-path serializers for the read-only list endpoints
+class CompiledProductSerializer(CompiledSerializer):
+    serializer_class = ProductSerializer
+
+
+class CompiledOrderItemSerializer(CompiledSerializer):
+    serializer_class = OrderItemSerializer
+    # same value as the OrderItem.item_subtotal property, computed by the db
+    expressions = {
+        'item_subtotal': models.ExpressionWrapper(
+            models.F('product__price') * models.F('quantity'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+    }
+
+
+class CompiledOrderSerializer(CompiledSerializer):
+    serializer_class = OrderSerializer
+    nested = {'items': CompiledOrderItemSerializer}
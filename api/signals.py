@@ -1,11 +1,89 @@
+from django.db.backends.signals import connection_created
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
-from api.models import Product
-from django.core.cache import cache
+from api.authentication import invalidate_cached_user
+from api.budget import install_query_counter
+from api.cache import bump_version
+from api.conditional import invalidate_product_validators
+from api.connections import record_connection
+from api.models import Order, OrderItem, Product, User
+from api.search import get_search_backend
+from api.stats import product_deleted, product_saved
+
 
 @receiver([post_save, post_delete], sender=Product)
-def invalidate_cache(sender, instance, **kwargs):
-    print("Clearing cache")
+def invalidate_product_cache(sender, instance, created=False, **kwargs):
+    scopes = ['product', f'product:{instance.pk}']
+    if not created and catalog_changed(instance):
+        scopes.append('catalog')
+    bump_version(*scopes)
+    invalidate_product_validators(instance.pk)
+
+
+def catalog_changed(instance):
+    # whether the name or price shown in orders changed; registered before
+    # update_product_stats_on_save, which moves _loaded_values on
+    old = getattr(instance, '_loaded_values', None)
+    if old is None:
+        return True
+    price = instance._meta.get_field('price').to_python(instance.price)
+    return old['name'] != instance.name or old['price'] != price
+
+
+@receiver(post_save, sender=Product)
+def update_product_stats_on_save(sender, instance, created, **kwargs):
+    product_saved(instance, created)
+
+
+@receiver(post_delete, sender=Product)
+def update_product_stats_on_delete(sender, instance, **kwargs):
+    product_deleted(instance)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, **kwargs):
+    backend = get_search_backend(using)
+    if backend is not None:
+        backend.index(instance, using)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    backend = get_search_backend(using)
+    if backend is not None:
+        backend.remove(instance.pk, using)
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_order_cache(sender, instance, **kwargs):
+    bump_version('order', f'order:user:{instance.user_id}')
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def invalidate_order_item_cache(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Order):
+        # deleted along with its order, whose own signal bumps the same scopes
+        return
+    if OrderItem.order.is_cached(instance):
+        user_id = instance.order.user_id
+    else:
+        user_id = Order.objects.filter(pk=instance.order_id).values_list('user_id', flat=True).first()
+    bump_version('order', f'order:user:{user_id}')
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    # covers deactivation and password changes, both saved through the model
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(connection_created)
+def count_database_connection(sender, connection, **kwargs):
+    record_connection(connection.alias)
+
 
-    cache.delete_pattern('*product_list*')
\ No newline at end of file
+@receiver(connection_created)
+def count_queries_on_connection(sender, connection, **kwargs):
+    # for api.budget.QueryUsage, whichever thread the connection is used on
+    install_query_counter(connection)
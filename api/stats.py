@@ -0,0 +1,126 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+
+STATS_KEY = 'product_stats'
+# the additive stats live in keys of their own, so writes can apply their
+# deltas atomically with cache.incr
+COUNTER_KEYS = {
+    'count': 'product_stats:count',
+    'price_cents': 'product_stats:price_cents',
+    'in_stock_count': 'product_stats:in_stock_count',
+}
+# upper bound on drift from writes that skip signals (bulk_create, queryset updates)
+STATS_TIMEOUT = 60 * 60
+CENTS = Decimal('0.01')
+
+
+def get_product_stats():
+    """
+    Catalogue statistics, computed with one aggregate query on a cache miss
+    and then kept up to date by ``product_saved``/``product_deleted``.
+    """
+    keys = [STATS_KEY, *COUNTER_KEYS.values()]
+    cached = cache.get_many(keys)
+    if len(cached) == len(keys):
+        stats = {**cached[STATS_KEY], **{name: cached[key] for name, key in COUNTER_KEYS.items()}}
+    else:
+        stats = compute_product_stats()
+        cache.set_many({
+            STATS_KEY: {'max_price': stats['max_price'], 'min_price': stats['min_price']},
+            **{key: stats[name] for name, key in COUNTER_KEYS.items()},
+        }, STATS_TIMEOUT)
+    return present(stats)
+
+
+def compute_product_stats():
+    # imported here so api.models can import this module for signal handlers
+    from api.models import Product
+
+    row = Product.objects.aggregate(
+        count=Count('pk'),
+        max_price=Max('price'),
+        min_price=Min('price'),
+        price_sum=Sum('price'),
+        in_stock_count=Count('pk', filter=Q(stock__gt=0)),
+    )
+    row['price_cents'] = cents(row.pop('price_sum') or Decimal('0'))
+    return row
+
+
+def present(stats):
+    count = stats['count']
+    return {
+        'count': count,
+        'max_price': stats['max_price'],
+        'min_price': stats['min_price'],
+        'avg_price': (Decimal(stats['price_cents']) * CENTS / count).quantize(CENTS) if count else None,
+        'in_stock_count': stats['in_stock_count'],
+    }
+
+
+def cents(price):
+    return int(price / CENTS)
+
+
+def product_saved(instance, created):
+    old = getattr(instance, '_loaded_values', None)
+    price = instance._meta.get_field('price').to_python(instance.price)
+    # ints, not bools: redis-py refuses a bool increment
+    in_stock = int(instance.stock > 0)
+    instance._loaded_values = {'name': instance.name, 'price': price, 'stock': instance.stock}
+
+    if created:
+        old_price = None
+        deltas = {'count': 1, 'price_cents': cents(price), 'in_stock_count': in_stock}
+    elif old is None:
+        return invalidate_product_stats()
+    else:
+        old_price = old['price']
+        deltas = {'price_cents': cents(price) - cents(old_price), 'in_stock_count': in_stock - int(old['stock'] > 0)}
+    transaction.on_commit(lambda: apply_deltas(deltas, old_price, price))
+
+
+def product_deleted(instance):
+    deltas = {'count': -1, 'price_cents': -cents(instance.price), 'in_stock_count': -int(instance.stock > 0)}
+    transaction.on_commit(lambda: apply_deltas(deltas, instance.price, None))
+
+
+def stock_availability_changed(delta):
+    """Products sold out (negative) or back in stock through queryset updates."""
+    if delta:
+        transaction.on_commit(lambda: apply_deltas({'in_stock_count': delta}))
+
+
+def apply_deltas(deltas, old_price=None, price=None):
+    # runs once committed, so a rollback never reaches the cached stats
+    if old_price != price:
+        extremes = cache.get(STATS_KEY)
+        if extremes is None:
+            return
+        if moves_extremes(extremes, old_price, price):
+            # the new max or min is unknown without a scan
+            return invalidate_product_stats()
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(COUNTER_KEYS[name], delta)
+        except ValueError:
+            # evicted: the next read aggregates again
+            return invalidate_product_stats()
+
+
+def moves_extremes(extremes, old_price, price):
+    max_price, min_price = extremes['max_price'], extremes['min_price']
+    if max_price is None:
+        return True
+    if price is not None and not min_price <= price <= max_price:
+        return True
+    return old_price in (max_price, min_price)
+
+
+def invalidate_product_stats():
+    cache.delete_many([STATS_KEY, *COUNTER_KEYS.values()])
@@ -0,0 +1,63 @@
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+
+class StreamingListModelMixin:
+    """
+    Streams unpaginated list responses as a JSON array.
+
+    The queryset is read with ``.iterator(chunk_size=...)`` and every chunk is
+    serialized and rendered on its own, so memory stays flat however large the
+    result set is. Filter backends, permissions and pagination still apply;
+    paginated pages and non-JSON renderers (e.g. the browsable API) get the
+    regular response.
+    """
+    stream_list = True
+    stream_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        if not self.should_stream(request):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        return self.streaming_response(queryset)
+
+    def should_stream(self, request):
+        renderer = getattr(request, 'accepted_renderer', None)
+        return self.stream_list and isinstance(renderer, JSONRenderer)
+
+    def streaming_response(self, queryset):
+        renderer = self.request.accepted_renderer
+        return StreamingHttpResponse(
+            self.stream_json(queryset, renderer, self.get_renderer_context()),
+            content_type=renderer.media_type,
+        )
+
+    def stream_json(self, queryset, renderer, renderer_context):
+        yield b'['
+        separator = b''
+        for data in self.iter_serialized_chunks(queryset):
+            # render the chunk as a list and drop the surrounding brackets
+            body = renderer.render(data, renderer.media_type, renderer_context)
+            yield separator + body[1:-1]
+            separator = b','
+        yield b']'
+
+    def iter_serialized_chunks(self, queryset):
+        compiled_class = getattr(self, 'compiled_serializer_class', None)
+        if compiled_class is not None:
+            compiled = compiled_class(context=self.get_serializer_context())
+            compiled.chunk_size = self.stream_chunk_size
+            yield from compiled.iter_chunks(queryset)
+            return
+
+        objects = queryset.iterator(chunk_size=self.stream_chunk_size)
+        while chunk := list(islice(objects, self.stream_chunk_size)):
+            yield self.get_serializer(chunk, many=True).data
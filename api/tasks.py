@@ -1,12 +1,29 @@
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.conf import settings
 
 
+def confirmation_message(order_id):
+    return 'Order confirmation', f'Order #{order_id} has been successfully placed.'
+
+
 @shared_task
 def send_order_confirmation_email(order_id, user_email):
-    subject = 'Order confirmation'
-    message = f'Order #{order_id} has been successfully placed.'
+    subject, message = confirmation_message(order_id)
     from_email = settings.DEFAULT_FROM_EMAIL
     recipient_list = [user_email]
-    return send_mail(subject, message, from_email, recipient_list)
\ No newline at end of file
+    return send_mail(subject, message, from_email, recipient_list)
+
+
+@shared_task
+def send_order_confirmation_emails(orders):
+    """Confirmation emails for ``[[order_id, email], ...]`` over a single SMTP connection."""
+    messages = [
+        EmailMessage(*confirmation_message(order_id), settings.DEFAULT_FROM_EMAIL, [email])
+        for order_id, email in orders
+        if email
+    ]
+    if not messages:
+        return 0
+    with get_connection() as connection:
+        return connection.send_messages(messages)
@@ -1,9 +1,80 @@
-from django.test import TestCase
-from api.models import Order, User
+import csv
+import datetime
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from io import StringIO
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
+
+import orjson
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from api.filters import OrderFilter, ProductFilter
+from api.renderers import MessagePackRenderer, ORJSONRenderer, msgpack
+from api.models import Order, OrderItem, OutboxMessage, Product, User
+from api.budget import QueryBudgetExceeded
+from api.metrics import MetricsMiddleware
+from api.connections import SharedConnectionFactory, connections_opened, get_redis_pool
+from api import profiling
+from api.authentication import CachedJWTAuthentication, token_cache, user_cache_key
+from api.async_views import AsyncOrderListAPIView
+from api.cache import bumped_key, version_key
+from api.conditional import validators_key
+from api.outbox import relay
+from api.search import SQLiteSearchBackend
+from api.stats import get_product_stats
+from api.tasks import send_order_confirmation_emails
+from api.transfer import Checkpoint, ProductExporter
+from api.views import ProductDetailAPIView, ProductListCreateAPIView
+from api.serializers import (CompiledOrderSerializer, CompiledProductSerializer,
+                             OrderSerializer, ProductSerializer)
 from django.urls import reverse
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+from prometheus_client import REGISTRY
+from silk import models as silk_models
+from silk.collector import DataCollector
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+def reset_silk():
+    # silk keeps the last request in a thread local and EXPLAINs every query
+    # while it is set, which skews query counts
+    DataCollector().clear()
+
+
+def read_json(response):
+    if response.streaming:
+        return json.loads(b''.join(response.streaming_content))
+    return response.json()
+
+
+async def aread_json(response):
+    if response.streaming:
+        return json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+    return response.json()
 
 # Create your tests here.
+@override_settings(CACHES=LOCMEM_CACHES)
 class UserOrderTestCase(TestCase):
     def setUp(self):
         user1 = User.objects.create_user(username='user1', password='test')
@@ -25,4 +96,1563 @@ class UserOrderTestCase(TestCase):
 
     def test_user_order_list_unauthenticated(self):
         response = self.client.get(reverse('user-orders'))
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        Product.objects.bulk_create(
+            Product(name=f'Product {i}', description='desc', price=Decimal('1.00') * i, stock=1)
+            for i in range(7)
+        )
+        for _ in range(5):
+            Order.objects.create(user=self.user)
+
+    def walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            body = response.json()
+            self.assertNotIn('count', body)
+            seen.append(body)
+            url = body['next']
+        return seen
+
+    def test_unpaginated_without_cursor_params(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/orders/')
+        self.assertIsInstance(read_json(response), list)
+
+    def test_order_pages_cover_all_orders_once(self):
+        self.client.force_login(self.user)
+        pages = self.walk('/orders/?page_size=2')
+        ids = [order['order_id'] for page in pages for order in page['results']]
+        expected = Order.objects.order_by('-created_at', '-order_id').values_list('order_id', flat=True)
+        self.assertEqual(ids, [str(order_id) for order_id in expected])
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_product_previous_link_returns_same_page(self):
+        pages = self.walk('/products/?page_size=3&ordering=-price')
+        self.assertEqual(len(pages), 3)
+        prices = [p['price'] for page in pages for p in page['results']]
+        self.assertEqual(prices, sorted(prices, key=Decimal, reverse=True))
+        response = self.client.get(pages[1]['previous'])
+        self.assertEqual(response.json()['results'], pages[0]['results'])
+
+    def test_tampered_cursor_is_rejected(self):
+        response = self.client.get('/products/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OrderTotalsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        Product.objects.bulk_create([
+            Product(name='A', description='desc', price=Decimal('12.99'), stock=5),
+            Product(name='B', description='desc', price=Decimal('0.10'), stock=5),
+        ])
+        a, b = Product.objects.order_by('name')
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product=a, quantity=3)
+        OrderItem.objects.create(order=self.order, product=b, quantity=7)
+        self.empty_order = Order.objects.create(user=self.user)
+
+    def test_annotated_total_matches_python_total(self):
+        for order in Order.objects.with_totals():
+            fallback = OrderSerializer(Order.objects.get(pk=order.pk)).data
+            annotated = OrderSerializer(order).data
+            self.assertEqual(annotated['total_price'], fallback['total_price'])
+            self.assertEqual(annotated['item_count'], fallback['item_count'])
+
+        self.assertEqual(Order.objects.with_totals().get(pk=self.order.pk).total_price, Decimal('39.67'))
+
+    def test_list_reports_totals(self):
+        self.client.force_login(self.user)
+        orders = {o['order_id']: o for o in read_json(self.client.get('/orders/'))}
+        self.assertEqual(orders[str(self.order.pk)]['total_price'], 39.67)
+        self.assertEqual(orders[str(self.order.pk)]['item_count'], 2)
+        self.assertEqual(orders[str(self.empty_order.pk)]['total_price'], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CompiledSerializerTestCase(TestCase):
+    def setUp(self):
+        reset_silk()
+        self.user = User.objects.create_user(username='user1', password='test')
+        Product.objects.bulk_create([
+            Product(name='A', description='desc', price=Decimal('12.99'), stock=5),
+            Product(name='B', description='', price=Decimal('0.10'), stock=0),
+        ])
+        a, b = Product.objects.order_by('name')
+        for quantity in range(1, 4):
+            order = Order.objects.create(user=self.user, status=Order.StatusChoices.CONFIRMED)
+            OrderItem.objects.create(order=order, product=a, quantity=quantity)
+            OrderItem.objects.create(order=order, product=b, quantity=quantity * 2)
+        Order.objects.create(user=self.user)
+
+    def assertSameJSON(self, compiled, serializer_class, queryset):
+        renderer = JSONRenderer()
+        expected = renderer.render(serializer_class(queryset, many=True).data)
+        self.assertEqual(renderer.render(compiled().serialize(queryset)), expected)
+
+    def test_products_render_identically(self):
+        self.assertSameJSON(CompiledProductSerializer, ProductSerializer, Product.objects.order_by('pk'))
+
+    def test_orders_render_identically(self):
+        queryset = Order.objects.with_totals().prefetch_related('items__product')
+        self.assertSameJSON(CompiledOrderSerializer, OrderSerializer, queryset)
+
+    def test_orders_use_constant_queries(self):
+        with self.assertNumQueries(2):
+            CompiledOrderSerializer().serialize(Order.objects.with_totals())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StreamingListTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        Product.objects.bulk_create(
+            Product(name=f'Product {i}', description='desc', price=Decimal('2.50'), stock=i % 3)
+            for i in range(12)
+        )
+
+    def test_list_is_streamed_in_chunks(self):
+        with patch.object(ProductListCreateAPIView, 'stream_chunk_size', 5):
+            response = self.client.get('/products/')
+            self.assertTrue(response.streaming)
+            chunks = list(response.streaming_content)
+        # opening bracket, two chunks of in-stock products, closing bracket
+        self.assertEqual(len(chunks), 4)
+        products = json.loads(b''.join(chunks))
+        # InStockFilterBackend still applies
+        self.assertEqual(len(products), 8)
+        expected = ProductSerializer(Product.objects.filter(stock__gt=0).order_by('pk'), many=True).data
+        self.assertEqual(products, json.loads(JSONRenderer().render(expected)))
+
+    def test_empty_list(self):
+        User.objects.all().delete()
+        response = self.client.get('/users/')
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+
+    def test_permissions_still_apply(self):
+        response = self.client.get('/orders/user-orders/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VersionedCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.other = User.objects.create_user(username='user2', password='test')
+        self.product = Product.objects.create(name='A', description='desc', price=Decimal('1.00'), stock=3)
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+
+    def get(self, url):
+        response = self.client.get(url)
+        return response['X-Cache'], read_json(response)
+
+    def test_product_save_invalidates_list_and_detail(self):
+        detail = f'/products/{self.product.pk}/'
+        self.assertEqual(self.get('/products/')[0], 'MISS')
+        self.assertEqual(self.get('/products/')[0], 'HIT')
+        self.assertEqual(self.get(detail)[0], 'MISS')
+        self.assertEqual(self.get(detail)[0], 'HIT')
+
+        self.product.name = 'B'
+        self.product.save()
+        self.assertEqual(self.get('/products/'), ('MISS', [ProductSerializer(self.product).data]))
+        self.assertEqual(self.get(detail)[1]['name'], 'B')
+
+    def test_order_list_is_cached_per_user(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.get('/orders/')[0], 'MISS')
+        self.assertEqual(len(self.get('/orders/')[1]), 1)
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.get('/orders/'), ('MISS', []))
+
+    def test_order_item_change_invalidates_owner_orders(self):
+        self.client.force_login(self.user)
+        self.get('/orders/')
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        cache_status, orders = self.get('/orders/')
+        self.assertEqual(cache_status, 'MISS')
+        self.assertEqual(orders[0]['item_count'], 2)
+
+    def test_checkout_keeps_other_caches(self):
+        other_product = Product.objects.create(name='B', description='desc', price=Decimal('2.00'), stock=3)
+        detail = f'/products/{self.product.pk}/'
+        self.client.force_login(self.user)
+        for url in ('/orders/', '/products/', detail, f'/products/{other_product.pk}/'):
+            self.get(url)
+
+        self.client.force_login(self.other)
+        self.client.post('/orders/', {'items': [{'product': self.product.pk, 'quantity': 1}]},
+                         content_type='application/json')
+        self.client.force_login(self.user)
+        self.assertEqual(self.get('/orders/')[0], 'HIT')
+        self.assertEqual(self.get(f'/products/{other_product.pk}/')[0], 'HIT')
+        cache_status, data = self.get(detail)
+        self.assertEqual((cache_status, data['stock']), ('MISS', 2))
+        # lists render stock
+        cache_status, products = self.get('/products/')
+        stock = {product['name']: product['stock'] for product in products}
+        self.assertEqual((cache_status, stock), ('MISS', {'A': 2, 'B': 3}))
+
+        # selling out drops the product from cached lists
+        self.client.force_login(self.other)
+        self.client.post('/orders/', {'items': [{'product': self.product.pk, 'quantity': 2}]},
+                         content_type='application/json')
+        self.assertEqual(self.get('/products/'), ('MISS', [ProductSerializer(other_product).data]))
+
+    def test_product_rename_invalidates_orders(self):
+        self.client.force_login(self.user)
+        self.get('/orders/')
+        self.product.stock = 10
+        self.product.save()
+        self.assertEqual(self.get('/orders/')[0], 'HIT')
+
+        self.product.name = 'Renamed'
+        self.product.save()
+        cache_status, orders = self.get('/orders/')
+        self.assertEqual(cache_status, 'MISS')
+        self.assertEqual(orders[0]['items'][0]['product_name'], 'Renamed')
+
+    def test_order_list_conditional_get(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/orders/')
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        response = self.client.get('/orders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # the ETag is per user
+        self.client.force_login(self.other)
+        response = self.client.get('/orders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # and per data version
+        self.client.force_login(self.user)
+        self.order.status = Order.StatusChoices.CONFIRMED
+        self.order.save()
+        response = self.client.get('/orders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_order_filter_params_are_normalized(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.get('/orders/?status=pending&created_at=')[0], 'MISS')
+        self.assertEqual(self.get('/orders/?utm=1&status=pending')[0], 'HIT')
+        self.assertEqual(self.get('/orders/?status=confirmed'), ('MISS', []))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@modify_settings(MIDDLEWARE={'remove': 'api.profiling.SampledSilkyMiddleware'})
+class BulkOrderWriteTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_silk()
+        self.user = User.objects.create_user(username='user1', password='test')
+        Product.objects.bulk_create(
+            Product(name=f'Product {i}', description='desc', price=Decimal('1.00'), stock=100)
+            for i in range(60)
+        )
+        self.product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        self.client.force_login(self.user)
+
+    def post_order(self, count):
+        items = [{'product': pk, 'quantity': 1} for pk in self.product_ids[:count]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/orders/', {'status': 'pending', 'items': items}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json(), len(queries)
+
+    def test_create_uses_constant_queries(self):
+        _, small = self.post_order(2)
+        order, large = self.post_order(50)
+        self.assertEqual(small, large)
+        self.assertEqual(OrderItem.objects.filter(order_id=order['order_id']).count(), 50)
+
+    def test_invalid_product_is_reported(self):
+        items = [{'product': self.product_ids[0], 'quantity': 1}, {'product': 999999, 'quantity': 1}]
+        response = self.client.post('/orders/', {'items': items}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('999999', str(response.json()['items'][1]['product']))
+
+    def test_update_only_writes_changed_items(self):
+        order, _ = self.post_order(3)
+        before = {item.product_id: item.pk for item in OrderItem.objects.filter(order_id=order['order_id'])}
+        a, b, c, d = self.product_ids[:4]
+        items = [
+            {'product': a, 'quantity': 1},   # unchanged
+            {'product': b, 'quantity': 5},   # quantity changed
+            {'product': d, 'quantity': 2},   # replaces c
+        ]
+        response = self.client.put(
+            f"/orders/{order['order_id']}/", {'status': 'pending', 'items': items}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        after = {item.product_id: (item.pk, item.quantity) for item in OrderItem.objects.filter(order_id=order['order_id'])}
+        self.assertEqual(after, {a: (before[a], 1), b: (before[b], 5), d: (before[c], 2)})
+
+    def test_batch_reports_per_order_results(self):
+        a, b = self.product_ids[:2]
+        entries = [
+            {'status': 'pending', 'items': [{'product': a, 'quantity': 1}]},
+            {'status': 'bogus', 'items': [{'product': b, 'quantity': 1}]},
+            {'items': [{'product': b, 'quantity': 2}, {'product': a, 'quantity': 1}]},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/orders/batch/', entries, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], [201, 400, 201])
+        self.assertIn('status', results[1]['errors'])
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 2)
+        # products are looked up once for the whole batch
+        product_queries = [q for q in queries if q['sql'].startswith('SELECT "api_product"."id", "api_product"."sku"')]
+        self.assertEqual(len(product_queries), 1)
+        # confirmations are queued with one outbox insert
+        outbox_inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "api_outboxmessage"')]
+        self.assertEqual(len(outbox_inserts), 1)
+        self.assertEqual(
+            sorted(m.payload['order_id'] for m in OutboxMessage.objects.all()),
+            sorted(r['order_id'] for r in results if 'order_id' in r),
+        )
+
+    def test_batch_requires_a_list(self):
+        response = self.client.post('/orders/batch/', {'items': []}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StockReservationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.product = Product.objects.create(name='A', description='desc', price=Decimal('1.00'), stock=5)
+        self.client.force_login(self.user)
+
+    def order(self, quantity, **extra):
+        return self.client.post('/orders/', {
+            'items': [{'product': self.product.pk, 'quantity': quantity}], **extra,
+        }, content_type='application/json')
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock
+
+    def test_order_reserves_stock(self):
+        self.assertEqual(self.order(3).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(), 2)
+
+    def test_oversell_is_rejected(self):
+        response = self.order(6)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stock(), 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancelling_releases_stock(self):
+        order_id = self.order(4).json()['order_id']
+        response = self.client.patch(f'/orders/{order_id}/', {'status': 'cancelled'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.stock(), 5)
+
+        # un-cancelling reserves again
+        self.client.patch(f'/orders/{order_id}/', {'status': 'pending'}, content_type='application/json')
+        self.assertEqual(self.stock(), 1)
+
+    def test_deleting_releases_stock(self):
+        order_id = self.order(3).json()['order_id']
+        self.assertEqual(self.stock(), 2)
+        response = self.client.delete(f'/orders/{order_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.stock(), 5)
+
+        # a cancelled order already gave its stock back
+        order_id = self.order(3).json()['order_id']
+        self.client.patch(f'/orders/{order_id}/', {'status': 'cancelled'}, content_type='application/json')
+        self.client.delete(f'/orders/{order_id}/')
+        self.assertEqual(self.stock(), 5)
+
+    def test_updating_items_adjusts_reservation(self):
+        order_id = self.order(2).json()['order_id']
+        self.client.put(f'/orders/{order_id}/', {
+            'status': 'pending', 'items': [{'product': self.product.pk, 'quantity': 5}],
+        }, content_type='application/json')
+        self.assertEqual(self.stock(), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StockConcurrencyTestCase(TransactionTestCase):
+    def test_concurrent_checkouts_never_oversell(self):
+        out = StringIO()
+        call_command('stress_stock', threads=8, orders=60, stock=25, stdout=out)
+        self.assertIn('sold=25 remaining=0 oversold=0', out.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, QUERY_BUDGET_ENFORCE=True)
+@modify_settings(MIDDLEWARE={'remove': 'api.profiling.SampledSilkyMiddleware'})
+class QueryBudgetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_silk()
+        self.user = User.objects.create_user(username='user1', password='test')
+        Product.objects.bulk_create(
+            Product(name=f'Product {i}', description='desc', price=Decimal('1.00'), stock=50)
+            for i in range(30)
+        )
+        products = list(Product.objects.all())
+        for _ in range(10):
+            order = Order.objects.create(user=self.user)
+            OrderItem.objects.bulk_create(OrderItem(order=order, product=p, quantity=1) for p in products[:5])
+        self.client.force_login(self.user)
+
+    def test_endpoints_stay_within_budget(self):
+        product = Product.objects.first()
+        for url in ['/products/', '/products/?page_size=10', f'/products/{product.pk}/',
+                    '/orders/', '/orders/?page_size=5', '/orders/user-orders/']:
+            response = self.client.get(url)
+            read_json(response)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+
+    def test_product_writes_stay_within_budget(self):
+        # not in any order, so the delete cascades to nothing
+        product = Product.objects.last()
+        self.client.force_login(User.objects.create_superuser(username='admin', password='test'))
+        url = f'/products/{product.pk}/'
+        payload = {'name': 'Renamed', 'description': 'desc', 'price': '2.00', 'stock': 50}
+        response = self.client.put(url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response['X-Query-Budget'], r'^queries=\d+/9;')
+        response = self.client.patch(url, {'stock': 3}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_order_writes_stay_within_budget(self):
+        product = Product.objects.last()
+        response = self.client.post('/orders/', {'items': [{'product': product.pk, 'quantity': 1}]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertRegex(response['X-Query-Budget'], r'^queries=\d+/13;')
+        # five items, deleted with their order rather than one by one
+        order = Order.objects.filter(user=self.user).first()
+        response = self.client.delete(f'/orders/{order.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertRegex(response['X-Query-Budget'], r'^queries=\d+/13;')
+
+    def test_header_reports_usage(self):
+        response = self.client.get('/orders/?page_size=5')
+        self.assertRegex(response['X-Query-Budget'], r'^queries=\d+/12; db=[\d.]+/200ms; total=[\d.]+/-ms$')
+
+    def test_time_budgets_only_log_in_tests(self):
+        with patch.object(ProductDetailAPIView, 'max_duration_ms', 0.001):
+            response = self.client.get(f'/products/{Product.objects.first().pk}/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with override_settings(QUERY_BUDGET_ENFORCE_TIMINGS=True):
+                with self.assertRaises(QueryBudgetExceeded):
+                    self.client.get(f'/products/{Product.objects.first().pk}/')
+
+    def test_n_plus_one_fails(self):
+        def per_row_query(view, request, *args, **kwargs):
+            for product in Product.objects.all():
+                Product.objects.get(pk=product.pk)
+            return Response([])
+
+        with patch.object(ProductDetailAPIView, 'get', per_row_query):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/products/1/')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@modify_settings(MIDDLEWARE={'remove': 'api.profiling.SampledSilkyMiddleware'})
+class ProductInfoTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_silk()
+        for price, stock in [('10.00', 1), ('20.00', 0), ('30.00', 5)]:
+            Product.objects.create(name=f'P{price}', description='desc', price=Decimal(price), stock=stock)
+
+    def assertStatsMatchDatabase(self):
+        cached = get_product_stats()
+        cache.clear()
+        self.assertEqual(cached, get_product_stats())
+
+    def test_stats_use_one_query(self):
+        with self.assertNumQueries(1):
+            info = self.client.get('/products/info/').json()
+        self.assertEqual(info, {
+            'count': 3, 'max_price': '30.00', 'min_price': '10.00',
+            'avg_price': '20.00', 'in_stock_count': 2,
+        })
+        # served from the cache afterwards
+        with self.assertNumQueries(0):
+            self.client.get('/products/info/')
+
+    def test_products_are_optional_and_paginated(self):
+        info = self.client.get('/products/info/?products=true&page_size=2').json()
+        self.assertEqual([p['name'] for p in info['products']], ['P10.00', 'P20.00'])
+        info = self.client.get(info['next']).json()
+        self.assertEqual([p['name'] for p in info['products']], ['P30.00'])
+        self.assertIsNone(info['next'])
+
+    def test_stats_follow_product_writes(self):
+        get_product_stats()
+        product = Product.objects.get(name='P20.00')
+        product.stock = 3
+        product.price = Decimal('25.00')
+        # deltas are applied once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertStatsMatchDatabase()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='P15', description='desc', price=Decimal('15.00'), stock=0)
+        # still cached
+        with self.assertNumQueries(0):
+            get_product_stats()
+        self.assertStatsMatchDatabase()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(name='P30.00').delete()
+        self.assertStatsMatchDatabase()
+        self.assertEqual(get_product_stats()['max_price'], Decimal('25.00'))
+
+    def test_rolled_back_writes_leave_stats_alone(self):
+        stats = get_product_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError):
+                with transaction.atomic():
+                    Product.objects.create(name='P15', description='desc', price=Decimal('15.00'), stock=1)
+                    raise DatabaseError()
+        self.assertEqual(get_product_stats(), stats)
+
+    def test_deltas_are_ints(self):
+        get_product_stats()
+        incr = cache.incr
+
+        def redis_incr(key, delta=1, **kwargs):
+            # redis-py rejects bools: "Invalid input of type: 'bool'"
+            self.assertIs(type(delta), int)
+            return incr(key, delta, **kwargs)
+
+        with patch.object(cache, 'incr', redis_incr):
+            with self.captureOnCommitCallbacks(execute=True):
+                product = Product.objects.create(name='P15', description='desc', price=Decimal('15.00'), stock=2)
+            product.stock = 0
+            with self.captureOnCommitCallbacks(execute=True):
+                product.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.get(name='P10.00').delete()
+        self.assertStatsMatchDatabase()
+
+    def test_checkouts_adjust_in_stock_count(self):
+        get_product_stats()
+        product = Product.objects.get(name='P10.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.reserve_stock({product.pk: 1})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_product_stats()['in_stock_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.release_stock({product.pk: 2})
+        self.assertEqual(get_product_stats()['in_stock_count'], 2)
+        self.assertStatsMatchDatabase()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FullTextSearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.coffee = Product.objects.create(
+            name='Coffee Machine', description='Brews coffee, coffee and more coffee', price=Decimal('70.99'), stock=6
+        )
+        self.grinder = Product.objects.create(
+            name='Grinder', description='Grinds beans for your coffee machine', price=Decimal('30.00'), stock=2
+        )
+        Product.objects.create(name='Watch', description='Tells the time', price=Decimal('500.05'), stock=1)
+
+    def search(self, term):
+        return [p['name'] for p in read_json(self.client.get('/products/', {'search': term}))]
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.search('coffee'), ['Coffee Machine', 'Grinder'])
+
+    def test_pages_keep_the_rank_order(self):
+        # the best match has the highest pk, so pk order would put it last
+        Product.objects.create(name='Coffee', description='Coffee, coffee', price=Decimal('9.99'), stock=3)
+        ranked = self.search('coffee')
+        self.assertEqual(ranked[0], 'Coffee')
+
+        pages = [self.client.get('/products/', {'search': 'coffee', 'page_size': 2}).json()]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).json())
+        self.assertEqual([p['name'] for page in pages for p in page['results']], ranked)
+        self.assertEqual(self.client.get(pages[1]['previous']).json()['results'], pages[0]['results'])
+
+    def test_prefix_and_multiple_terms(self):
+        self.assertEqual(self.search('grind coff'), ['Grinder'])
+        self.assertEqual(self.search('"quoted'), [])
+
+    def test_index_follows_product_writes(self):
+        self.grinder.name = 'Burr mill'
+        self.grinder.description = 'Grinds beans'
+        self.grinder.save()
+        self.assertEqual(self.search('coffee'), ['Coffee Machine'])
+        self.coffee.delete()
+        self.assertEqual(self.search('coffee'), [])
+        self.assertEqual(self.search('burr'), ['Burr mill'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@skipUnless(connection.vendor == 'sqlite', 'asserts on SQLite EXPLAIN QUERY PLAN output')
+class FilterQueryPlanTestCase(TestCase):
+    """Every filter combination the list views serve must reach the table through an index."""
+
+    def setUp(self):
+        reset_silk()
+        self.user = User.objects.create_user(username='planner', password='test')
+
+    def assertUsesIndex(self, queryset, table, index=None):
+        plan = queryset.explain()
+        lines = [line for line in plan.splitlines() if f' {table} ' in f'{line} ']
+        self.assertTrue(lines, plan)
+        for line in lines:
+            self.assertIn('USING', line, plan)
+            if index:
+                self.assertIn(index, line, plan)
+
+    def product_plan(self, params):
+        # InStockFilterBackend + ProductKeysetPagination ordering
+        queryset = Product.objects.filter(stock__gt=0).order_by('pk')
+        return ProductFilter(params, queryset=queryset).qs
+
+    def order_plan(self, params, user=None):
+        queryset = Order.objects.with_totals().order_by('-created_at', '-order_id')
+        if user is not None:
+            queryset = queryset.filter(user=user)
+        return OrderFilter(params, queryset=queryset).qs
+
+    def test_product_filters(self):
+        self.assertUsesIndex(self.product_plan({}), 'api_product', 'product_in_stock_idx')
+        self.assertUsesIndex(self.product_plan({'price': '10'}), 'api_product', 'product_price_idx')
+        self.assertUsesIndex(self.product_plan({'price__range': '1,5'}), 'api_product', 'product_price_idx')
+        self.assertUsesIndex(self.product_plan({'price__gt': '10'}), 'api_product')
+        self.assertUsesIndex(self.product_plan({'price__lt': '10'}), 'api_product')
+        # name__iexact/icontains compile to LIKE on sqlite, which can't use a
+        # b-tree index; product_name_upper_idx serves them on postgres
+
+    def test_user_order_filters(self):
+        for params in ({}, {'status': 'pending'}, {'created_at': '2024-01-01'},
+                       {'created_at__gt': '2024-01-01'}, {'created_at__lt': '2024-01-01'}):
+            with self.subTest(params=params):
+                self.assertUsesIndex(self.order_plan(params, self.user), 'api_order')
+        self.assertUsesIndex(
+            self.order_plan({'created_at': '2024-01-01'}, self.user), 'api_order',
+            'order_user_created_idx (user_id=? AND created_at>? AND created_at<?)',
+        )
+
+    def test_status_order_filters(self):
+        self.assertUsesIndex(self.order_plan({'status': 'pending'}), 'api_order', 'order_status_created_idx')
+        self.assertUsesIndex(
+            self.order_plan({'status': 'pending', 'created_at__gt': '2024-01-01'}), 'api_order',
+            'order_status_created_idx (status=? AND created_at>?)',
+        )
+
+    def test_date_filter_matches_whole_day(self):
+        day = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        created = {
+            'before': day - datetime.timedelta(microseconds=1),
+            'start': day,
+            'end': day + datetime.timedelta(days=1, microseconds=-1),
+            'after': day + datetime.timedelta(days=1),
+        }
+        for name, created_at in created.items():
+            order = Order.objects.create(user=self.user)
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+            created[name] = order.pk
+
+        matched = set(self.order_plan({'created_at': '2024-01-01'}).values_list('pk', flat=True))
+        self.assertEqual(matched, {created['start'], created['end']})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=['replica'])
+@modify_settings(MIDDLEWARE={'remove': 'api.profiling.SampledSilkyMiddleware'})
+class ReplicaRoutingTestCase(TransactionTestCase):
+    # two separate sqlite databases and no replication: a row's location shows
+    # which database served the read
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='test')
+        self.other = User.objects.create_user(username='other', password='test')
+        self.product = Product.objects.create(name='Primary', description='desc', price=Decimal('5.00'), stock=10)
+        Product.objects.using('replica').create(name='Replica', description='desc', price=Decimal('5.00'), stock=10)
+        # as if the replica had caught up with these writes
+        cache.clear()
+
+    def test_product_reads_use_replica(self):
+        names = [p['name'] for p in read_json(self.client.get('/products/'))]
+        self.assertEqual(names, ['Replica'])
+
+    def test_writes_use_primary(self):
+        admin = User.objects.create_superuser(username='admin', password='test')
+        self.client.force_login(admin)
+        response = self.client.post('/products/', {'name': 'New', 'description': 'desc', 'price': '1.00', 'stock': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Product.objects.using('default').filter(name='New').exists())
+        self.assertFalse(Product.objects.using('replica').filter(name='New').exists())
+
+    def test_reads_use_primary_after_a_version_bump(self):
+        self.assertEqual(read_json(self.client.get('/products/'))[0]['name'], 'Replica')
+        self.product.name = 'Renamed'
+        self.product.save()
+
+        # a cache miss in the lag window is filled from the primary
+        self.assertEqual(read_json(self.client.get('/products/'))[0]['name'], 'Renamed')
+        cache.delete(bumped_key('product'))
+        self.assertEqual(read_json(self.client.get('/products/?ordering=name'))[0]['name'], 'Replica')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_reads_primary(self):
+        names = [p['name'] for p in read_json(self.client.get('/products/'))]
+        self.assertEqual(names, ['Primary'])
+
+    def test_reads_stick_to_primary_after_own_order_write(self):
+        self.client.force_login(self.other)
+        self.assertEqual(read_json(self.client.get('/orders/')), [])
+
+        self.client.force_login(self.user)
+        response = self.client.post(
+            '/orders/', {'status': 'pending', 'items': [{'product': self.product.pk, 'quantity': 1}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(read_json(self.client.get('/orders/'))), 1)
+
+        # the checkout changed stock, which the lagging replica doesn't have yet
+        self.client.force_login(self.other)
+        self.assertEqual(read_json(self.client.get('/products/'))[0]['stock'], 9)
+        # once the window is over, the writer reads the replica again
+        cache.clear()
+        self.client.force_login(self.user)
+        self.assertEqual(read_json(self.client.get('/orders/')), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConnectionManagementTestCase(TestCase):
+    def test_persistent_connections_with_health_checks(self):
+        for database in settings.DATABASES.values():
+            self.assertEqual(database['CONN_MAX_AGE'], settings.DATABASE_CONN_MAX_AGE)
+            self.assertTrue(database['CONN_HEALTH_CHECKS'])
+
+    def test_cache_shares_the_redis_pool(self):
+        factory = SharedConnectionFactory({})
+        client = factory.connect(settings.REDIS_URL)
+        self.assertIs(client.connection_pool, get_redis_pool())
+        self.assertEqual(client.connection_pool.max_connections, settings.REDIS_POOL['max_connections'])
+
+    def test_new_connections_are_counted(self):
+        # the in-memory test database is never really closed and reopened
+        opened = connections_opened['default']
+        connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertEqual(connections_opened['default'], opened + 1)
+
+    def test_stats_endpoint_is_staff_only(self):
+        get_redis_pool()
+        self.client.force_login(User.objects.create_user(username='user', password='test'))
+        self.assertEqual(self.client.get('/stats/connections/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(User.objects.create_superuser(username='admin', password='test'))
+        stats = self.client.get('/stats/connections/').json()
+        self.assertTrue(stats['databases']['default']['connected'])
+        self.assertEqual(stats['redis']['127.0.0.1:6379/1']['in_use'], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@modify_settings(MIDDLEWARE={'remove': 'api.profiling.SampledSilkyMiddleware'})
+class AsyncViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='async', password='test')
+        self.other = User.objects.create_user(username='other', password='test')
+        self.products = Product.objects.bulk_create(
+            Product(name=f'P{i}', description='desc', price=Decimal(f'{i}.50'), stock=i) for i in range(4)
+        )
+        for user in (self.user, self.other):
+            order = Order.objects.create(user=user)
+            OrderItem.objects.create(order=order, product=self.products[1], quantity=2)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def aget(self, path, **headers):
+        return self.async_client.get(path, headers={'authorization': self.token, **headers})
+
+    async def test_product_endpoints_match_sync_views(self):
+        for path in ('/products/', '/products/?price__gt=1&ordering=-price', '/products/?page_size=2',
+                     f'/products/{self.products[2].pk}/'):
+            with self.subTest(path=path):
+                expected = await sync_to_async(lambda: read_json(self.client.get(path)))()
+                response = await self.aget(f'/async{path}')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                data = await aread_json(response)
+                if 'results' in expected:
+                    self.assertEqual(data['results'], expected['results'])
+                    self.assertIn('/async/products/?cursor=', data['next'])
+                else:
+                    self.assertEqual(data, expected)
+
+        response = await self.aget('/async/products/999999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_unpaginated_lists_are_streamed_in_chunks(self):
+        with patch.object(CompiledProductSerializer, 'chunk_size', 2):
+            response = await self.aget('/async/products/')
+            chunks = [chunk async for chunk in response.streaming_content]
+        # the brackets around chunks of two and one in-stock products
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(len(json.loads(b''.join(chunks))), 3)
+
+    async def test_orders_need_a_token_and_are_scoped_to_the_user(self):
+        response = await AsyncClient().get('/async/orders/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        orders = await aread_json(await self.aget('/async/orders/'))
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(orders[0]['user'], self.user.pk)
+        self.assertEqual(orders[0]['total_price'], 3.0)
+
+        detail = await self.aget(f"/async/orders/{orders[0]['order_id']}/")
+        self.assertEqual(detail.json()['items'], orders[0]['items'])
+        other_order = await Order.objects.filter(user=self.other).afirst()
+        response = await self.aget(f'/async/orders/{other_order.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_responses_are_cached_and_invalidated(self):
+        first = await self.aget('/async/products/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        # streamed, and cached once the body is sent
+        self.assertTrue(first.streaming)
+        await aread_json(first)
+        self.assertEqual((await self.aget('/async/products/'))['X-Cache'], 'HIT')
+
+        product = self.products[1]
+        product.name = 'Renamed'
+        await product.asave()
+        response = await self.aget('/async/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Renamed', [p['name'] for p in await aread_json(response)])
+
+        listed = await self.aget('/async/orders/')
+        response = await self.aget('/async/orders/', if_none_match=listed['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RendererTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='renderer', password='test')
+        product = Product.objects.create(name='Caf\u00e9 \u2028', description='desc', price=Decimal('10.25'), stock=3)
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=product, quantity=3)
+        self.data = OrderSerializer(Order.objects.with_totals(), many=True).data
+
+    def test_orjson_matches_json_renderer(self):
+        # Decimal totals, UUID order ids and datetimes encode exactly as before
+        self.assertIsInstance(self.data[0]['total_price'], Decimal)
+        self.assertEqual(ORJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertEqual(
+            ORJSONRenderer().render({'a': 1}, 'application/json; indent=4'),
+            b'{\n  "a": 1\n}',
+        )
+
+    def test_json_requests_use_orjson(self):
+        self.client.force_login(self.user)
+        with patch('api.renderers.orjson.dumps', wraps=orjson.dumps) as dumps:
+            self.assertEqual(len(read_json(self.client.get('/orders/'))), 1)
+        dumps.assert_called()
+        response = self.client.post('/orders/', '{"items": [', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/orders/', HTTP_ACCEPT=MessagePackRenderer.media_type)
+        self.assertEqual(response['Content-Type'], MessagePackRenderer.media_type)
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(JSONRenderer().render(self.data)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@modify_settings(MIDDLEWARE={'remove': 'api.profiling.SampledSilkyMiddleware'})
+class ConditionalProductTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Lamp', description='desc', price=Decimal('20.00'), stock=4)
+        self.url = f'/products/{self.product.pk}/'
+        self.client.force_login(User.objects.create_superuser(username='admin', password='test'))
+
+    def test_if_none_match_skips_the_database(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_version_changes_with_the_product(self):
+        etag = self.client.get(self.url)['ETag']
+        Product.objects.reserve_stock({self.product.pk: 1})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['stock'], 3)
+
+        self.product.refresh_from_db()
+        self.product.name = 'Desk lamp'
+        self.product.save(update_fields=['name'])
+        self.assertEqual(self.product.version, 3)
+        self.assertNotEqual(self.client.get(self.url)['ETag'], response['ETag'])
+
+    def test_validators_are_dropped_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Desk lamp'
+            self.product.save()
+            # a conditional GET in between caches the pre-commit version
+            cache.set(validators_key(self.product.pk), (1, 0))
+        self.assertIsNone(cache.get(validators_key(self.product.pk)))
+
+    def test_if_match_guards_concurrent_edits(self):
+        etag = self.client.get(self.url)['ETag']
+        payload = {'name': 'Lamp', 'description': 'desc', 'price': '25.00', 'stock': 4}
+
+        response = self.client.put(self.url, payload, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # a second admin still holding the old ETag
+        response = self.client.patch(self.url, {'price': '30.00'}, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(self.url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, Decimal('25.00'))
+
+        response = self.client.delete(self.url, HTTP_IF_MATCH=self.client.get(self.url)['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductImportExportTestCase(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        Product.objects.bulk_create([
+            Product(sku=f'SKU-{i}', name=f'Product {i}', description='desc', price=Decimal(f'{i}.50'), stock=i)
+            for i in range(1, 8)
+        ])
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def write_csv(self, name, rows):
+        with open(self.path(name), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['sku', 'name', 'description', 'price', 'stock'])
+            writer.writerows(rows)
+        return self.path(name)
+
+    def test_export_and_import_round_trip(self):
+        for name in ('products.csv', 'products.jsonl'):
+            call_command('export_products', self.path(name), batch_size=3, stdout=StringIO())
+            self.assertFalse(os.path.exists(self.path(f'{name}.checkpoint')))
+        with open(self.path('products.jsonl'), 'rb') as f:
+            rows = [orjson.loads(line) for line in f]
+        self.assertEqual([row['sku'] for row in rows], [f'SKU-{i}' for i in range(1, 8)])
+        self.assertEqual(rows[0]['price'], '1.50')
+
+        Product.objects.all().delete()
+        call_command('import_products', self.path('products.csv'), batch_size=3, stdout=StringIO())
+        self.assertEqual(
+            list(Product.objects.order_by('sku').values_list('sku', 'price', 'stock')),
+            [(f'SKU-{i}', Decimal(f'{i}.50'), i) for i in range(1, 8)],
+        )
+        call_command('import_products', self.path('products.jsonl'), stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 7)
+
+    def test_import_upserts_on_sku(self):
+        path = self.write_csv('products.csv', [
+            ['SKU-1', 'Product 1', 'desc', '1.50', '1'],
+            ['SKU-2', 'Renamed', 'desc', '9.99', '2'],
+            ['SKU-NEW', 'New', '', '3', '10'],
+        ])
+        out = StringIO()
+        call_command('import_products', path, stdout=out)
+        self.assertIn('1 created, 1 updated, 1 unchanged', out.getvalue())
+
+        versions = dict(Product.objects.values_list('sku', 'version'))
+        self.assertEqual((versions['SKU-1'], versions['SKU-2'], versions['SKU-NEW']), (1, 2, 1))
+        self.assertEqual(Product.objects.get(sku='SKU-2').price, Decimal('9.99'))
+        self.assertEqual(Product.objects.get(sku='SKU-NEW').price, Decimal('3.00'))
+
+    def test_import_reindexes_only_written_rows(self):
+        path = self.write_csv('products.csv', [
+            ['SKU-1', 'Product 1', 'desc', '1.50', '1'],
+            ['SKU-2', 'Espresso cup', 'desc', '2.50', '2'],
+            ['SKU-NEW', 'Espresso machine', '', '3', '10'],
+        ])
+        with patch.object(SQLiteSearchBackend, 'rebuild') as rebuild:
+            call_command('import_products', path, stdout=StringIO())
+        rebuild.assert_not_called()
+        response = self.client.get('/products/?search=espresso')
+        self.assertEqual(sorted(p['name'] for p in read_json(response)), ['Espresso cup', 'Espresso machine'])
+
+        # a rerun changes nothing, so nothing is bumped either
+        versions = cache.get_many([version_key('product'), version_key('catalog')])
+        call_command('import_products', path, stdout=StringIO())
+        self.assertEqual(cache.get_many([version_key('product'), version_key('catalog')]), versions)
+
+    def test_export_skips_products_without_sku(self):
+        Product.objects.create(name='No sku', description='desc', price=Decimal('1.00'), stock=1)
+        err = StringIO()
+        call_command('export_products', self.path('products.jsonl'), stdout=StringIO(), stderr=err)
+        self.assertIn('Skipped 1 rows', err.getvalue())
+
+        Product.objects.all().delete()
+        call_command('import_products', self.path('products.jsonl'), stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 7)
+
+    def test_import_rejects_invalid_rows(self):
+        path = self.write_csv('products.csv', [['SKU-1', 'Product 1', 'desc', '1.50', '1'], ['SKU-9', 'Bad', '', 'x', '1']])
+        with self.assertRaisesMessage(CommandError, 'Row 2'):
+            call_command('import_products', path, stdout=StringIO())
+
+    def test_import_resumes_from_checkpoint(self):
+        path = self.write_csv('products.csv', [[f'SKU-{i}', 'Imported', '', '1', '1'] for i in range(1, 8)])
+        stat = os.stat(path)
+        Checkpoint(path).save({
+            'source': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'format': 'csv'},
+            'rows': 4, 'created': 0, 'updated': 4, 'unchanged': 0,
+        })
+        call_command('import_products', path, batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            list(Product.objects.filter(name='Imported').order_by('sku').values_list('sku', flat=True)),
+            ['SKU-5', 'SKU-6', 'SKU-7'],
+        )
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_interrupted_export_resumes(self):
+        call_command('export_products', self.path('full.csv'), stdout=StringIO())
+        page = ProductExporter.page
+        calls = []
+
+        def failing_page(exporter, *args):
+            calls.append(args)
+            if len(calls) == 3:
+                raise RuntimeError('interrupted')
+            return page(exporter, *args)
+
+        with patch.object(ProductExporter, 'page', failing_page), self.assertRaises(RuntimeError):
+            call_command('export_products', self.path('products.csv'), batch_size=2, stdout=StringIO())
+        self.assertEqual(Checkpoint(self.path('products.csv')).load()['rows'], 4)
+
+        call_command('export_products', self.path('products.csv'), batch_size=2, stdout=StringIO())
+        with open(self.path('full.csv')) as full, open(self.path('products.csv')) as resumed:
+            self.assertEqual(resumed.read(), full.read())
+
+    def test_export_orders_with_items(self):
+        user = User.objects.create_user(username='buyer', password='test')
+        order = Order.objects.create(user=user)
+        products = list(Product.objects.order_by('pk')[:2])
+        OrderItem.objects.create(order=order, product=products[0], quantity=2)
+        OrderItem.objects.create(order=order, product=products[1], quantity=1)
+        Order.objects.create(user=user)
+
+        call_command('export_orders', self.path('orders.jsonl'), batch_size=1, stdout=StringIO())
+        with open(self.path('orders.jsonl'), 'rb') as f:
+            rows = [orjson.loads(line) for line in f]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['order_id'], str(order.order_id))
+        self.assertEqual(rows[0]['total_price'], '5.50')
+        self.assertEqual([item['sku'] for item in rows[0]['items']], ['SKU-1', 'SKU-2'])
+        self.assertEqual(rows[1]['items'], [])
+
+        call_command('export_orders', self.path('orders.csv'), stdout=StringIO())
+        with open(self.path('orders.csv'), newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(json.loads(rows[0]['items'])[0]['quantity'], 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PopulateDbTestCase(TestCase):
+    def populate(self, **options):
+        call_command('populate_db', stdout=StringIO(), **options)
+
+    def dataset(self):
+        return (
+            list(Product.objects.order_by('sku').values_list('sku', 'name', 'description', 'price', 'stock')),
+            list(Order.objects.order_by('order_id').values_list('order_id', 'user__username', 'status', 'created_at')),
+            list(OrderItem.objects.order_by('order_id', 'product__sku').values_list('order_id', 'product__sku', 'quantity')),
+        )
+
+    def test_defaults_create_the_demo_data(self):
+        self.populate()
+        self.populate()
+        self.assertEqual(Product.objects.count(), 6)
+        self.assertEqual(Order.objects.filter(user__username='admin').count(), 3)
+        self.assertTrue(all(1 <= len(o.items.all()) <= 3 for o in Order.objects.prefetch_related('items')))
+
+    def test_same_seed_same_dataset(self):
+        sizes = {'users': 20, 'products': 50, 'orders': 200, 'items': 3, 'batch_size': 64}
+        self.populate(**sizes)
+        first = self.dataset()
+        self.assertEqual((len(first[0]), len(first[1])), (56, 200))
+
+        Order.objects.all().delete()
+        Product.objects.all().delete()
+        self.populate(**sizes)
+        self.assertEqual(self.dataset(), first)
+
+        Order.objects.all().delete()
+        self.populate(**sizes, seed=1)
+        self.assertNotEqual(self.dataset()[1], first[1])
+
+    def test_items_must_be_positive(self):
+        with self.assertRaisesMessage(CommandError, '--items must be at least 1.'):
+            self.populate(items=0)
+        self.assertFalse(Product.objects.exists())
+
+    def test_orders_are_skewed(self):
+        self.populate(users=50, products=200, orders=1000, items=2)
+        per_product = Counter(OrderItem.objects.values_list('product_id', flat=True))
+        per_user = Counter(Order.objects.values_list('user_id', flat=True))
+        # the most popular product and buyer are far above the average
+        self.assertGreater(max(per_product.values()), 10 * sum(per_product.values()) / 206)
+        self.assertGreater(max(per_user.values()), 5 * 1000 / 51)
+        self.assertGreater(len({created.date() for created in Order.objects.values_list('created_at', flat=True)}), 100)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, OUTBOX_EMAIL_BATCH_SIZE=2)
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='test', email='user1@example.com')
+        self.product = Product.objects.create(name='A', description='desc', price=Decimal('1.00'), stock=5)
+        self.client.force_login(self.user)
+
+    def order(self, quantity):
+        return self.client.post(
+            '/orders/', {'items': [{'product': self.product.pk, 'quantity': quantity}]},
+            content_type='application/json',
+        )
+
+    @patch('api.outbox.send_order_confirmation_emails')
+    def test_checkout_writes_outbox_not_broker(self, task):
+        response = self.order(1)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        task.s.assert_not_called()
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.payload, {'order_id': response.json()['order_id'], 'email': 'user1@example.com'})
+
+        # a rejected order leaves nothing behind
+        self.assertEqual(self.order(10).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    @patch('api.outbox.group')
+    def test_relay_publishes_in_batches(self, group):
+        for _ in range(5):
+            self.order(1)
+        order_ids = [m.payload['order_id'] for m in OutboxMessage.objects.order_by('pk')]
+
+        self.assertEqual(relay(batch_size=3), 3)
+        # three confirmations, at most two per email task
+        chunks = [signature.args[0] for signature in group.call_args.args[0]]
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual([order_id for chunk in chunks for order_id, _ in chunk], order_ids[:3])
+        group.return_value.apply_async.assert_called_once_with()
+
+        out = StringIO()
+        call_command('relay_outbox', once=True, batch_size=3, stdout=out)
+        self.assertIn('Relayed 2 messages', out.getvalue())
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    @patch('api.outbox.group')
+    def test_failed_publish_keeps_messages(self, group):
+        self.order(1)
+        group.return_value.apply_async.side_effect = ConnectionError('broker down')
+        with self.assertRaises(ConnectionError):
+            relay()
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_batched_task_uses_one_connection(self):
+        with patch('api.tasks.get_connection', wraps=get_connection) as connect:
+            sent = send_order_confirmation_emails([['a1', 'a@example.com'], ['b2', 'b@example.com'], ['c3', '']])
+        self.assertEqual(sent, 2)
+        connect.assert_called_once_with()
+        self.assertEqual([m.to for m in mail.outbox], [['a@example.com'], ['b@example.com']])
+        self.assertIn('Order #b2', mail.outbox[1].body)
+
+
+# the test settings turn the background flush off, records are flushed by the tests
+@override_settings(CACHES=LOCMEM_CACHES, PROFILING_TRACE_TOKEN='secret')
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_silk()
+        profiling.buffer.records.clear()
+        for model in (silk_models.SQLQuery, silk_models.Response, silk_models.Request):
+            model.objects.all().delete()
+        Product.objects.create(name='A', description='desc', price=Decimal('1.00'), stock=1)
+
+    def get(self, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/products/', **headers)
+            # the list is streamed, its queries run as it's consumed
+            content = response.getvalue()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # nothing is written to silk's tables on the request thread
+        self.assertFalse([q for q in queries if 'silk_' in q['sql']])
+        return content
+
+    def test_unsampled_requests_are_not_recorded(self):
+        self.get()
+        self.get(HTTP_X_PROFILE='wrong')
+        self.assertEqual(profiling.buffer.flush(), 0)
+
+    def test_trace_header_records_full_detail(self):
+        self.get(HTTP_X_PROFILE='secret')
+        self.assertFalse(silk_models.Request.objects.exists())
+        self.assertEqual(profiling.buffer.flush(), 1)
+
+        request = silk_models.Request.objects.get()
+        self.assertEqual((request.path, request.response.status_code), ('/products/', 200))
+        queries = list(request.queries.all())
+        self.assertEqual(request.num_sql_queries, len(queries))
+        self.assertTrue(queries)
+        self.assertTrue(all(q.traceback and q.analysis for q in queries))
+
+    def test_trace_header_records_response_body(self):
+        self.client.get(f'/products/{Product.objects.get().pk}/', HTTP_X_PROFILE='secret')
+        profiling.buffer.flush()
+        self.assertIn('"A"', silk_models.Response.objects.get().body)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_requests_record_timings_only(self):
+        self.get()
+        self.assertEqual(profiling.buffer.flush(), 1)
+        request = silk_models.Request.objects.get()
+        self.assertGreater(request.time_taken, 0)
+        self.assertEqual(request.response.body, '')
+        self.assertTrue(all(q.time_taken is not None and not q.analysis and not q.traceback
+                            for q in request.queries.all()))
+
+    async def test_async_requests_are_recorded(self):
+        async def get_response(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(profiling.SampledSilkyMiddleware(get_response)))
+        await AsyncClient().get('/async/products/')
+        self.assertEqual(profiling.buffer.stats()['buffered'], 0)
+
+        product = await Product.objects.aget()
+        response = await AsyncClient().get(f'/async/products/{product.pk}/', headers={'x-profile': 'secret'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(await sync_to_async(profiling.buffer.flush)(), 1)
+        request = await silk_models.Request.objects.aget()
+        self.assertEqual(request.path, f'/async/products/{product.pk}/')
+        # the ORM calls ran on the thread the collector was set up on
+        queries = [q async for q in request.queries.all()]
+        self.assertTrue(queries)
+        self.assertTrue(all(q.traceback for q in queries))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_BUFFER_SIZE=2)
+    def test_buffer_is_bounded(self):
+        dropped = profiling.buffer.dropped
+        for _ in range(3):
+            self.get()
+        self.assertEqual(profiling.buffer.dropped - dropped, 1)
+        self.assertEqual(profiling.buffer.flush(), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_TOKEN=None)
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_silk()
+        self.product = Product.objects.create(name='A', description='desc', price=Decimal('1.00'), stock=1)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_latency_queries_and_cache_results_per_view(self):
+        labels = {'view': 'product-detail', 'method': 'GET'}
+        before = [
+            self.sample('api_request_duration_seconds_count', status='200', **labels),
+            self.sample('api_request_queries_sum', **labels),
+            self.sample('api_response_cache_total', view='product-detail', result='miss'),
+            self.sample('api_response_cache_total', view='product-detail', result='hit'),
+        ]
+        url = f'/products/{self.product.pk}/'
+        executed = 0
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+                executed += len(queries)
+
+        after = [
+            self.sample('api_request_duration_seconds_count', status='200', **labels),
+            self.sample('api_request_queries_sum', **labels),
+            self.sample('api_response_cache_total', view='product-detail', result='miss'),
+            self.sample('api_response_cache_total', view='product-detail', result='hit'),
+        ]
+        self.assertEqual([a - b for a, b in zip(after, before)], [2, executed, 1, 1])
+
+    def test_not_modified_counts_as_cache_hit(self):
+        url = f'/products/{self.product.pk}/'
+        etag = self.client.get(url)['ETag']
+        hits = self.sample('api_response_cache_total', view='product-detail', result='hit')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.sample('api_response_cache_total', view='product-detail', result='hit'), hits + 1)
+
+    async def test_async_requests_are_measured_natively(self):
+        async def get_response(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(get_response)))
+        labels = {'view': 'async-product-detail', 'method': 'GET'}
+        count = self.sample('api_request_queries_count', **labels)
+        queries = self.sample('api_request_queries_sum', **labels)
+        response = await AsyncClient().get(f'/async/products/{self.product.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.sample('api_request_queries_count', **labels), count + 1)
+        # the ORM calls ran on a worker thread and are counted all the same
+        self.assertGreater(self.sample('api_request_queries_sum', **labels), queries)
+
+    def test_streamed_response_measured_after_last_chunk(self):
+        labels = {'view': 'product-list', 'method': 'GET'}
+        count = self.sample('api_request_queries_count', **labels)
+        queries = self.sample('api_request_queries_sum', **labels)
+        response = self.client.get('/products/')
+        self.assertEqual(self.sample('api_request_queries_count', **labels), count)
+
+        response.getvalue()
+        self.assertEqual(self.sample('api_request_queries_count', **labels), count + 1)
+        self.assertGreater(self.sample('api_request_queries_sum', **labels), queries)
+
+    def test_metrics_endpoint(self):
+        self.client.get(f'/products/{self.product.pk}/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'api_request_duration_seconds_bucket{', response.content)
+        self.assertIn(b'view="product-detail"', response.content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_metrics_endpoint_multiprocess(self):
+        with tempfile.TemporaryDirectory() as path, patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': path}):
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # read from the (empty) directory rather than this process's memory
+        self.assertNotIn(b'api_request_duration_seconds', response.content)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@modify_settings(MIDDLEWARE={'remove': 'api.profiling.SampledSilkyMiddleware'})
+class CachedJWTAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user(username='jwt', password='test')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def get(self, path='/orders/'):
+        return self.client.get(path, HTTP_AUTHORIZATION=self.token)
+
+    def test_repeat_requests_skip_token_check_and_user_query(self):
+        validate = JWTAuthentication.get_validated_token
+        with patch.object(JWTAuthentication, 'get_validated_token', autospec=True, side_effect=validate) as check:
+            self.assertEqual(self.get().status_code, status.HTTP_200_OK)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.get().status_code, status.HTTP_200_OK)
+        self.assertEqual(check.call_count, 1)
+        self.assertFalse([q for q in queries if 'FROM "api_user"' in q['sql']])
+
+    def test_user_changes_apply_to_the_next_request(self):
+        self.get()
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+        self.get()
+        self.user.is_active = False
+        self.user.save()
+        response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.json()['detail'], 'User is inactive')
+
+        self.user.delete()
+        self.assertEqual(self.get().json()['detail'], 'User not found')
+
+    def test_only_auth_fields_are_cached(self):
+        self.get()
+        entry = cache.get(user_cache_key(self.user.pk))
+        self.assertEqual(set(entry), {'id', 'is_active', 'is_staff', 'is_superuser', 'password_hash'})
+        self.assertNotIn(self.user.password, entry.values())
+
+        user = CachedJWTAuthentication().get_user(AccessToken.for_user(self.user))
+        self.assertEqual((user.pk, user.is_staff), (self.user.pk, False))
+        # anything else is loaded on first access
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, 'jwt')
+
+    def test_bulk_updates_drop_cached_users(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(self.get().json()['detail'], 'User is inactive')
+
+    async def test_async_views_share_the_user_cache(self):
+        response = await self.async_client.get('/async/orders/', headers={'authorization': self.token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((await sync_to_async(cache.get)(user_cache_key(self.user.pk)))['id'], self.user.pk)
+
+        self.user.is_active = False
+        await self.user.asave()
+        response = await self.async_client.get('/async/orders/', headers={'authorization': self.token})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_async_views_accept_the_uncached_authenticator(self):
+        with patch.object(AsyncOrderListAPIView, 'authentication_classes', [JWTAuthentication]):
+            response = await self.async_client.get('/async/orders/', headers={'authorization': self.token})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            self.user.is_active = False
+            await self.user.asave()
+            response = await self.async_client.get('/async/orders/', headers={'authorization': self.token})
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(json.loads(response.content)['detail'], 'User is inactive')
+
+    @override_settings(JWT_TOKEN_CACHE_SIZE=2)
+    def test_token_cache_is_bounded_and_expires(self):
+        tokens = [AccessToken.for_user(self.user) for _ in range(3)]
+        for i, token in enumerate(tokens):
+            token_cache.set(f'raw{i}', token)
+        self.assertEqual([token_cache.get(f'raw{i}') for i in range(3)], [None, tokens[1], tokens[2]])
+
+        expired = AccessToken.for_user(self.user)
+        expired['exp'] = int(time.time()) - 1
+        token_cache.set('expired', expired)
+        self.assertIsNone(token_cache.get('expired'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@modify_settings(MIDDLEWARE={'remove': 'api.profiling.SampledSilkyMiddleware'})
+class SparseFieldsetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='sparse', password='test')
+        self.products = Product.objects.bulk_create(
+            Product(name=f'P{i}', description='long description', price=Decimal(f'{i}.50'), stock=i + 1) for i in range(4)
+        )
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product=self.products[1], quantity=2)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def get(self, path, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_AUTHORIZATION=self.token, **headers)
+            data = read_json(response)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, data)
+        return response, data, [q['sql'] for q in queries]
+
+    def test_product_list_loads_and_renders_only_the_requested_fields(self):
+        _, data, queries = self.get('/products/?fields=name,price')
+        self.assertEqual(data[0], {'name': 'P0', 'price': '0.50'})
+        _, data, queries = self.get('/products/?omit=description,stock')
+        self.assertEqual(data[0], {'name': 'P0', 'price': '0.50'})
+        self.assertFalse([sql for sql in queries if 'description' in sql])
+
+    def test_paginated_products_keep_the_cursor_keys_loaded(self):
+        _, data, queries = self.get('/products/?fields=name&ordering=-price&page_size=2')
+        self.assertEqual(data['results'], [{'name': 'P3'}, {'name': 'P2'}])
+        product_queries = [sql for sql in queries if 'FROM "api_product"' in sql]
+        # one query for the page, no deferred loads for the cursor's price
+        self.assertEqual(len(product_queries), 1)
+        self.assertNotIn('description', product_queries[0])
+
+        _, data, _ = self.get(data['next'])
+        self.assertEqual(data['results'], [{'name': 'P1'}, {'name': 'P0'}])
+
+    def test_product_detail_etag_depends_on_the_fieldset(self):
+        path = f'/products/{self.products[0].pk}/'
+        full, data, _ = self.get(path)
+        self.assertIn('description', data)
+        sparse, data, queries = self.get(f'{path}?fields=name')
+        self.assertEqual(data, {'name': 'P0'})
+        self.assertNotEqual(full['ETag'], sparse['ETag'])
+        self.assertFalse([sql for sql in queries if 'description' in sql])
+
+    def test_orders_skip_totals_and_items_unless_rendered(self):
+        _, data, queries = self.get('/orders/?fields=order_id,status')
+        self.assertEqual(data, [{'order_id': str(self.order.pk), 'status': 'pending'}])
+        self.assertFalse([sql for sql in queries if 'api_orderitem' in sql])
+
+        _, data, queries = self.get('/orders/?fields=total_price')
+        self.assertEqual(data, [{'total_price': 3.0}])
+        self.assertEqual(len([sql for sql in queries if 'api_orderitem' in sql]), 1)
+
+        _, data, queries = self.get(f'/orders/{self.order.pk}/?omit=total_price,item_count,created_at')
+        self.assertEqual(set(data), {'order_id', 'user', 'status', 'items'})
+        self.assertFalse([sql for sql in queries if 'SUM(' in sql])
+
+    def test_fieldsets_are_part_of_the_cache_key(self):
+        _, full, _ = self.get('/orders/')
+        _, sparse, _ = self.get('/orders/?fields=status')
+        self.assertIn('items', full[0])
+        self.assertEqual(sparse, [{'status': 'pending'}])
+
+    def test_users_and_async_views(self):
+        _, data, queries = self.get('/users/?fields=id,username')
+        self.assertEqual(data, [{'id': self.user.pk, 'username': 'sparse'}])
+        # the list query, the other one is the token's user
+        self.assertFalse([sql for sql in queries if '"password"' in sql and 'WHERE' not in sql])
+
+        response = async_to_sync(self.async_client.get)(
+            '/async/orders/?fields=status', headers={'authorization': self.token}
+        )
+        self.assertEqual(async_to_sync(aread_json)(response), [{'status': 'pending'}])
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/products/?fields=name,secret&omit=nope')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'fields': ['Unknown field: secret.'], 'omit': ['Unknown field: nope.']})
+
+    def test_writes_ignore_fieldsets(self):
+        admin = User.objects.create_superuser(username='admin', password='test')
+        self.client.force_login(admin)
+        response = self.client.post(
+            '/products/?fields=name', {'name': 'New', 'description': 'd', 'price': '1.00', 'stock': 1},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('description', response.json())
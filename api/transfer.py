@@ -0,0 +1,424 @@
+import csv
+import io
+import json
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import orjson
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, OperationalError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.cache import bump_version, reset_versions
+from api.conditional import invalidate_product_validators
+from api.models import Order, OrderItem, Product
+from api.search import get_search_backend
+from api.stats import invalidate_product_stats
+
+FORMATS = ('csv', 'jsonl')
+PRODUCT_FIELDS = ['sku', 'name', 'description', 'price', 'stock']
+PRODUCT_MAX_PRICE = Decimal('99999999.99')
+
+
+def detect_format(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt == 'ndjson':
+        fmt = 'jsonl'
+    if fmt not in FORMATS:
+        raise CommandError(f'Unknown format for {path}, pass --format csv or --format jsonl.')
+    return fmt
+
+
+class Checkpoint:
+    """
+    Progress of an import or export, kept in ``<path>.checkpoint`` and
+    replaced atomically, so an interrupted run can pick up where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = f'{path}.checkpoint'
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, state):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        for path in (self.path, f'{self.path}.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def close_connections():
+    # forked workers must open their own database connections
+    connections.close_all()
+
+
+# Import
+
+def read_rows(path, fmt):
+    """Yield the rows of a CSV (with a header) or JSON Lines file as dicts."""
+    if fmt == 'csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+
+
+def product_values(row, number):
+    """Validated Product field values of an import row; row ``number`` is 1-based."""
+    try:
+        sku = str(row.get('sku') or '').strip()
+        name = str(row.get('name') or '').strip()
+        if not sku or not name:
+            raise ValueError('sku and name are required')
+        price = Decimal(str(row['price'])).quantize(Decimal('0.01'))
+        if not 0 <= price <= PRODUCT_MAX_PRICE:
+            raise ValueError(f'price {price} out of range')
+        stock = int(row['stock'])
+        if stock < 0:
+            raise ValueError('stock must not be negative')
+    except KeyError as exc:
+        raise CommandError(f'Row {number}: missing column {exc}.')
+    except (ValueError, TypeError, InvalidOperation) as exc:
+        raise CommandError(f'Row {number}: {exc}.')
+    return {
+        'sku': sku[:64], 'name': name[:200], 'description': row.get('description') or '',
+        'price': price, 'stock': stock,
+    }
+
+
+def upsert_products(rows):
+    """
+    Insert or update a batch of product values keyed on ``sku``.
+
+    Existing rows are locked and compared first, so unchanged products keep
+    their version and changed ones get the next one, as Product.save would;
+    only the written rows are re-indexed for search. Returns ``(created, updated, unchanged, updated_pks)``.
+    """
+    # the last row wins when a sku repeats within the batch
+    rows = {values['sku']: values for values in rows}
+    for attempt in range(5):
+        try:
+            with transaction.atomic():
+                return _upsert_products(rows)
+        except (IntegrityError, OperationalError):
+            # another worker inserted one of these skus first (its row is an update
+            # now), or the database broke a lock wait between workers
+            if attempt == 4:
+                raise
+            time.sleep(0.05 * 2 ** attempt)
+
+
+def _upsert_products(rows):
+    # plain tuples are much cheaper than model instances for the comparison
+    existing = {
+        values[0]: (pk, version, dict(zip(PRODUCT_FIELDS, values)))
+        for pk, version, *values in Product.objects.select_for_update().filter(sku__in=list(rows))
+        .order_by('sku').values_list('pk', 'version', *PRODUCT_FIELDS)
+    }
+    now = timezone.now()
+    products, updated_pks = [], []
+    for sku, values in rows.items():
+        if sku not in existing:
+            products.append(Product(**values, updated_at=now))
+            continue
+        pk, version, current = existing[sku]
+        if current != values:
+            products.append(Product(**values, version=version + 1, updated_at=now))
+            updated_pks.append(pk)
+    # one INSERT .. ON CONFLICT (sku) DO UPDATE; bulk_update's CASE per row
+    # gets quadratically slower with the batch size
+    Product.objects.bulk_create(
+        products, update_conflicts=True, unique_fields=['sku'],
+        update_fields=[*PRODUCT_FIELDS[1:], 'version', 'updated_at'],
+    )
+    backend = get_search_backend()
+    if products and backend is not None:
+        backend.reindex(Product.objects.filter(sku__in=[product.sku for product in products]))
+    created = len(products) - len(updated_pks)
+    return created, len(updated_pks), len(rows) - len(products), updated_pks
+
+
+def import_products(path, fmt, batch_size=2000, workers=1, restart=False, progress=None):
+    """
+    Stream ``path`` into the catalogue in batches of ``batch_size`` rows,
+    upserting on sku, on up to ``workers`` processes (one on sqlite). Finished
+    batches are checkpointed in file order; a rerun skips them unless ``restart``.
+    """
+    if workers > 1 and connections['default'].vendor == 'sqlite':
+        # a single writer at a time, parallel batches would only wait on each other
+        workers = 1
+    checkpoint = Checkpoint(path)
+    stat = os.stat(path)
+    source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'format': fmt}
+    state = {} if restart else checkpoint.load()
+    if state and state['source'] != source:
+        raise CommandError(f'{path} changed since it was checkpointed, rerun with --restart.')
+    state = state or {'source': source, 'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0}
+
+    rows = islice(read_rows(path, fmt), state['rows'], None)
+    batches = (
+        [product_values(row, number) for number, row in enumerate(batch, start)]
+        for start, batch in _numbered(batched(rows, batch_size), state['rows'] + 1)
+    )
+
+    def done(size, result):
+        created, updated, unchanged, updated_pks = result
+        state['rows'] += size
+        state['created'] += created
+        state['updated'] += updated
+        state['unchanged'] += unchanged
+        # bulk writes skip the post_save signals, drop what they would have
+        if updated_pks:
+            reset_versions([f'product:{pk}' for pk in updated_pks])
+            invalidate_product_validators(*updated_pks)
+        checkpoint.save(state)
+        if progress:
+            progress(state)
+
+    try:
+        if workers > 1:
+            close_connections()
+            with ProcessPoolExecutor(workers, initializer=close_connections) as pool:
+                # at most two batches per worker in memory; results are taken in file order
+                pending = deque()
+                try:
+                    for batch in batches:
+                        pending.append((len(batch), pool.submit(upsert_products, batch)))
+                        if len(pending) >= workers * 2:
+                            size, future = pending.popleft()
+                            done(size, future.result())
+                    while pending:
+                        size, future = pending.popleft()
+                        done(size, future.result())
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
+        else:
+            for batch in batches:
+                done(len(batch), upsert_products(batch))
+    finally:
+        if state['created'] or state['updated']:
+            bump_version('product', 'catalog')
+            invalidate_product_stats()
+
+    checkpoint.clear()
+    return state
+
+
+def _numbered(batches, start):
+    for batch in batches:
+        yield start, batch
+        start += len(batch)
+
+
+# Export
+
+class ProductExporter:
+    fields = PRODUCT_FIELDS
+    # import_products matches rows on sku, so products without one can't round-trip
+    exported = Q(sku__isnull=False) & ~Q(sku='')
+
+    def page(self, where, after, limit):
+        """``limit`` rows after the keyset position ``after``, and the new position."""
+        qs = Product.objects.filter(self.exported, where).order_by('pk')
+        if after is not None:
+            qs = qs.filter(pk__gt=after)
+        rows = list(qs.values_list('pk', *self.fields)[:limit])
+        return (rows[-1][0] if rows else after), [row[1:] for row in rows]
+
+    def partitions(self, count):
+        bounds = Product.objects.order_by('pk').values_list('pk', flat=True)
+        low, high = bounds.first(), bounds.last()
+        if count == 1 or low is None:
+            return [Q()]
+        step = -(-(high - low + 1) // count)
+        return _ranges('pk', [low + step * i for i in range(1, count)])
+
+    def skipped(self):
+        return Product.objects.exclude(self.exported).count()
+
+
+class OrderExporter:
+    """One row per order, its items nested (a JSON array in a CSV column)."""
+    fields = ['order_id', 'user_id', 'status', 'created_at', 'total_price', 'items']
+
+    def page(self, where, after, limit):
+        qs = Order.objects.filter(where).order_by('created_at', 'order_id')
+        if after is not None:
+            created_at, order_id = after
+            qs = qs.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, order_id__gt=order_id))
+        orders = list(qs.values_list('order_id', 'user_id', 'status', 'created_at')[:limit])
+        if not orders:
+            return after, []
+
+        items = {order[0]: [] for order in orders}
+        for order_id, product_id, sku, quantity, price in (
+            OrderItem.objects.filter(order_id__in=items).order_by('pk')
+            .values_list('order_id', 'product_id', 'product__sku', 'quantity', 'product__price')
+        ):
+            items[order_id].append({'product_id': product_id, 'sku': sku, 'quantity': quantity, 'price': price})
+
+        rows = [
+            (*order, sum((item['price'] * item['quantity'] for item in items[order[0]]), Decimal('0.00')),
+             items[order[0]])
+            for order in orders
+        ]
+        last = orders[-1]
+        return (last[3].isoformat(), str(last[0])), rows
+
+    def partitions(self, count):
+        bounds = Order.objects.order_by('created_at').values_list('created_at', flat=True)
+        low, high = bounds.first(), bounds.last()
+        if count == 1 or low is None or low == high:
+            return [Q()]
+        step = (high - low) / count
+        return _ranges('created_at', [low + step * i for i in range(1, count)])
+
+    def skipped(self):
+        return 0
+
+
+def _ranges(field, cuts):
+    # unbounded at both ends, so rows added meanwhile land in the first or last part
+    lower = [None, *cuts]
+    upper = [*cuts, None]
+    return [
+        Q(**{k: v for k, v in ((f'{field}__gte', lo), (f'{field}__lt', hi)) if v is not None})
+        for lo, hi in zip(lower, upper)
+    ]
+
+
+def encode_rows(fmt, fields, rows, header=False):
+    if fmt == 'jsonl':
+        return b''.join(
+            orjson.dumps(dict(zip(fields, row)), default=str, option=orjson.OPT_APPEND_NEWLINE)
+            for row in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+    writer.writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return orjson.dumps(value, default=str).decode()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def export_part(exporter, path, fmt, where=Q(), batch_size=5000, restart=False):
+    """
+    Write the rows of ``exporter`` matching ``where`` to ``path``, keyset
+    paginated. After every batch the file is synced and the last key and byte
+    offset checkpointed; a rerun truncates to that offset and carries on.
+    """
+    checkpoint = Checkpoint(path)
+    state = {} if restart else checkpoint.load()
+    if state and (state['format'] != fmt or not os.path.exists(path) or os.path.getsize(path) < state['bytes']):
+        state = {}
+    state = state or {'format': fmt, 'key': None, 'bytes': 0, 'rows': 0}
+
+    with open(path, 'r+b' if state['bytes'] else 'wb') as f:
+        f.truncate(state['bytes'])
+        f.seek(state['bytes'])
+        if fmt == 'csv' and not state['bytes']:
+            f.write(encode_rows(fmt, exporter.fields, [], header=True))
+        while True:
+            key, rows = exporter.page(where, state['key'], batch_size)
+            if not rows:
+                break
+            f.write(encode_rows(fmt, exporter.fields, rows))
+            f.flush()
+            os.fsync(f.fileno())
+            state.update(key=key, bytes=f.tell(), rows=state['rows'] + len(rows))
+            checkpoint.save(state)
+    return state['rows']
+
+
+def export(exporter, path, fmt, batch_size=5000, workers=1, restart=False):
+    """
+    Export everything to ``path``. With several workers each one writes a
+    key range to ``<path>.part<n>`` (resumable on its own), and the parts are
+    joined in key order at the end.
+    """
+    if workers <= 1:
+        rows = export_part(exporter, path, fmt, Q(), batch_size, restart)
+        Checkpoint(path).clear()
+        return rows
+
+    parts = [(f'{path}.part{i}', where) for i, where in enumerate(exporter.partitions(workers))]
+    close_connections()
+    with ProcessPoolExecutor(len(parts), initializer=close_connections) as pool:
+        futures = [
+            pool.submit(export_part, exporter, part, fmt, where, batch_size, restart)
+            for part, where in parts
+        ]
+        rows = sum(future.result() for future in futures)
+
+    with open(path, 'wb') as out:
+        for i, (part, _) in enumerate(parts):
+            with open(part, 'rb') as f:
+                if fmt == 'csv' and i:
+                    f.readline()
+                shutil.copyfileobj(f, out)
+    for part, _ in parts:
+        os.remove(part)
+        Checkpoint(part).clear()
+    return rows
+
+
+class ExportCommand(BaseCommand):
+    exporter_class = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1, help='processes, each exporting a key range')
+        parser.add_argument('--restart', action='store_true', help='ignore a checkpoint left by an earlier run')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        start = time.perf_counter()
+        exporter = self.exporter_class()
+        rows = export(
+            exporter, path, fmt,
+            options['batch_size'], options['workers'], options['restart'],
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {rows} rows to {path} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s).'
+        ))
+        skipped = exporter.skipped()
+        if skipped:
+            self.stderr.write(self.style.WARNING(f'Skipped {skipped} rows that could not be imported back.'))
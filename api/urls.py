@@ -1,16 +1,22 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 from rest_framework.routers import DefaultRouter
 
 urlpatterns = [
-    path('products/', views.ProductListCreateAPIView.as_view()),
+    path('products/', views.ProductListCreateAPIView.as_view(), name='product-list'),
     # path('products/create/', views.ProductCreateAPIView.as_view()),
-    path('products/info/', views.ProductInfoAPIView.as_view()),
+    path('products/info/', views.ProductInfoAPIView.as_view(), name='product-info'),
     # path('products/<int:pk>', views.ProductDetailAPIView.as_view()),
-    path('products/<int:product_id>/', views.ProductDetailAPIView.as_view()),
+    path('products/<int:product_id>/', views.ProductDetailAPIView.as_view(), name='product-detail'),
     # path('orders/', views.OrderListAPIView.as_view()),
     # path('user-orders/', views.UserOrderListAPIView.as_view(), name='user-orders'),
     path('users/', views.UserListView.as_view(), name='user-list'),
+    # async (ASGI) variants of the read endpoints
+    path('async/products/', async_views.AsyncProductListAPIView.as_view(), name='async-product-list'),
+    path('async/products/<int:product_id>/', async_views.AsyncProductDetailAPIView.as_view(), name='async-product-detail'),
+    path('async/orders/', async_views.AsyncOrderListAPIView.as_view(), name='async-order-list'),
+    path('async/orders/<uuid:pk>/', async_views.AsyncOrderDetailAPIView.as_view(), name='async-order-detail'),
+    path('stats/connections/', views.ConnectionStatsAPIView.as_view(), name='connection-stats'),
 
 ]
 
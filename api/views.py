@@ -1,37 +1,53 @@
-import time
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-
-from django.db.models import Max
+from django.db import DatabaseError, transaction
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
-from rest_framework import filters, generics, viewsets
+from rest_framework import filters, generics, status, viewsets
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import (LimitOffsetPagination,
                                        PageNumberPagination)
-from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.budget import QueryBudgetMixin
+from api.cache import cache_response, filter_params, order_scopes, product_scopes
+from api.compiled import CompiledListModelMixin
+from api.conditional import (check_write_preconditions, not_modified_response,
+                             product_etag, product_validators)
+from api.connections import connection_stats
 from api.filters import InStockFilterBackend, OrderFilter, ProductFilter
 from api.models import Order, OrderItem, Product, User
-from api.serializers import (OrderSerializer, ProductInfoSerializer,
+from api.outbox import enqueue_order_confirmations
+from api.search import FullTextSearchFilter
+from api.stats import get_product_stats
+from api.streaming import StreamingListModelMixin
+from api.fieldsets import SparseFieldsetMixin
+from api.replicas import ReplicaReadMixin
+from api.pagination import OrderKeysetPagination, ProductInfoPagination, ProductKeysetPagination
+from api.serializers import (CompiledOrderSerializer, CompiledProductSerializer,
+                             OrderItemListSerializer, OrderSerializer, ProductInfoSerializer,
                              ProductSerializer, OrderCreateSerializer, UserSerializer)
 
-from api.tasks import send_order_confirmation_email
-
 
-class ProductListCreateAPIView(generics.ListCreateAPIView):
+class ProductListCreateAPIView(QueryBudgetMixin, ReplicaReadMixin, StreamingListModelMixin, CompiledListModelMixin, SparseFieldsetMixin, generics.ListCreateAPIView):
     # queryset = Product.objects.all()
     queryset = Product.objects.order_by('pk')
     serializer_class = ProductSerializer
+    # list() renders straight from .values() rows
+    compiled_serializer_class = CompiledProductSerializer
+    max_queries = 5
+    max_db_time_ms = 200
+    max_duration_ms = 1000
     # filterset_fields = ['name', 'price']
     filterset_class = ProductFilter
     filter_backends = [
         DjangoFilterBackend, 
-        filters.SearchFilter, 
+        # full-text index instead of icontains scans, see api/search.py
+        FullTextSearchFilter,
         filters.OrderingFilter, 
         InStockFilterBackend,
         ]
@@ -41,16 +57,17 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
     ordering_fields = ['name', 'price', 'stock']
 
     # offset is controlled by the settings, PAGE_SIZE
-    pagination_class = None #LimitOffsetPagination
-
-    @method_decorator(cache_page(60 * 15, key_prefix='product_list'))
+    # pagination_class = None #LimitOffsetPagination
+    # keyset pagination, only used when ?cursor= or ?page_size= is passed
+    pagination_class = ProductKeysetPagination
+    # cached responses are filled from the primary right after a product write
+    replica_scopes = staticmethod(product_scopes)
+
+    # versioned cache, invalidated from api.signals when a product changes
+    @cache_response(60 * 15, key_prefix='product_list', scopes=product_scopes)
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-    def get_queryset(self):
-        time.sleep(2)
-        return super().get_queryset()
-
     def get_permissions(self):
         self.permission_classes = [AllowAny]
         if self.request.method == 'POST':
@@ -59,10 +76,65 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
 
 
 
-class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+class ProductDetailAPIView(QueryBudgetMixin, ReplicaReadMixin, SparseFieldsetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     lookup_url_kwarg = 'product_id'
+    replica_scopes = staticmethod(product_scopes)
+    max_queries = 5
+    # the savepoint, the write, the search index sync and reading back the version
+    method_max_queries = {'PUT': 9, 'PATCH': 9, 'DELETE': 9}
+    max_db_time_ms = 100
+
+    def get(self, request, *args, **kwargs):
+        # ETag/Last-Modified from the product's version; a matching
+        # If-None-Match/If-Modified-Since gets a 304 straight from the cache
+        validators = product_validators(kwargs['product_id'])
+        if validators is None:
+            return self.get_cached(request, *args, **kwargs)
+        etag = product_etag(request, kwargs['product_id'], validators[0])
+        response = not_modified_response(request, etag, validators[1])
+        if response is None:
+            response = self.get_cached(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(validators[1])
+        return response
+
+    @cache_response(60 * 15, key_prefix='product_detail', scopes=product_scopes)
+    def get_cached(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    # If-Match / If-Unmodified-Since on writes: optimistic concurrency for admin edits.
+    # Writes load the product with select_for_update, so the preconditions are
+    # checked against a row that stays locked until the write commits.
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            queryset = queryset.select_for_update()
+        return queryset
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().update(request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().destroy(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        self.check_write_preconditions(serializer.instance)
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        self.check_write_preconditions(instance)
+        instance.delete()
+
+    def check_write_preconditions(self, instance):
+        check_write_preconditions(
+            self.request, product_etag(self.request, instance.pk, instance.version),
+            int(instance.updated_at.timestamp()),
+        )
 
     def get_permissions(self):
         self.permission_classes = [AllowAny]
@@ -79,28 +151,57 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 #         print(request.data)
 #         return super().create(request, *args, **kwargs) 
 
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.prefetch_related('items__product')
+class OrderViewSet(QueryBudgetMixin, ReplicaReadMixin, StreamingListModelMixin, CompiledListModelMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.all()
+    # the totals join and the items prefetch, skipped when ?fields=/?omit= leaves them out
+    field_querysets = {'total_price': 'with_totals', 'item_count': 'with_totals', 'items': 'with_items'}
     serializer_class = OrderSerializer
+    compiled_serializer_class = CompiledOrderSerializer
     permission_classes = [IsAuthenticated]
     # we can override the default pagination class
-    pagination_class = None
+    # keyset pagination on (created_at, order_id), opt-in via ?cursor= / ?page_size=
+    pagination_class = OrderKeysetPagination
     filterset_class = OrderFilter
     filter_backends = [DjangoFilterBackend]
-
-    @method_decorator(cache_page(60 * 15, key_prefix='order_list'))
+    max_batch_size = 500
+    # after placing or changing an order the user reads their orders from the primary
+    sticky_writes = True
+    replica_scopes = staticmethod(order_scopes)
+    max_queries = 12
+    # writes reserve or release stock and write the outbox in the same transaction
+    method_max_queries = {'POST': 13, 'PUT': 21, 'PATCH': 13, 'DELETE': 13}
+    max_db_time_ms = 200
+
+    def get_query_budget(self):
+        if self.action == 'batch':
+            # scales with the batch, bounded by max_batch_size instead
+            return None, None, None
+        return super().get_query_budget()
+
+    # keyed on the user (or staff), the OrderFilter params and the data version
+    @cache_response(60 * 15, key_prefix='order_list', scopes=order_scopes, params=filter_params, etag=True)
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    @cache_response(60 * 15, key_prefix='order_detail', scopes=order_scopes, etag=True)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        order = serializer.save(user=self.request.user)
-        # schedule the task
-        send_order_confirmation_email.delay(order.order_id, self.request.user.email)
+        with transaction.atomic():
+            order = serializer.save(user=self.request.user)
+            # sent by the outbox relay once committed, not on the request thread
+            enqueue_order_confirmations([(order.order_id, self.request.user.email)])
 
+    def perform_destroy(self, instance):
+        # the stock held by the order goes back with it
+        with transaction.atomic():
+            Product.objects.release_stock(instance.reserved_quantities())
+            instance.delete()
 
     def get_serializer_class(self):
         # can also check if POST: if self.request.method == 'POST':
-        if self.action == 'create' or self.action == 'update':
+        if self.action in ('create', 'update', 'batch'):
             return OrderCreateSerializer
         return super().get_serializer_class() # OrderSerializer
 
@@ -116,9 +217,64 @@ class OrderViewSet(viewsets.ModelViewSet):
             )
     def user_orders(self, request):
         orders = self.get_queryset().filter(user=request.user)
+        if self.should_stream(request):
+            return self.streaming_response(orders)
         serializer = self.get_serializer(orders, many=True)
         return Response(serializer.data)
 
+    @action(
+            detail=False,
+            methods=['POST'],
+            url_path='batch',
+            )
+    def batch(self, request):
+        # validate and create many orders in one request, one savepoint per order
+        entries = request.data
+        if not isinstance(entries, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of orders.']})
+        if len(entries) > self.max_batch_size:
+            raise ValidationError({'non_field_errors': [f'At most {self.max_batch_size} orders per batch.']})
+
+        # resolve the products of every order with a single query
+        context = self.get_serializer_context()
+        context['products'] = OrderItemListSerializer.fetch_products(
+            item for entry in entries
+            if isinstance(entry, dict) and isinstance(entry.get('items'), list)
+            for item in entry['items']
+        )
+
+        results = []
+        created = []
+        with transaction.atomic():
+            for index, entry in enumerate(entries):
+                serializer = OrderCreateSerializer(data=entry, context=context)
+                if not serializer.is_valid():
+                    results.append({'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+                    continue
+                try:
+                    with transaction.atomic():
+                        order = serializer.save(user=request.user)
+                except ValidationError as exc:
+                    # e.g. not enough stock left for this order
+                    results.append({'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': exc.detail})
+                    continue
+                except DatabaseError as exc:
+                    results.append({'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': {'non_field_errors': [str(exc)]}})
+                    continue
+                created.append(order.order_id)
+                results.append({'index': index, 'status': status.HTTP_201_CREATED, 'order_id': order.order_id})
+
+            # one outbox insert for the whole batch
+            enqueue_order_confirmations((order_id, request.user.email) for order_id in created)
+
+        if len(created) == len(entries):
+            response_status = status.HTTP_201_CREATED
+        elif not created:
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response({'results': results}, status=response_status)
+
 
 
 # class OrderListAPIView(generics.ListCreateAPIView):
@@ -138,20 +294,33 @@ class OrderViewSet(viewsets.ModelViewSet):
 
 # this is good for collecting data or retruning that data
 # refer to here - https://www.youtube.com/watch?v=TVFCU0w65Ak&list=PL-2EBeDYMIbTLulc9FSoAXhbmXpLq2l5t&index=9
-class ProductInfoAPIView(APIView):
-    def get(self, request):
-        products = Product.objects.all()
-        serializer = ProductInfoSerializer({
-            'products': products,
-            'count': len(products),
-            'max_price': products.aggregate(max_price=Max('price'))['max_price']
-        })
-        return Response(serializer.data)
-
+class ProductInfoAPIView(ReplicaReadMixin, APIView):
+    pagination_class = ProductInfoPagination
 
-class UserListView(generics.ListAPIView):
+    def get(self, request):
+        # stats come from one aggregate query, cached and updated on product writes
+        info = get_product_stats()
+        paginator = None
+        if request.query_params.get('products') in ('true', '1'):
+            paginator = self.pagination_class()
+            info['products'] = paginator.paginate_queryset(Product.objects.all(), request, view=self)
+        serializer = ProductInfoSerializer(info)
+        data = serializer.data
+        if paginator is not None:
+            data['next'] = paginator.get_next_link()
+            data['previous'] = paginator.get_previous_link()
+        return Response(data)
+
+
+class UserListView(ReplicaReadMixin, StreamingListModelMixin, SparseFieldsetMixin, generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = None
 
 
+class ConnectionStatsAPIView(APIView):
+    # database/redis pool usage of this process, for dashboards and capacity planning
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(connection_stats())
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drf_course.settings')
 
+# persistent connections are per thread, and under ASGI sync code runs on
+# threads that come and go, so Django's docs say to turn them off here (the
+# psycopg pool used on postgres is fine)
+for database in settings.DATABASES.values():
+    database['CONN_MAX_AGE'] = 0
+
 application = get_asgi_application()
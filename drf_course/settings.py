@@ -1,3 +1,4 @@
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -34,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so latency covers the whole middleware stack
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -41,7 +44,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'silk.middleware.SilkyMiddleware',
+    'api.profiling.SampledSilkyMiddleware',
 ]
 
 ROOT_URLCONF = 'drf_course.urls'
@@ -72,9 +75,39 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # read replica, a second sqlite file locally: after `migrate --database=replica`
+    # copy db.sqlite3 over it whenever you want it to "catch up"
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+    },
 }
 
+# persistent connections: each worker thread keeps its connection for up to
+# CONN_MAX_AGE seconds instead of reconnecting on every request, and pings it
+# before reusing it. On postgres a psycopg pool is used instead (Django
+# doesn't allow both), sized by DATABASE_POOL. WSGI only: drf_course.asgi
+# turns CONN_MAX_AGE off again.
+DATABASE_CONN_MAX_AGE = 60
+DATABASE_POOL = {'min_size': 2, 'max_size': 10, 'timeout': 10}
+
+for _database in DATABASES.values():
+    _database.setdefault('CONN_HEALTH_CHECKS', True)
+    if _database['ENGINE'] == 'django.db.backends.postgresql':
+        _database.setdefault('OPTIONS', {}).setdefault('pool', DATABASE_POOL)
+        _database['CONN_MAX_AGE'] = 0
+    else:
+        _database.setdefault('CONN_MAX_AGE', DATABASE_CONN_MAX_AGE)
+
+# reads from views using api.replicas.ReplicaReadMixin go to one of these;
+# add 'replica' to try it out, empty means everything hits the primary
+DATABASE_ROUTERS = ['api.replicas.PrimaryReplicaRouter']
+DATABASE_REPLICAS = []
+# how long reads stay on the primary after a write: the writer's own reads, and
+# everyone's reads of the cache scopes it bumped (replica lag)
+REPLICA_STICKY_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -123,10 +156,23 @@ AUTH_USER_MODEL = 'api.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication with cached token validation and user lookups
+        'api.authentication.CachedJWTAuthentication',
         # fallback for the admin UI site.
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # orjson for JSON; MessagePack too when the optional msgpack package is installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        *(['api.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        *(['api.parsers.MessagePackParser'] if find_spec('msgpack') else []),
+    ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -141,18 +187,73 @@ SPECTACULAR_SETTINGS = {
     # OTHER SETTINGS
 }
 
+REDIS_URL = 'redis://127.0.0.1:6379/1'
+
+# one pool per process shared by the cache and the Celery producer (api.connections)
+REDIS_POOL = {
+    'max_connections': 50,
+    'socket_connect_timeout': 2,
+    'socket_timeout': 2,
+    'health_check_interval': 30,
+}
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://127.0.0.1:6379/1",
+        "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CONNECTION_FACTORY": "api.connections.SharedConnectionFactory",
         }
     }
 }
 
-CELERY_BROKER_URL = 'redis://127.0.0.1:6379/1'
-
-CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/1'
-
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+CELERY_BROKER_URL = REDIS_URL
+CELERY_BROKER_TRANSPORT = 'api.connections:SharedPoolTransport'
+CELERY_BROKER_POOL_LIMIT = 10
+
+CELERY_RESULT_BACKEND = REDIS_URL
+CELERY_REDIS_MAX_CONNECTIONS = REDIS_POOL['max_connections']
+CELERY_REDIS_BACKEND_HEALTH_CHECK_INTERVAL = REDIS_POOL['health_check_interval']
+
+# Transactional outbox (api/outbox.py): messages taken per relay round and
+# confirmation emails per task, each task sending over one SMTP connection.
+OUTBOX_RELAY_BATCH_SIZE = 500
+OUTBOX_EMAIL_BATCH_SIZE = 100
+
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# Per-view query budgets (api.budget.QueryBudgetMixin): when True, a request
+# that goes over its budget raises instead of only logging a warning. With
+# QUERY_BUDGET_ENFORCE_TIMINGS off only the query count raises, the DB and
+# wall time budgets are logged.
+QUERY_BUDGET_ENFORCE = False
+QUERY_BUDGET_ENFORCE_TIMINGS = True
+
+# manage.py test runs with query budgets enforced and profiling off
+TEST_RUNNER = 'drf_course.test_runner.TestRunner'
+
+# Silk profiling (api.profiling.SampledSilkyMiddleware): the share of requests
+# recorded, and the header that records a request with full detail. Set
+# PROFILING_TRACE_TOKEN in production, or anyone can ask for a trace.
+PROFILING_SAMPLE_RATE = 0.01
+PROFILING_TRACE_HEADER = 'X-Profile'
+PROFILING_TRACE_TOKEN = None
+PROFILING_MAX_QUERIES = 200
+# records are buffered in memory and written in bulk every PROFILING_FLUSH_INTERVAL
+# seconds or PROFILING_FLUSH_SIZE records (0 disables the background flush)
+PROFILING_BUFFER_SIZE = 1000
+PROFILING_FLUSH_SIZE = 100
+PROFILING_FLUSH_INTERVAL = 5
+SILKY_MIDDLEWARE_CLASS = 'api.profiling.SampledSilkyMiddleware'
+
+# Prometheus metrics (api.metrics) served at /metrics. When METRICS_TOKEN is
+# set, scrapers must send it as "Authorization: Bearer <token>". Run gunicorn
+# with PROMETHEUS_MULTIPROC_DIR set to aggregate all the workers.
+METRICS_TOKEN = None
+
+# api.authentication.CachedJWTAuthentication: validated access tokens kept per
+# process (at most JWT_TOKEN_CACHE_SIZE, for JWT_TOKEN_CACHE_TTL seconds), users
+# kept in the default cache and dropped whenever they are saved.
+JWT_TOKEN_CACHE_SIZE = 10000
+JWT_TOKEN_CACHE_TTL = 60
+JWT_USER_CACHE_TIMEOUT = 60 * 5
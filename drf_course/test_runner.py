@@ -0,0 +1,25 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    DiscoverRunner applying the settings every test runs with: going over a
+    query budget fails the test (the time budgets depend on the machine, so
+    they only log), and profiling samples nothing and runs no background
+    flush thread, whose writes would land outside the test transactions.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(
+            QUERY_BUDGET_ENFORCE=True,
+            QUERY_BUDGET_ENFORCE_TIMINGS=False,
+            PROFILING_SAMPLE_RATE=0,
+            PROFILING_FLUSH_INTERVAL=0,
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)